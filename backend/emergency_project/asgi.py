@@ -1,5 +1,31 @@
 import os
+import threading
 from django.core.asgi import get_asgi_application
 
+# ASGI configuration for uvicorn (alone or as gunicorn workers, see start.sh)
+# With ASYNC_READ_VIEWS the read endpoints run as async views on the worker's event loop
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emergency_project.settings')
-application = get_asgi_application()
\ No newline at end of file
+application = get_asgi_application()
+
+# Lets availability event streams end when their client disconnects
+from services.availability import DisconnectWatcher  # noqa: E402
+application = DisconnectWatcher(application)
+
+# Same per-worker warm-up as wsgi.py. It queries the database, which Django refuses on a
+# thread with a running event loop (plain `uvicorn` imports the app inside its loop), so
+# it runs on a short-lived thread
+from services.spatial_index import warm_index  # noqa: E402
+from services.gazetteer import get_gazetteer  # noqa: E402
+from services.routing import warm_ranker  # noqa: E402
+
+
+def warm_up():
+    warm_index()
+    get_gazetteer()
+    warm_ranker()
+
+
+warm_up_thread = threading.Thread(target=warm_up, name='warm-up')
+warm_up_thread.start()
+warm_up_thread.join()
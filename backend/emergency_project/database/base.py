@@ -0,0 +1,58 @@
+from django.contrib.gis.db.backends.postgis.base import DatabaseWrapper as PostGISDatabaseWrapper
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from .pool import PreparedStatementConnection, get_pool
+
+# PostGIS backend (ENGINE 'emergency_project.database') with two additions:
+# - connections remember their prepared statements (see services/prepared.py)
+# - with POOL_SIZE set, connections come from and go back to a per-process pool instead
+#   of being opened and closed by every thread. Under ASGI each request runs its sync code
+#   on a new thread, so Django's own persistent connections (CONN_MAX_AGE) would open one
+#   connection per request; the pool keeps them open across threads
+# Extra keys in the DATABASES entry: POOL_SIZE (0 disables the pool), POOL_TIMEOUT (seconds
+# to wait for a free connection) and CONN_HEALTH_CHECKS (ping pooled connections that have
+# been idle for a while before reusing them)
+
+# Pooled connections idle for longer than this are pinged before reuse
+POOL_CHECK_AFTER = 30
+
+
+class DatabaseWrapper(PostGISDatabaseWrapper):
+    """PostGIS database wrapper with an optional per-process connection pool."""
+
+    def get_pool(self):
+        size = self.settings_dict.get('POOL_SIZE')
+        if not size:
+            return None
+        check_after = POOL_CHECK_AFTER if self.settings_dict.get('CONN_HEALTH_CHECKS') else None
+        return get_pool(
+            self.alias, self.settings_dict['NAME'], size, self.settings_dict.get('POOL_TIMEOUT', 10), check_after
+        )
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.setdefault('connection_factory', PreparedStatementConnection)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool()
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        connection = pool.get(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        # Set by get_new_connection() for new connections; a reused one still needs it
+        self.isolation_level = IsolationLevel(
+            self.settings_dict['OPTIONS'].get('isolation_level', IsolationLevel.READ_COMMITTED)
+        )
+        return connection
+
+    def _close(self):
+        pool = self.get_pool()
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            # Closed inside atomic(): Django keeps the connection object until the block
+            # exits, so it cannot be handed to another thread
+            if self.in_atomic_block:
+                pool.discard(self.connection)
+            else:
+                pool.put(self.connection)
@@ -0,0 +1,104 @@
+import collections
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PreparedStatementConnection(extensions.connection):
+    """psycopg2 connection remembering which server-side statements it has prepared."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+class ConnectionPool:
+    """Open database connections shared by the threads of one worker process."""
+
+    def __init__(self, size, timeout, check_after):
+        self.size = size
+        self.timeout = timeout
+        # Idle connections older than this are pinged before reuse; None never pings
+        self.check_after = check_after
+        self.slots = threading.BoundedSemaphore(size)
+        # Most recently returned last: reuse pops from the right, so a quiet worker keeps
+        # using a few warm connections and the rest age at the left
+        self.idle = collections.deque()
+
+    # An open connection: an idle one if any is usable, else a new one from `connect`.
+    # Waits up to `timeout` seconds while all `size` connections are checked out
+    def get(self, connect):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise psycopg2.OperationalError(
+                f'No free database connection after {self.timeout}s (pool of {self.size} per process)'
+            )
+        try:
+            while True:
+                try:
+                    connection, idle_since = self.idle.pop()
+                except IndexError:
+                    return connect()
+                if self.is_usable(connection, idle_since):
+                    return connection
+                connection.close()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def is_usable(self, connection, idle_since):
+        if connection.closed:
+            return False
+        if self.check_after is None or time.monotonic() - idle_since < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    # Return a checked-out connection. An open transaction is rolled back so the next user
+    # starts clean; a connection in an unknown state (mid-query, broken) is closed instead
+    def put(self, connection):
+        try:
+            status = connection.get_transaction_status()
+            if status in (extensions.TRANSACTION_STATUS_INTRANS, extensions.TRANSACTION_STATUS_INERROR):
+                connection.rollback()
+                status = extensions.TRANSACTION_STATUS_IDLE
+            if status == extensions.TRANSACTION_STATUS_IDLE and not connection.closed:
+                self.idle.append((connection, time.monotonic()))
+            else:
+                connection.close()
+        except psycopg2.Error:
+            connection.close()
+        finally:
+            self.slots.release()
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        finally:
+            self.slots.release()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# The pool of one database in this process, by alias and database name (the test runner
+# renames the database of an alias). Keyed by pid as well, so a worker forked from a
+# process that already had a pool never shares its parent's sockets
+def get_pool(alias, name, size, timeout, check_after):
+    key = (alias, name, os.getpid())
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(size, timeout, check_after)
+    return pool
@@ -1,5 +1,5 @@
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Get base directory of the project (parent of settings.py)
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,6 +43,32 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware', # Clickjacking protection
 ]
 
+# Per-request phase timings: Server-Timing header (db, serialize, render, external, app),
+# a JSON log line per slow request and EXPLAIN ANALYZE of slow queries (services logger)
+# Off by default; when off the middleware and query hook are not installed at all
+REQUEST_TIMING = config('REQUEST_TIMING', default=False, cast=bool)
+REQUEST_TIMING_LOG_MS = config('REQUEST_TIMING_LOG_MS', default=100, cast=float) # Log requests this slow; 0 = all
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=100, cast=float) # Log and explain queries this slow; 0 = off
+SLOW_QUERY_EXPLAIN_INTERVAL = config('SLOW_QUERY_EXPLAIN_INTERVAL', default=300, cast=int) # Seconds between plans of one statement
+if REQUEST_TIMING:
+    # Ahead of the other middleware, so the total covers them too
+    MIDDLEWARE.insert(0, 'services.timing.RequestTimingMiddleware')
+
+# Prometheus metrics at /metrics (needs prometheus_client): request latency per endpoint
+# action and service type, within_radius result counts, geocoding provider latency and
+# outcomes, database connections and queries. Off unless enabled: start.sh and the compose
+# file turn it on and start.sh sets PROMETHEUS_MULTIPROC_DIR so the Gunicorn workers'
+# samples are summed
+METRICS_ENABLED = config('METRICS_ENABLED', default=False, cast=bool)
+if METRICS_ENABLED:
+    MIDDLEWARE.insert(0, 'services.metrics.MetricsMiddleware')
+
+# Serve nearest, within_radius, by_type, statistics and geocode from async views
+# Experimental: only measured for slow geocoding; WhiteNoise is sync-only and database
+# work runs in sync_to_async, so database-bound reads gain little (see the README)
+# Only worthwhile under an ASGI server; start.sh sets it with SERVER_INTERFACE=asgi
+ASYNC_READ_VIEWS = config('ASYNC_READ_VIEWS', default=False, cast=bool)
+
 # Root URL configuration module
 ROOT_URLCONF = 'emergency_project.urls'
 
@@ -67,15 +93,39 @@ TEMPLATES = [
 WSGI_APPLICATION = 'emergency_project.wsgi.application'
 
 
+# Database connection handling (see README "Database Connections")
+# DATABASE_POOL: '' keeps one persistent connection per thread for DATABASE_CONN_MAX_AGE
+# seconds; 'process' shares a pool of DATABASE_POOL_SIZE open connections between the
+# threads of each worker (start.sh uses it under ASGI, where every request gets a new
+# thread); 'pgbouncer' connects through the PgBouncer sidecar in transaction pooling mode
+DATABASE_POOL = config('DATABASE_POOL', default='')
+DATABASE_CONN_MAX_AGE = config('DATABASE_CONN_MAX_AGE', default=60, cast=int) # Seconds; 0 closes after each request
+DATABASE_CONN_HEALTH_CHECKS = config('DATABASE_CONN_HEALTH_CHECKS', default=True, cast=bool) # Check reused connections
+DATABASE_POOL_SIZE = config('DATABASE_POOL_SIZE', default=10, cast=int) # Connections per worker process
+DATABASE_POOL_TIMEOUT = config('DATABASE_POOL_TIMEOUT', default=10, cast=float) # Seconds to wait for a free one
+# Prepare the nearest/within_radius queries once per connection; not possible behind
+# PgBouncer, which may run each transaction on a different server connection. Off until
+# its gain is measured on the deployment's data (manage.py bench, see the README)
+DATABASE_PREPARED_STATEMENTS = (
+    config('DATABASE_PREPARED_STATEMENTS', default=False, cast=bool) and DATABASE_POOL != 'pgbouncer'
+)
+
 # Database configuration - PostgreSQL with PostGIS extension
 DATABASES = {
     'default': {
-        'ENGINE': 'django.contrib.gis.db.backends.postgis', # PostGIS spatial database
+        'ENGINE': 'emergency_project.database', # PostGIS backend with an optional connection pool
         'NAME': config('DATABASE_NAME', default='emergency_db'),
         'USER': config('DATABASE_USER', default='postgres'),
         'PASSWORD': config('DATABASE_PASSWORD', default='postgres123'),
         'HOST': config('DATABASE_HOST', default='postgis'), # Docker service name
         'PORT': config('DATABASE_PORT', default='5432'),
+        # With the process pool Django hands the connection back at the end of each request
+        'CONN_MAX_AGE': 0 if DATABASE_POOL == 'process' else DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DATABASE_CONN_HEALTH_CHECKS,
+        'POOL_SIZE': DATABASE_POOL_SIZE if DATABASE_POOL == 'process' else 0,
+        'POOL_TIMEOUT': DATABASE_POOL_TIMEOUT,
+        # Named cursors do not survive transaction pooling; iterator() then fetches client-side
+        'DISABLE_SERVER_SIDE_CURSORS': DATABASE_POOL == 'pgbouncer',
     }
 }
 
@@ -110,13 +160,134 @@ CORS_ALLOW_ALL_ORIGINS = True
 # Django REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer', # JSON response format
+        'services.renderers.FastJSONRenderer', # JSON response format (orjson when installed)
         'rest_framework.renderers.BrowsableAPIRenderer', # HTML browsable API
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination', # Page-based pagination
     'PAGE_SIZE': 100 # Items per page
 }
 
+# Shared caches for vector tiles, statistics, the data-version counter and geocode results
+# File-based by default so every gunicorn worker in a container sees the same entries
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'cache')),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    # The data-version counter alone: a FileBasedCache over MAX_ENTRIES deletes a random
+    # share of its files, and losing the counter would invalidate every tile, statistic and
+    # ETag and make every worker rebuild its in-memory index. It holds one key, so it is
+    # never culled
+    'state': {
+        'BACKEND': config('STATE_CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('STATE_CACHE_LOCATION', default=str(BASE_DIR / 'cache' / 'state')),
+        'TIMEOUT': None,
+    },
+    # Separate store for geocode results so tile churn never evicts them
+    'geocode': {
+        'BACKEND': config('GEOCODE_CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('GEOCODE_CACHE_LOCATION', default=str(BASE_DIR / 'cache' / 'geocode')),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# Seconds to keep a statistics payload (it is also invalidated by any data change)
+STATISTICS_CACHE_TIMEOUT = config('STATISTICS_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Geocoding cache: per-process LRU in front of the shared 'geocode' cache
+GEOCODE_CACHE_MAX_ENTRIES = config('GEOCODE_CACHE_MAX_ENTRIES', default=2048, cast=int) # LRU size per worker
+GEOCODE_CACHE_TTL = config('GEOCODE_CACHE_TTL', default=7 * 24 * 3600, cast=int) # Seconds to keep found addresses
+GEOCODE_CACHE_NEGATIVE_TTL = config('GEOCODE_CACHE_NEGATIVE_TTL', default=3600, cast=int) # Seconds to keep "not found"
+
+# Cache-Control max-age for conditional API reads (ETag/Last-Modified follow the data version)
+# Lets nginx micro-cache responses; browsers revalidate with If-None-Match after it expires
+API_CACHE_MAX_AGE = config('API_CACHE_MAX_AGE', default=5, cast=int)
+
+# Vector tiles (/api/tiles/{z}/{x}/{y}.mvt)
+TILE_CACHE_TIMEOUT = config('TILE_CACHE_TIMEOUT', default=3600, cast=int) # Server-side cache lifetime
+TILE_HTTP_MAX_AGE = config('TILE_HTTP_MAX_AGE', default=60, cast=int) # Browser Cache-Control max-age
+TILE_CLUSTER_MAX_ZOOM = config('TILE_CLUSTER_MAX_ZOOM', default=11, cast=int) # Cluster at this zoom and below
+TILE_CLUSTER_GRID = config('TILE_CLUSTER_GRID', default=16, cast=int) # Cluster cells per tile side
+
+# Remote geocoding providers (URLs are configurable so tests can point at a stub server)
+GEOCODE_OPENCAGE_URL = config('GEOCODE_OPENCAGE_URL', default='https://api.opencagedata.com/geocode/v1/json')
+GEOCODE_NOMINATIM_URL = config('GEOCODE_NOMINATIM_URL', default='https://nominatim.openstreetmap.org/search')
+GEOCODE_PROVIDER_TIMEOUT = config('GEOCODE_PROVIDER_TIMEOUT', default=5.0, cast=float) # Seconds per provider call
+GEOCODE_HEDGE_DELAY_MS = config('GEOCODE_HEDGE_DELAY_MS', default=800, cast=int) # Start fallback if primary is slower
+GEOCODE_POOL_SIZE = config('GEOCODE_POOL_SIZE', default=10, cast=int) # Keep-alive connections per host
+GEOCODE_MAX_CONCURRENCY = config('GEOCODE_MAX_CONCURRENCY', default=8, cast=int) # Provider calls in flight per worker
+GEOCODE_BREAKER_FAILURES = config('GEOCODE_BREAKER_FAILURES', default=5, cast=int) # Consecutive failures to open
+GEOCODE_BREAKER_RESET = config('GEOCODE_BREAKER_RESET', default=30, cast=int) # Seconds before a trial call
+
+# Local gazetteer used for autocomplete and offline geocoding (CSV: name,kind,county,lat,lng,population)
+GAZETTEER_ENABLED = config('GAZETTEER_ENABLED', default=True, cast=bool)
+GAZETTEER_PATH = config('GAZETTEER_PATH', default=str(BASE_DIR / 'services' / 'data' / 'gazetteer.csv'))
+GAZETTEER_MAX_ENTRIES = config('GAZETTEER_MAX_ENTRIES', default=500000, cast=int) # Memory bound
+GAZETTEER_MAX_SUGGESTIONS = config('GAZETTEER_MAX_SUGGESTIONS', default=10, cast=int)
+
+# Spatial query backend for nearest / within_radius / by_type
+# 'database' runs PostGIS queries, 'memory' uses a per-worker KD-tree index built from the table
+SPATIAL_BACKEND = config('SPATIAL_BACKEND', default='database')
+# Seconds before a worker rebuilds its in-memory index (0 = rely on save/delete signals only)
+SPATIAL_INDEX_MAX_AGE = config('SPATIAL_INDEX_MAX_AGE', default=300, cast=int)
+# How often a worker re-reads the shared data version to notice other workers' edits; the
+# in-memory index and travel-time ranker are then refreshed in the background
+DATA_VERSION_CHECK_MS = config('DATA_VERSION_CHECK_MS', default=500, cast=int)
+
+# Coverage grid over Ireland for the memory backend: per-cell shortlists answer "nearest
+# N (N <= COVERAGE_GRID_K)" with a lookup and exact re-rank; cells are patched on edits
+COVERAGE_GRID_ENABLED = config('COVERAGE_GRID_ENABLED', default=True, cast=bool)
+COVERAGE_GRID_CELL_DEG = config('COVERAGE_GRID_CELL_DEG', default=0.1, cast=float) # About 11 x 6.7 km
+COVERAGE_GRID_K = config('COVERAGE_GRID_K', default=10, cast=int)
+COVERAGE_GRID_MAX_SHORTLIST = config('COVERAGE_GRID_MAX_SHORTLIST', default=64, cast=int)
+
+# Travel-time ranking (?rank=travel_time) over a road graph built by `manage.py build_road_graph`
+ROUTING_GRAPH_PATH = config('ROUTING_GRAPH_PATH', default=str(BASE_DIR / 'services' / 'data' / 'roads.graph'))
+ROUTING_ACCESS_SPEED_KMH = config('ROUTING_ACCESS_SPEED_KMH', default=20, cast=float) # Point to nearest road
+ROUTING_MAX_SNAP_M = config('ROUTING_MAX_SNAP_M', default=2000, cast=float) # Farther from a road = no route
+
+# Service-area isochrones (/api/services/{id}/isochrone/?minutes=), computed in the background
+ISOCHRONE_WORKERS = config('ISOCHRONE_WORKERS', default=2, cast=int) # Processes per web worker
+ISOCHRONE_MAX_MINUTES = config('ISOCHRONE_MAX_MINUTES', default=60, cast=int)
+ISOCHRONE_PRECOMPUTE_MINUTES = config('ISOCHRONE_PRECOMPUTE_MINUTES', default='8', cast=Csv(int)) # Kept current on save/import
+ISOCHRONE_CONCAVITY = config('ISOCHRONE_CONCAVITY', default=0.4, cast=float) # ST_ConcaveHull target (1 = convex)
+ISOCHRONE_FALLBACK_SPEED_KMH = config('ISOCHRONE_FALLBACK_SPEED_KMH', default=40, cast=float) # Without a road graph
+ISOCHRONE_MAX_SPEED_KMH = config('ISOCHRONE_MAX_SPEED_KMH', default=130, cast=float) # At least the fastest road; bounds /reachable/
+
+# Limits for POST /api/services/nearest/batch/
+NEAREST_BATCH_MAX_POINTS = config('NEAREST_BATCH_MAX_POINTS', default=1000, cast=int)
+NEAREST_BATCH_MAX_LIMIT = config('NEAREST_BATCH_MAX_LIMIT', default=10, cast=int)
+
+# Map viewport queries (GET /api/services/in_bbox/?bbox=&zoom=)
+IN_BBOX_MAX_RESULTS = config('IN_BBOX_MAX_RESULTS', default=500, cast=int) # More than this are sent as clusters
+IN_BBOX_CLUSTER_GRID = config('IN_BBOX_CLUSTER_GRID', default=8, cast=int) # Cluster cells per 256 px tile side
+
+# Live availability: POST /api/availability/ (reports), GET /api/availability/stream/ (server-sent
+# events, ASGI workers only) and ?rank=availability / ?min_available= on nearest and by_type
+# Publishers send "Authorization: Bearer <token>"; without a token only staff users may publish
+AVAILABILITY_PUBLISH_TOKEN = config('AVAILABILITY_PUBLISH_TOKEN', default='')
+AVAILABILITY_MAX_BATCH = config('AVAILABILITY_MAX_BATCH', default=1000, cast=int) # Reports per request
+AVAILABILITY_MAX_AGE = config('AVAILABILITY_MAX_AGE', default=300, cast=int) # Older reports count as unknown
+AVAILABILITY_POLL_INTERVAL = config('AVAILABILITY_POLL_INTERVAL', default=1.0, cast=float) # Seconds between polls per worker
+AVAILABILITY_POLL_OVERLAP = config('AVAILABILITY_POLL_OVERLAP', default=2.0, cast=float) # Seconds each poll reaches back
+AVAILABILITY_CANDIDATES = config('AVAILABILITY_CANDIDATES', default=5, cast=int) # nearest ranks limit x this many
+AVAILABILITY_STREAM_MAX_CLIENTS = config('AVAILABILITY_STREAM_MAX_CLIENTS', default=5000, cast=int) # Per worker
+AVAILABILITY_STREAM_QUEUE = config('AVAILABILITY_STREAM_QUEUE', default=64, cast=int) # Events a client may lag
+AVAILABILITY_STREAM_HEARTBEAT = config('AVAILABILITY_STREAM_HEARTBEAT', default=15, cast=int) # Seconds
+
+# Service list paging and export (GET /api/services/?cursor=&page_size= and ?stream=)
+KEYSET_MAX_PAGE_SIZE = config('KEYSET_MAX_PAGE_SIZE', default=1000, cast=int)
+STREAM_CHUNK_SIZE = config('STREAM_CHUNK_SIZE', default=2000, cast=int) # Rows per server-side cursor fetch
+
+# Delta sync (GET /api/services/changes/?since=<cursor>)
+# Overlap re-reads rows updated just before the cursor to cover in-flight transactions;
+# deletion tombstones are kept this many days, older cursors get a full snapshot
+DELTA_SYNC_OVERLAP = config('DELTA_SYNC_OVERLAP', default=5, cast=int)
+DELTA_SYNC_TOMBSTONE_DAYS = config('DELTA_SYNC_TOMBSTONE_DAYS', default=30, cast=int)
+
 # X-Frame-Options header - allow same-origin framing (required for admin-interface)
 X_FRAME_OPTIONS = 'SAMEORIGIN'
 
@@ -4,6 +4,8 @@ from django.views.generic import TemplateView
 from django.conf import settings
 from django.conf.urls.static import static
 
+from services import metrics
+
 # URL patterns for the project
 urlpatterns = [
     path('admin/', admin.site.urls), # Django admin interface
@@ -11,6 +13,10 @@ urlpatterns = [
     path('', TemplateView.as_view(template_name='index.html'), name='home'), # Home page
 ]
 
+# Prometheus scrape endpoint, summed over all worker processes (see services.metrics)
+if metrics.is_enabled():
+    urlpatterns.append(path('metrics', metrics.metrics_view, name='metrics'))
+
 # Serve static files directly in development mode
 # In production, Nginx handles static files
 if settings.DEBUG:
@@ -10,4 +10,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emergency_project.settings')
 
 # Create WSGI application object
 # This is what the web server (Gunicorn) calls to handle requests
-application = get_wsgi_application()
\ No newline at end of file
+application = get_wsgi_application()
+
+# Build the in-memory spatial index as each worker starts (no-op for the database backend)
+# and load the local gazetteer so the first autocomplete request is fast
+# The road graph (if one has been built) is loaded and every service searched up front too
+from services.spatial_index import warm_index  # noqa: E402
+from services.gazetteer import get_gazetteer  # noqa: E402
+from services.routing import warm_ranker  # noqa: E402
+warm_index()
+get_gazetteer()
+warm_ranker()
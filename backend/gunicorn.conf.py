@@ -0,0 +1,16 @@
+import os
+
+# Gunicorn loads ./gunicorn.conf.py by default; start.sh passes everything else on the
+# command line. Only the hooks live here
+
+try:
+    from prometheus_client import multiprocess
+except ImportError:
+    multiprocess = None
+
+
+# A dead worker's live gauge files are removed; its counters and histograms stay in
+# PROMETHEUS_MULTIPROC_DIR so the totals on /metrics never go backwards
+def child_exit(server, worker):
+    if multiprocess is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
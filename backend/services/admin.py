@@ -1,5 +1,5 @@
 from django.contrib.gis import admin
-from .models import EmergencyService
+from .models import EmergencyService, ServiceIsochrone
 
 
 # Admin interface configuration for EmergencyService model
@@ -24,7 +24,7 @@ class EmergencyServiceAdmin(admin.GISModelAdmin):
             'fields': ('location',), # GeoDjango map widget appears here
         }),
         ('Service Details', {
-            'fields': ('capacity', 'is_24_hours')
+            'fields': ('capacity', 'is_24_hours', 'external_id')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -42,4 +42,13 @@ class EmergencyServiceAdmin(admin.GISModelAdmin):
         if obj.location:
             return f"Lat: {obj.latitude:.4f}, Lng: {obj.longitude:.4f}"
         return "No location set"
-    get_location.short_description = "Coordinates"
\ No newline at end of file
+    get_location.short_description = "Coordinates"
+
+
+# Computed isochrones are shown read-only; they are recomputed from their service
+@admin.register(ServiceIsochrone)
+class ServiceIsochroneAdmin(admin.GISModelAdmin):
+    list_display = ['service', 'minutes', 'method', 'computed_at']
+    list_filter = ['method', 'minutes', 'service__service_type']
+    search_fields = ['service__name']
+    readonly_fields = ['service', 'minutes', 'method', 'signature', 'computed_at']
@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class ServicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'services'
\ No newline at end of file
+    name = 'services'
+
+    # Connect model signal handlers once the app registry is ready
+    def ready(self):
+        from . import signals  # noqa: F401
+        from . import metrics, timing
+
+        # Query timing for the Server-Timing header; not hooked in at all when it is off
+        if settings.REQUEST_TIMING:
+            connection_created.connect(timing.install_db_timing)
+        if metrics.is_enabled():
+            connection_created.connect(metrics.install_db_metrics)
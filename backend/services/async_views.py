@@ -0,0 +1,321 @@
+import functools
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from rest_framework import exceptions, status
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.request import Request
+
+from . import availability, geocoding, metrics, routing, spatial_index, viewport
+from .conditional import async_conditional_read
+from .renderers import COLUMNAR_RENDERERS, FastJSONRenderer
+from .rows import (
+    by_type_rows, encode_distance_rows, encode_indexed_rows, encode_travel_time_rows, nearest_rows,
+    within_radius_rows
+)
+from .statistics import aget_statistics
+from .views import RANKINGS
+
+logger = logging.getLogger(__name__)
+
+# Native async versions of the read endpoints for ASGI workers (ASYNC_READ_VIEWS). DRF views
+# are synchronous, so under ASGI each would hold a thread for its whole run; these wait on
+# the database, cache and geocoding providers without blocking the worker's event loop.
+# Payloads, errors, content negotiation and conditional requests match the viewset actions;
+# the browsable API is not offered here
+
+# Same formats as the viewset's spatial actions, minus the browsable API
+SPATIAL_RENDERERS = [FastJSONRenderer, *COLUMNAR_RENDERERS]
+JSON_RENDERERS = [FastJSONRenderer]
+
+_negotiation = DefaultContentNegotiation()
+
+
+def respond(request, data, status=status.HTTP_200_OK):
+    renderer = request.accepted_renderer
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type = f'{content_type}; charset={renderer.charset}'
+    return HttpResponse(
+        renderer.render(data, request.accepted_media_type, {}), content_type=content_type, status=status
+    )
+
+
+# Decorator for the async read views: GET/HEAD only, negotiates the renderer the way DRF
+# does (Accept header or ?format=) and records it on the request for respond()
+def read_view(renderers):
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request.accepted_renderer = FastJSONRenderer()
+            request.accepted_media_type = FastJSONRenderer.media_type
+            if request.method not in ('GET', 'HEAD'):
+                response = respond(
+                    request, {'detail': f'Method "{request.method}" not allowed.'},
+                    status=status.HTTP_405_METHOD_NOT_ALLOWED
+                )
+                response['Allow'] = 'GET, HEAD'
+                return response
+            try:
+                renderer, media_type = _negotiation.select_renderer(
+                    Request(request), [renderer() for renderer in renderers]
+                )
+            except exceptions.NotAcceptable as e:
+                return respond(request, {'detail': str(e.detail)}, status=status.HTTP_406_NOT_ACCEPTABLE)
+            request.accepted_renderer, request.accepted_media_type = renderer, media_type
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Error response for an invalid ?rank=, or for travel_time when no road graph is loaded;
+# getting the ranker may load the graph and sync it with the database, so it runs in a thread
+async def rank_error(request, rank):
+    if rank not in RANKINGS:
+        return respond(
+            request, {'error': 'Invalid rank. Choose: distance, travel_time or availability.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if rank == 'travel_time' and await sync_to_async(routing.get_ranker)() is None:
+        return respond(
+            request, {'error': 'Travel-time ranking is unavailable: no road graph is loaded.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    return None
+
+
+# In-memory searches take microseconds and run on the loop; getting the index may rebuild
+# it from the database, so that runs in a thread
+async def get_index():
+    return await sync_to_async(spatial_index.get_index)()
+
+
+@read_view(SPATIAL_RENDERERS)
+@async_conditional_read
+async def nearest(request):
+    try:
+        lat = float(request.GET.get('lat'))
+        lng = float(request.GET.get('lng'))
+        limit = int(request.GET.get('limit', 5))
+        service_type = request.GET.get('type', None)
+    except (TypeError, ValueError) as e:
+        logger.warning(f'Invalid parameters: {e}')
+        return respond(
+            request, {'error': 'Invalid parameters. Provide lat, lng as numbers.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    rank = request.GET.get('rank', 'distance')
+    error = await rank_error(request, rank)
+    if error is not None:
+        return error
+    try:
+        min_available = availability.parse_min_available(request.GET)
+    except ValueError:
+        return respond(
+            request, {'error': 'min_available must be a non-negative integer.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    live = rank == 'availability' or min_available is not None
+    candidates = limit * settings.AVAILABILITY_CANDIDATES if live else limit
+
+    if rank == 'travel_time':
+        service_types = {service_type} if service_type else None
+        ranker = await sync_to_async(routing.get_ranker)()
+        data = encode_travel_time_rows(ranker.rank(lat, lng, service_types, max(candidates, 0)))
+        if live:
+            data = await sync_to_async(availability.apply)(data, limit, min_available)
+        return respond(request, {
+            'user_location': {'lat': lat, 'lng': lng},
+            'rank': rank,
+            'count': len(data),
+            'services': data
+        })
+
+    if spatial_index.is_enabled():
+        index = await get_index()
+        data = encode_indexed_rows(index.nearest(lat, lng, candidates, service_type))
+    else:
+        data = encode_distance_rows(await sync_to_async(nearest_rows)(lat, lng, candidates, service_type))
+    # The availability copy may poll the database, so this runs in a thread
+    if live:
+        data = await sync_to_async(availability.apply)(
+            data, limit, min_available, by_availability=rank == 'availability'
+        )
+    return respond(request, {
+        'user_location': {'lat': lat, 'lng': lng},
+        'rank': rank,
+        'count': len(data),
+        'services': data
+    })
+
+
+@read_view(SPATIAL_RENDERERS)
+@async_conditional_read
+async def within_radius(request):
+    try:
+        lat = float(request.GET.get('lat'))
+        lng = float(request.GET.get('lng'))
+        radius = float(request.GET.get('radius', 5))
+        service_type = request.GET.get('type', None)
+    except (TypeError, ValueError) as e:
+        logger.warning(f'Invalid parameters: {e}')
+        return respond(
+            request, {'error': 'Invalid parameters. Provide lat, lng, radius as numbers.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if spatial_index.is_enabled():
+        index = await get_index()
+        data = encode_indexed_rows(index.within_radius(lat, lng, radius * 1000, service_type))
+    else:
+        rows = await sync_to_async(within_radius_rows)(lat, lng, radius * 1000, service_type)
+        data = encode_distance_rows(rows)
+    metrics.observe_within_radius(request, len(data))
+    return respond(request, {
+        'user_location': {'lat': lat, 'lng': lng},
+        'radius_km': radius,
+        'count': len(data),
+        'services': data
+    })
+
+
+@read_view(SPATIAL_RENDERERS)
+@async_conditional_read
+async def by_type(request):
+    try:
+        lat = float(request.GET.get('lat'))
+        lng = float(request.GET.get('lng'))
+        service_type = request.GET.get('type')
+    except (TypeError, ValueError) as e:
+        logger.warning(f'Invalid parameters: {e}')
+        return respond(
+            request, {'error': 'Invalid parameters. Provide lat, lng as numbers and type.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if service_type not in ['hospital', 'police', 'fire']:
+        return respond(
+            request, {'error': 'Invalid service type. Choose: hospital, police, or fire.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    rank = request.GET.get('rank', 'distance')
+    error = await rank_error(request, rank)
+    if error is not None:
+        return error
+    try:
+        min_available = availability.parse_min_available(request.GET)
+    except ValueError:
+        return respond(
+            request, {'error': 'min_available must be a non-negative integer.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if rank == 'travel_time':
+        ranker = await sync_to_async(routing.get_ranker)()
+        data = encode_travel_time_rows(ranker.rank(lat, lng, {service_type}))
+    elif spatial_index.is_enabled():
+        index = await get_index()
+        data = encode_indexed_rows(index.by_type(lat, lng, service_type))
+    else:
+        data = encode_distance_rows(await sync_to_async(by_type_rows)(lat, lng, service_type))
+    if rank == 'availability' or min_available is not None:
+        data = await sync_to_async(availability.apply)(
+            data, min_available=min_available, by_availability=rank == 'availability'
+        )
+    return respond(request, {
+        'user_location': {'lat': lat, 'lng': lng},
+        'service_type': service_type,
+        'rank': rank,
+        'count': len(data),
+        'services': data
+    })
+
+
+@read_view(JSON_RENDERERS)
+@async_conditional_read
+async def in_bbox(request):
+    try:
+        bbox, zoom, service_type = viewport.parse_bbox_request(request.GET)
+    except ValueError as e:
+        return respond(request, {'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows, clusters = await sync_to_async(viewport.services_in_bbox)(bbox, zoom, service_type)
+    return respond(request, viewport.bbox_payload(bbox, zoom, rows, clusters))
+
+
+# Server-sent events with the current availability reports (optionally ?type=): a snapshot
+# event on connect, then an availability event with the reports changed in each poll. Only
+# under ASGI workers, where an open stream costs a task instead of a whole worker
+async def availability_stream(request):
+    if not settings.ASYNC_READ_VIEWS:
+        return JsonResponse(
+            {'error': 'Availability streams need ASGI workers (SERVER_INTERFACE=asgi).'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    if request.method != 'GET':
+        response = JsonResponse(
+            {'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED
+        )
+        response['Allow'] = 'GET'
+        return response
+    service_type = request.GET.get('type') or None
+    if service_type and service_type not in availability.SERVICE_TYPE_KEYS:
+        return JsonResponse(
+            {'error': 'Invalid service type. Choose: hospital, police, or fire.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    feed = availability.get_feed()
+    # Subscribed before the snapshot is taken, so no report falls between the two
+    subscription = feed.subscribe(service_type)
+    if subscription is None:
+        return JsonResponse(
+            {'error': 'Too many availability streams on this worker. Try again later.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    try:
+        snapshot = await sync_to_async(feed.snapshot)(service_type)
+    except BaseException:
+        feed.unsubscribe(subscription)
+        raise
+    response = StreamingHttpResponse(
+        availability.stream_events(subscription, snapshot, request.scope.get('availability.disconnected')),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # nginx passes events on as they are written
+    return response
+
+
+@read_view(JSON_RENDERERS)
+@async_conditional_read
+async def statistics(request):
+    return respond(request, await aget_statistics())
+
+
+# Slow or failing providers only hold this request's task, never a worker
+@read_view(JSON_RENDERERS)
+async def geocode_address(request):
+    query = request.GET.get('query', '').strip()
+    if not query:
+        return respond(request, {'error': 'Query parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        result = await geocoding.ageocode(query)
+    except geocoding.GeocodingError as e:
+        logger.error(f'Geocoding failed: {e}')
+        return respond(
+            request, {'error': f'Geocoding failed: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    if result is None:
+        return respond(
+            request, {'error': 'No results found. Please try a different address.'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return respond(request, result)
@@ -0,0 +1,390 @@
+import asyncio
+import hmac
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from . import metrics
+from .models import EmergencyService, ServiceAvailability
+from .renderers import dumps
+
+logger = logging.getLogger(__name__)
+
+# Live availability: services publish free beds/units with POST /api/availability/, which
+# upserts into the unlogged ServiceAvailability table and never touches EmergencyService.
+# Each worker keeps a copy of the table (AvailabilityFeed) current by polling for recent
+# reports at most every AVAILABILITY_POLL_INTERVAL seconds: one query per worker, however
+# many streams and nearest requests it serves, and unlike LISTEN/NOTIFY it works behind
+# PgBouncer. New reports are fanned out to the worker's /api/availability/stream/ clients
+# as server-sent events and used by nearest/by_type for ?rank=availability / ?min_available=
+
+TABLE = ServiceAvailability._meta.db_table
+SERVICES_TABLE = EmergencyService._meta.db_table
+SEQUENCE = 'services_availability_seq'
+SERVICE_TYPE_KEYS = [key for key, _ in EmergencyService.SERVICE_TYPES]
+STATUS_KEYS = [key for key, _ in ServiceAvailability.STATUSES]
+MAX_AVAILABLE = 1_000_000
+# Stream path, for DisconnectWatcher (matches services/urls.py under /api/)
+STREAM_PATH = '/api/availability/stream/'
+
+# One statement per batch: reports are unnested from parallel arrays and upserted. The
+# EXISTS check reads the service row without locking it; reports for unknown services are
+# dropped and missing from RETURNING
+UPSERT_SQL = f'''
+    INSERT INTO {TABLE} (service_id, available, status, wait_minutes, updated_at, seq)
+    SELECT u.service_id, u.available, u.status, u.wait_minutes, now(), nextval('{SEQUENCE}')
+    FROM unnest(%s::bigint[], %s::int[], %s::text[], %s::int[]) AS u(service_id, available, status, wait_minutes)
+    WHERE EXISTS (SELECT 1 FROM {SERVICES_TABLE} e WHERE e.id = u.service_id)
+    ON CONFLICT (service_id) DO UPDATE SET
+        available = EXCLUDED.available, status = EXCLUDED.status, wait_minutes = EXCLUDED.wait_minutes,
+        updated_at = EXCLUDED.updated_at, seq = EXCLUDED.seq
+    RETURNING service_id
+'''
+
+# Reports written since a time. updated_at is the writing transaction's start, so a report
+# can become visible a little after a later one; polls reach back AVAILABILITY_POLL_OVERLAP
+# seconds and skip reports they already hold (same seq)
+POLL_SQL = f'''
+    SELECT a.service_id AS id, e.service_type, a.available, a.status, a.wait_minutes, a.updated_at, a.seq
+    FROM {TABLE} a
+    JOIN {SERVICES_TABLE} e ON e.id = a.service_id
+    WHERE a.updated_at >= %s
+'''
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Fields of a report as returned to clients
+REPORT_FIELDS = ('available', 'status', 'wait_minutes', 'updated_at')
+
+
+# Validate a publish request body and return a list of (service_id, available, status,
+# wait_minutes). Accepts {"reports": [...]} or a single report object; a service reported
+# twice keeps its last report. Raises ValueError with a client-facing message on bad input
+def parse_reports(data):
+    if isinstance(data, dict) and 'reports' in data:
+        data = data['reports']
+    elif isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list) or not data:
+        raise ValueError('Provide a report object or "reports" as a non-empty list.')
+    max_batch = settings.AVAILABILITY_MAX_BATCH
+    if len(data) > max_batch:
+        raise ValueError(f'A batch can contain at most {max_batch} reports.')
+
+    reports = {}
+    for raw in data:
+        if not isinstance(raw, dict):
+            raise ValueError('Each report must be an object.')
+        try:
+            service_id = int(raw['service'])
+            available = int(raw['available'])
+            wait_minutes = raw.get('wait_minutes')
+            wait_minutes = int(wait_minutes) if wait_minutes is not None else None
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Each report needs a numeric service and available (and numeric wait_minutes if given).')
+        status = raw.get('status', 'open')
+        if status not in STATUS_KEYS:
+            raise ValueError('Invalid status. Choose: open, diverting or closed.')
+        if not 0 <= available <= MAX_AVAILABLE or (wait_minutes is not None and wait_minutes < 0):
+            raise ValueError('available and wait_minutes cannot be negative.')
+        reports[service_id] = (service_id, available, status, wait_minutes)
+    return list(reports.values())
+
+
+# Publishing needs the AVAILABILITY_PUBLISH_TOKEN bearer token, or a staff user when no
+# token is configured
+def can_publish(request):
+    token = settings.AVAILABILITY_PUBLISH_TOKEN
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    return bool(request.user and request.user.is_staff)
+
+
+# Upsert the reports; returns the ids that were stored (the others are not services)
+def publish(reports):
+    columns = list(zip(*reports))
+    with connection.cursor() as cursor:
+        cursor.execute(UPSERT_SQL, [list(column) for column in columns])
+        stored = [service_id for (service_id,) in cursor.fetchall()]
+    metrics.count_availability_reports(len(stored))
+    return stored
+
+
+# Server-sent event carrying one JSON value; compact JSON has no newlines, so a single
+# data line is enough
+def sse_event(name, data):
+    return b'event: ' + name.encode() + b'\ndata: ' + dumps(data) + b'\n\n'
+
+
+class Subscription:
+    """One stream client: its type filter and a bounded queue of encoded events"""
+
+    def __init__(self, service_type):
+        self.service_type = service_type
+        self.queue = asyncio.Queue(maxsize=settings.AVAILABILITY_STREAM_QUEUE)
+
+    # Called on the subscriber's event loop. A client too slow to take its events is cut
+    # off (None ends the stream) rather than buffered; it reconnects to a fresh snapshot
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class AvailabilityFeed:
+    """Per-worker copy of the availability reports, kept current by polling"""
+
+    def __init__(self):
+        # service id -> report (a dict with id, service_type, seq and REPORT_FIELDS)
+        self._reports = {}
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._since = None
+        self._polled_at = float('-inf')
+        # Stream clients grouped by the event loop they run on
+        self._subscribers = {}
+        self._poller = None
+
+    # Fetch the reports written since the last poll, merge them and send them to the
+    # stream clients. Returns the reports that changed
+    def poll(self):
+        with connection.cursor() as cursor:
+            cursor.execute(POLL_SQL, [self._since or EPOCH])
+            columns = [column.name for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        changed = []
+        with self._lock:
+            for row in rows:
+                current = self._reports.get(row['id'])
+                if current is None or current['seq'] < row['seq']:
+                    self._reports[row['id']] = row
+                    changed.append(row)
+        if rows:
+            latest = max(row['updated_at'] for row in rows)
+            self._since = latest - timedelta(seconds=settings.AVAILABILITY_POLL_OVERLAP)
+        self._polled_at = time.monotonic()
+        if changed:
+            self._publish(changed)
+        return changed
+
+    # Poll unless this worker polled within AVAILABILITY_POLL_INTERVAL. Only the first
+    # load waits for a poll in progress elsewhere; later callers use the current copy
+    def refresh(self):
+        if time.monotonic() - self._polled_at < settings.AVAILABILITY_POLL_INTERVAL:
+            return
+        loaded = self._polled_at != float('-inf')
+        if not self._poll_lock.acquire(blocking=not loaded):
+            return
+        try:
+            if time.monotonic() - self._polled_at >= settings.AVAILABILITY_POLL_INTERVAL:
+                self.poll()
+        finally:
+            self._poll_lock.release()
+
+    # Current reports for these service ids (missing ids have none)
+    def reports(self, service_ids):
+        self.refresh()
+        return {service_id: self._reports[service_id] for service_id in service_ids if service_id in self._reports}
+
+    # Every current report, optionally of one service type, as sent to clients
+    def snapshot(self, service_type=None):
+        self.refresh()
+        with self._lock:
+            reports = list(self._reports.values())
+        return [report for report in reports if not service_type or report['service_type'] == service_type]
+
+    # Register a stream client on the running event loop and start the poller thread if
+    # it is the first. Returns None when the worker already has its maximum of clients
+    def subscribe(self, service_type=None):
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(service_type)
+        with self._lock:
+            if sum(len(subscribers) for subscribers in self._subscribers.values()) >= \
+                    settings.AVAILABILITY_STREAM_MAX_CLIENTS:
+                return None
+            self._subscribers.setdefault(loop, set()).add(subscription)
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_loop, name='availability-feed', daemon=True)
+                self._poller.start()
+        metrics.stream_opened()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for loop, subscribers in list(self._subscribers.items()):
+                if subscription in subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[loop]
+                    metrics.stream_closed()
+                    return
+
+    # Encode each event once per type filter and hand it to every loop with one
+    # thread-safe call; the loop copies it into its clients' queues
+    def _publish(self, changed):
+        with self._lock:
+            subscribers = {loop: list(subscriptions) for loop, subscriptions in self._subscribers.items()}
+        if not subscribers:
+            return
+        events = {None: sse_event('availability', changed)}
+        for service_type in SERVICE_TYPE_KEYS:
+            reports = [report for report in changed if report['service_type'] == service_type]
+            if reports:
+                events[service_type] = sse_event('availability', reports)
+        for loop, subscriptions in subscribers.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, subscriptions, events)
+            except RuntimeError:
+                # Loop already closed (worker shutting down)
+                pass
+
+    # Poller thread: runs while there are stream clients, then exits
+    def _poll_loop(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._poller = None
+                        return
+                try:
+                    self.refresh()
+                except DatabaseError as e:
+                    logger.warning(f'Availability poll failed: {e}')
+                    connection.close()
+                time.sleep(settings.AVAILABILITY_POLL_INTERVAL)
+        finally:
+            connection.close()
+
+
+def _deliver(subscriptions, events):
+    for subscription in subscriptions:
+        event = events.get(subscription.service_type)
+        if event is not None:
+            subscription.put(event)
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def get_feed():
+    global _feed
+    if _feed is None:
+        with _feed_lock:
+            if _feed is None:
+                _feed = AvailabilityFeed()
+    return _feed
+
+
+# A report as returned with a service, or None when there is none newer than
+# AVAILABILITY_MAX_AGE (a service that stopped publishing is treated as unknown)
+def current_report(report, cutoff):
+    if report is None or report['updated_at'] < cutoff:
+        return None
+    return {field: report[field] for field in REPORT_FIELDS}
+
+
+# 0: accepting (open with capacity), 1: unknown, 2: full, diverting or closed
+def tier(report):
+    if report is None:
+        return 1
+    return 0 if report['status'] == 'open' and report['available'] > 0 else 2
+
+
+# ?min_available=: a non-negative integer, or None when absent
+def parse_min_available(params):
+    value = params.get('min_available')
+    if value in (None, ''):
+        return None
+    min_available = int(value)
+    if min_available < 0:
+        raise ValueError(value)
+    return min_available
+
+
+# Attach each service's current report as 'availability', keep only open services with at
+# least min_available free (if given) and, by_availability, order accepting services first,
+# then unknown, then the rest; the sort is stable, so each group stays nearest first
+def apply(rows, limit=None, min_available=None, by_availability=False):
+    reports = get_feed().reports([row['id'] for row in rows])
+    cutoff = timezone.now() - timedelta(seconds=settings.AVAILABILITY_MAX_AGE)
+    for row in rows:
+        row['availability'] = current_report(reports.get(row['id']), cutoff)
+    if min_available is not None:
+        rows = [
+            row for row in rows
+            if row['availability'] is not None and row['availability']['status'] == 'open'
+            and row['availability']['available'] >= min_available
+        ]
+    if by_availability:
+        rows.sort(key=lambda row: tier(row['availability']))
+    return rows if limit is None else rows[:max(limit, 0)]
+
+
+# Body of a stream: the snapshot, then the queued events, with a comment line as heartbeat
+# so proxies keep the connection open. Ends when the client disconnects or falls behind
+async def stream_events(subscription, snapshot, disconnected=None):
+    waiter = None
+    if disconnected is not None:
+        waiter = asyncio.ensure_future(disconnected.wait())
+        waiter.add_done_callback(lambda _: subscription.close())
+    try:
+        yield b'retry: 5000\n' + sse_event('snapshot', snapshot)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), settings.AVAILABILITY_STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                event = b': ping\n\n'
+            if event is None:
+                return
+            yield event
+    finally:
+        if waiter is not None:
+            waiter.cancel()
+        get_feed().unsubscribe(subscription)
+
+
+class DisconnectWatcher:
+    """ASGI wrapper that tells availability streams when their client has gone
+
+    Django 4.2 keeps iterating a streaming response after the client disconnects (and
+    Uvicorn silently drops what it sends), so a stream would otherwise never end. Once the
+    request body has been read, this watches the connection for http.disconnect and sets
+    the asyncio.Event it put in scope['availability.disconnected']"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != STREAM_PATH:
+            return await self.app(scope, receive, send)
+        disconnected = scope['availability.disconnected'] = asyncio.Event()
+        watcher = None
+
+        async def watch():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        async def receive_body():
+            nonlocal watcher
+            message = await receive()
+            if message['type'] == 'http.request' and not message.get('more_body') and watcher is None:
+                watcher = asyncio.ensure_future(watch())
+            return message
+
+        try:
+            await self.app(scope, receive_body, send)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
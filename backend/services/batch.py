@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.db import connection
+
+from . import spatial_index
+from .spatial_index import service_to_row
+from .models import EmergencyService
+
+SERVICE_TYPE_KEYS = [key for key, _ in EmergencyService.SERVICE_TYPES]
+
+# One LATERAL KNN probe per (point, type) pair, all in a single round trip
+# Points and limits arrive as parallel arrays and are unnested into rows
+BATCH_NEAREST_SQL = '''
+    SELECT p.idx, s.service_type, s.id, s.distance
+    FROM unnest(%s::int[], %s::float8[], %s::float8[]) AS p(idx, lat, lng)
+    CROSS JOIN unnest(%s::text[], %s::int[]) AS l(service_type, n)
+    CROSS JOIN LATERAL (
+        SELECT e.id, e.service_type,
+               ST_DistanceSphere(e.location, ST_SetSRID(ST_MakePoint(p.lng, p.lat), 4326)) AS distance
+        FROM {table} e
+        WHERE e.service_type = l.service_type
+        ORDER BY e.location::geography <-> ST_SetSRID(ST_MakePoint(p.lng, p.lat), 4326)::geography
+        LIMIT l.n
+    ) s
+    ORDER BY p.idx, s.service_type, s.distance
+'''
+
+
+# Validate a batch request body and return (points, limits)
+# points: list of (lat, lng); limits: {service_type: n}
+# Raises ValueError with a client-facing message on bad input
+def parse_batch_request(data):
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object.')
+    raw_points = data.get('points')
+    if not isinstance(raw_points, list) or not raw_points:
+        raise ValueError('Provide "points" as a non-empty list.')
+    max_points = settings.NEAREST_BATCH_MAX_POINTS
+    if len(raw_points) > max_points:
+        raise ValueError(f'A batch can contain at most {max_points} points.')
+
+    points = []
+    for raw in raw_points:
+        try:
+            # Accept {"lat": .., "lng": ..} objects or [lat, lng] pairs
+            if isinstance(raw, dict):
+                lat, lng = float(raw['lat']), float(raw['lng'])
+            else:
+                lat, lng = float(raw[0]), float(raw[1])
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise ValueError('Each point needs numeric lat and lng.')
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError('Point coordinates out of range.')
+        points.append((lat, lng))
+
+    raw_limits = data.get('limits') or {key: 1 for key in SERVICE_TYPE_KEYS}
+    if not isinstance(raw_limits, dict):
+        raise ValueError('"limits" must map service types to counts.')
+    max_limit = settings.NEAREST_BATCH_MAX_LIMIT
+    limits = {}
+    for service_type, n in raw_limits.items():
+        if service_type not in SERVICE_TYPE_KEYS:
+            raise ValueError('Invalid service type. Choose: hospital, police, or fire.')
+        try:
+            n = int(n)
+        except (TypeError, ValueError):
+            raise ValueError('Limits must be integers.')
+        if not 0 <= n <= max_limit:
+            raise ValueError(f'Limits must be between 0 and {max_limit}.')
+        if n:
+            limits[service_type] = n
+    return points, limits
+
+
+# Empty per-point result with a list for every requested type
+def _empty_results(points, limits):
+    return [{service_type: [] for service_type in limits} for _ in points]
+
+
+# Answer every point with one set-based PostGIS query
+# Returns (results, details): results has one {service_type: [(id, distance_m), ...]}
+# per point and details maps each referenced service id to its compact fields
+def nearest_batch_database(points, limits):
+    results = _empty_results(points, limits)
+    if not limits:
+        return results, {}
+    types = list(limits)
+    params = [
+        list(range(len(points))),
+        [lat for lat, _ in points],
+        [lng for _, lng in points],
+        types,
+        [limits[service_type] for service_type in types],
+    ]
+    sql = BATCH_NEAREST_SQL.format(table=connection.ops.quote_name(EmergencyService._meta.db_table))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for idx, service_type, service_id, distance in cursor.fetchall():
+            results[idx][service_type].append((service_id, distance))
+    service_ids = {
+        service_id
+        for result in results for matches in result.values() for service_id, _ in matches
+    }
+    return results, batch_service_details(service_ids)
+
+
+# Same result shape answered from the per-worker KD-tree index
+def nearest_batch_memory(points, limits):
+    index = spatial_index.get_index()
+    results = _empty_results(points, limits)
+    details = {}
+    for result, (lat, lng) in zip(results, points):
+        for service_type, n in limits.items():
+            matches = index.nearest(lat, lng, n, service_type)
+            result[service_type] = [(row['id'], distance_m) for row, distance_m in matches]
+            for row, _ in matches:
+                if row['id'] not in details:
+                    details[row['id']] = _compact_details(row)
+    return results, details
+
+
+# Fields listed once per referenced service in a batch response
+def _compact_details(row):
+    return {
+        'name': row['name'],
+        'service_type': row['service_type'],
+        'phone': row['phone'],
+        'latitude': row['latitude'],
+        'longitude': row['longitude'],
+    }
+
+
+# Compact details for every service referenced by a batch, fetched once per id
+def batch_service_details(service_ids):
+    if not service_ids:
+        return {}
+    queryset = EmergencyService.objects.filter(id__in=service_ids).only(
+        'id', 'name', 'service_type', 'address', 'phone', 'location', 'is_24_hours'
+    )
+    return {service.id: _compact_details(service_to_row(service)) for service in queryset}
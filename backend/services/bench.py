@@ -0,0 +1,375 @@
+import bisect
+import csv
+import json
+import math
+import random
+import re
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import StringIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.urls import Resolver404, resolve
+
+from .data_version import bump_data_version
+from .geocoding import IRELAND_BOUNDS
+from .metrics import action_name
+from .models import EmergencyService, ServiceDeletion
+
+# Synthetic services carry this external_id prefix, so a run can find and remove exactly
+# the rows it loaded and leave real data alone
+EXTERNAL_ID_PREFIX = 'bench:'
+
+TABLE = EmergencyService._meta.db_table
+DELETION_TABLE = ServiceDeletion._meta.db_table
+COPY_COLUMNS = (
+    'external_id', 'name', 'service_type', 'address', 'phone', 'email', 'location', 'capacity',
+    'is_24_hours', 'description', 'created_at', 'updated_at',
+)
+# Roughly the national mix: many Garda stations, fewer fire stations, few hospitals
+SERVICE_TYPE_WEIGHTS = (('police', 0.55), ('fire', 0.30), ('hospital', 0.15))
+# Share of services (and queries) placed in the countryside around a town rather than in it
+RURAL_SHARE = 0.15
+RURAL_SIGMA_KM = 20.0
+KM_PER_DEG_LAT = 111.32
+
+# Default query mix: endpoint weights and the request each one sends
+MIX_WEIGHTS = (
+    ('nearest', 0.40), ('within_radius', 0.20), ('by_type', 0.20), ('list', 0.10), ('statistics', 0.10),
+    ('in_bbox', 0.10),
+)
+# Gunicorn/nginx access-log lines: the request path is the second word of the quoted request
+ACCESS_LOG_REQUEST = re.compile(r'"(?:GET|HEAD) (\S+) HTTP/[\d.]+"')
+
+
+def _weighted(pairs):
+    values, weights = zip(*pairs)
+    total = 0.0
+    cumulative = []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return values, cumulative
+
+
+class Sampler:
+    """Seeded random points clustered around Irish towns, weighted by population"""
+
+    def __init__(self, seed, path=None):
+        self.rng = random.Random(seed)
+        towns = []
+        with open(path or settings.GAZETTEER_PATH, newline='', encoding='utf-8') as handle:
+            for row in csv.DictReader(handle):
+                try:
+                    population = int(row.get('population') or 0)
+                    lat, lng = float(row['lat']), float(row['lng'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if population > 0 and row.get('kind') in ('city', 'town', 'suburb'):
+                    towns.append(((row['name'], lat, lng, population), population))
+        if not towns:
+            raise ValueError('No populated towns in the gazetteer')
+        self.towns, self.town_weights = _weighted(towns)
+        self.service_types, self.type_weights = _weighted(SERVICE_TYPE_WEIGHTS)
+
+    def choose(self, values, cumulative):
+        return values[bisect.bisect(cumulative, self.rng.random() * cumulative[-1])]
+
+    # (town name, lat, lng): a normal spread around a population-weighted town, wider for
+    # bigger towns, or a rural point further out. Clamped to the island's bounding box
+    def point(self):
+        name, lat, lng, population = self.choose(self.towns, self.town_weights)
+        if self.rng.random() < RURAL_SHARE:
+            sigma_km = RURAL_SIGMA_KM
+        else:
+            sigma_km = 1.0 + 4.0 * math.sqrt(population / 100000)
+        lat += self.rng.gauss(0, sigma_km) / KM_PER_DEG_LAT
+        lng += self.rng.gauss(0, sigma_km) / (KM_PER_DEG_LAT * math.cos(math.radians(lat)))
+        lat = min(max(lat, IRELAND_BOUNDS['min_lat']), IRELAND_BOUNDS['max_lat'])
+        lng = min(max(lng, IRELAND_BOUNDS['min_lng']), IRELAND_BOUNDS['max_lng'])
+        return name, lat, lng
+
+    def service_type(self):
+        return self.choose(self.service_types, self.type_weights)
+
+
+# COPY text lines for synthetic services [start, stop); the sampler is consumed in order,
+# so growing a dataset from 10k to 100k rows keeps the first 10k unchanged
+def copy_lines(sampler, start, stop, now):
+    for number in range(start, stop):
+        town, lat, lng = sampler.point()
+        service_type = sampler.service_type()
+        rng = sampler.rng
+        yield '\t'.join((
+            f'{EXTERNAL_ID_PREFIX}{number}',
+            f'{town} {service_type.title()} {number}',
+            service_type,
+            f'{number} Main Street, {town}',
+            f'+353 1 {number % 10000000:07d}',
+            f'service{number}@example.com',
+            f'SRID=4326;POINT({lng:.6f} {lat:.6f})',
+            str(rng.randint(50, 800) if service_type == 'hospital' else 0),
+            't' if service_type != 'police' or rng.random() < 0.3 else 'f',
+            'Synthetic service for manage.py bench',
+            now,
+            now,
+        )) + '\n'
+
+
+# Append synthetic services [start, stop) with COPY, in chunks so a million rows never sit
+# in memory at once, then refresh planner statistics for the new table size
+def load_services(sampler, start, stop, chunk=50000):
+    now = datetime.now(timezone.utc).isoformat()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for chunk_start in range(start, stop, chunk):
+                buffer = StringIO()
+                buffer.writelines(copy_lines(sampler, chunk_start, min(chunk_start + chunk, stop), now))
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {TABLE} ({', '.join(COPY_COLUMNS)}) FROM STDIN", buffer)
+        # Caches, tiles and in-memory indexes in every worker follow the data version
+        transaction.on_commit(bump_data_version)
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {TABLE}')
+
+
+# Remove every synthetic service. Rows derived from them (isochrones, coverage areas and
+# gaps) are removed or detached the way their on_delete would, and delta-sync clients get
+# tombstones as for any other deletion
+def remove_services():
+    pattern = f'{EXTERNAL_ID_PREFIX}%'
+    bench_ids = f'SELECT id FROM {TABLE} WHERE external_id LIKE %s'
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for relation in EmergencyService._meta.get_fields(include_hidden=True):
+                if not (relation.auto_created and relation.is_relation and not relation.concrete):
+                    continue
+                table = relation.related_model._meta.db_table
+                column = relation.field.column
+                if relation.on_delete is models.SET_NULL:
+                    cursor.execute(f'UPDATE {table} SET {column} = NULL WHERE {column} IN ({bench_ids})', [pattern])
+                else:
+                    cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({bench_ids})', [pattern])
+            cursor.execute(f'''
+                WITH removed AS (DELETE FROM {TABLE} WHERE external_id LIKE %s RETURNING id)
+                INSERT INTO {DELETION_TABLE} (service_id, deleted_at) SELECT id, now() FROM removed
+            ''', [pattern])
+            removed = cursor.rowcount
+        transaction.on_commit(bump_data_version)
+    return removed
+
+
+# Seeded query mix of (endpoint, path) pairs from points where people live
+def default_mix(sampler, count):
+    endpoints, cumulative = _weighted(MIX_WEIGHTS)
+    mix = []
+    for _ in range(count):
+        endpoint = sampler.choose(endpoints, cumulative)
+        _, lat, lng = sampler.point()
+        where = f'lat={lat:.5f}&lng={lng:.5f}'
+        if endpoint == 'nearest':
+            path = f'/api/services/nearest/?{where}&limit={sampler.rng.choice((1, 3, 5, 10))}'
+        elif endpoint == 'within_radius':
+            path = f'/api/services/within_radius/?{where}&radius={sampler.rng.choice((1, 2, 5, 10))}'
+        elif endpoint == 'by_type':
+            path = f'/api/services/by_type/?{where}&type={sampler.service_type()}'
+        elif endpoint == 'in_bbox':
+            # A 1024 x 640 px map viewport centred on the point
+            zoom = sampler.rng.choice((8, 10, 12, 14))
+            half_lng = 360 / 2 ** zoom * 2
+            half_lat = half_lng * 0.625 * math.cos(math.radians(lat))
+            bbox = f'{lng - half_lng:.5f},{lat - half_lat:.5f},{lng + half_lng:.5f},{lat + half_lat:.5f}'
+            path = f'/api/services/in_bbox/?bbox={bbox}&zoom={zoom}'
+        elif endpoint == 'list':
+            path = '/api/services/?page_size=50'
+        else:
+            path = '/api/services/statistics/'
+        mix.append((endpoint, path))
+    return mix
+
+
+# Endpoint name of a recorded path: its action name as in /metrics, so recorded and default
+# mixes report under the same names. None for paths outside the project
+def endpoint_name(path):
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return None
+    return action_name(match.url_name or match.view_name)
+
+
+# Recorded query mix: one request path per line, or access-log lines (GET/HEAD requests are
+# picked out). Blank lines, comments and paths the project does not route are skipped
+def read_mix(path):
+    mix = []
+    with open(path, encoding='utf-8') as handle:
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = ACCESS_LOG_REQUEST.search(line)
+            request_path = match.group(1) if match else line.split()[0]
+            endpoint = endpoint_name(request_path)
+            if endpoint is not None:
+                mix.append((endpoint, request_path))
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def summarize(latencies_ms):
+    values = sorted(latencies_ms)
+    return {
+        'p50_ms': percentile(values, 0.50),
+        'p95_ms': percentile(values, 0.95),
+        'p99_ms': percentile(values, 0.99),
+        'max_ms': values[-1] if values else None,
+        'mean_ms': sum(values) / len(values) if values else None,
+    }
+
+
+class Recorder:
+    """Per-endpoint latencies, errors, query counts and allocation peaks of one replay"""
+
+    def __init__(self):
+        self.endpoints = {}
+
+    def entry(self, endpoint):
+        entry = self.endpoints.get(endpoint)
+        if entry is None:
+            entry = self.endpoints[endpoint] = {'latencies': [], 'errors': 0, 'queries': [], 'peaks': []}
+        return entry
+
+    def results(self):
+        results = {}
+        for endpoint in sorted(self.endpoints):
+            entry = self.endpoints[endpoint]
+            result = {'requests': len(entry['latencies']) + entry['errors'], 'errors': entry['errors']}
+            result.update(summarize(entry['latencies']))
+            if entry['queries']:
+                result['queries_per_request'] = sum(entry['queries']) / len(entry['queries'])
+            if entry['peaks']:
+                result['peak_alloc_kib'] = sorted(entry['peaks'])[len(entry['peaks']) // 2] / 1024
+            results[endpoint] = result
+        return results
+
+
+def _is_error(status_code):
+    return status_code >= 400
+
+
+# Replay through Django's test client in this process: the full middleware and view stack
+# without the network. Counts the database queries each request runs; a second, shorter
+# pass traces Python allocations (tracemalloc slows requests down, so it is not timed)
+def replay_client(mix, warmup, memory_samples):
+    from django.test import Client
+
+    client = Client()
+    for _, path in mix[:warmup]:
+        client.get(path)
+
+    recorder = Recorder()
+    executed = [0]
+
+    def count_queries(execute, sql, params, many, context):
+        executed[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count_queries):
+        for endpoint, path in mix:
+            entry = recorder.entry(endpoint)
+            executed[0] = 0
+            started = time.perf_counter()
+            response = client.get(path)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if _is_error(response.status_code):
+                entry['errors'] += 1
+                continue
+            entry['latencies'].append(elapsed_ms)
+            entry['queries'].append(executed[0])
+
+    samples = {}
+    tracemalloc.start()
+    try:
+        for endpoint, path in mix:
+            if samples.get(endpoint, 0) >= memory_samples:
+                continue
+            samples[endpoint] = samples.get(endpoint, 0) + 1
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            client.get(path)
+            recorder.entry(endpoint)['peaks'].append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return recorder.results()
+
+
+# Replay over HTTP against a running server, one request at a time so runs compare
+# latency rather than how the load generator schedules concurrent requests
+def replay_http(mix, url, warmup, timeout):
+    import httpx
+
+    recorder = Recorder()
+    with httpx.Client(base_url=url, timeout=timeout) as client:
+        for _, path in mix[:warmup]:
+            client.get(path)
+        for endpoint, path in mix:
+            entry = recorder.entry(endpoint)
+            started = time.perf_counter()
+            try:
+                response = client.get(path)
+            except httpx.HTTPError:
+                entry['errors'] += 1
+                continue
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if _is_error(response.status_code):
+                entry['errors'] += 1
+            else:
+                entry['latencies'].append(elapsed_ms)
+    return recorder.results()
+
+
+# Changes from a previous results file: (size, transport, endpoint, metric, before, after,
+# relative change) for every p50/p99 both files have
+def compare(baseline, results, metrics=('p50_ms', 'p99_ms')):
+    previous = {
+        (run['rows'], run['transport']): run['endpoints'] for run in baseline.get('runs', [])
+    }
+    changes = []
+    for run in results['runs']:
+        before_endpoints = previous.get((run['rows'], run['transport']), {})
+        for endpoint, after in run['endpoints'].items():
+            before = before_endpoints.get(endpoint)
+            if before is None:
+                continue
+            for metric in metrics:
+                if before.get(metric) and after.get(metric) is not None:
+                    changes.append((
+                        run['rows'], run['transport'], endpoint, metric, before[metric], after[metric],
+                        after[metric] / before[metric] - 1,
+                    ))
+    return changes
+
+
+# Floats rounded so results files diff cleanly between runs and commits
+def _rounded(value):
+    if isinstance(value, float):
+        return round(value, 3)
+    if isinstance(value, dict):
+        return {key: _rounded(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rounded(item) for item in value]
+    return value
+
+
+def write_results(path, results):
+    with open(path, 'w', encoding='utf-8') as handle:
+        json.dump(_rounded(results), handle, indent=2, sort_keys=True)
+        handle.write('\n')
@@ -0,0 +1,110 @@
+import functools
+import hashlib
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .data_version import aget_data_version, get_data_version
+
+
+# Canonical form of a query string value so equivalent requests share one ETag
+# ("53.35" and "53.350" are the same coordinate)
+def _normalize_value(value):
+    value = value.strip()
+    try:
+        return repr(float(value))
+    except ValueError:
+        return value
+
+
+# request.GET rather than query_params so plain Django requests (async views) work too
+def normalized_query(request):
+    return '&'.join(
+        f'{key}={_normalize_value(value)}'
+        for key in sorted(request.GET)
+        for value in sorted(request.GET.getlist(key))
+    )
+
+
+# Strong ETag over the shared data version, the path, the normalised query parameters and
+# the negotiated media type; any change to the services table changes every ETag
+def make_etag(request, version):
+    accepted = getattr(request, 'accepted_media_type', '') or ''
+    payload = f'{version}|{request.path}|{normalized_query(request)}|{accepted}'
+    return '"' + hashlib.sha1(payload.encode()).hexdigest() + '"'
+
+
+# The data version is the change time in microseconds, so it doubles as Last-Modified
+def version_last_modified(version):
+    return datetime.fromtimestamp(version // 1_000_000, tz=timezone.utc)
+
+
+def _add_cache_headers(request, response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    # The browsable API embeds the user and a CSRF token, so it must never be shared
+    if getattr(getattr(request, 'accepted_renderer', None), 'format', None) == 'api':
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.API_CACHE_MAX_AGE)
+    patch_vary_headers(response, ['Accept'])
+
+
+# Validators for the current data version, and the 304/412 response when the request's
+# preconditions already settle it (None: run the view)
+def _preconditions(request, version):
+    etag = make_etag(request, version)
+    last_modified = version_last_modified(version)
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    if response is not None and response.status_code == HttpResponseNotModified.status_code:
+        _add_cache_headers(request, response, etag, last_modified)
+    return etag, last_modified, response
+
+
+# ?rank=availability and ?min_available= add live availability (services.availability),
+# which changes without a data version bump, so those requests are never answered or
+# stamped as conditional
+def includes_live_data(request):
+    return request.GET.get('rank') == 'availability' or bool(request.GET.get('min_available'))
+
+
+# Decorator for read-only viewset actions: answers 304 Not Modified (or 412) before the
+# action runs, so no spatial query is made, and stamps successful responses with validators
+# and Cache-Control so browsers, the service worker and nginx can reuse them
+def conditional_read(view_method):
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or includes_live_data(request):
+            return view_method(self, request, *args, **kwargs)
+
+        etag, last_modified, response = _preconditions(request, get_data_version())
+        if response is not None:
+            return response
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            _add_cache_headers(request, response, etag, last_modified)
+        return response
+    return wrapper
+
+
+# conditional_read for async function views; the request must already carry the
+# negotiated accepted_media_type, as DRF requests do
+def async_conditional_read(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or includes_live_data(request):
+            return await view(request, *args, **kwargs)
+
+        etag, last_modified, response = _preconditions(request, await aget_data_version())
+        if response is not None:
+            return response
+
+        response = await view(request, *args, **kwargs)
+        if response.status_code == 200:
+            _add_cache_headers(request, response, etag, last_modified)
+        return response
+    return wrapper
@@ -0,0 +1,210 @@
+import csv
+import heapq
+import json
+import logging
+from array import array
+
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.contrib.gis.geos import Point
+from django.db import connection, transaction
+from django.db.models import F, Max, Q, Sum
+from psycopg2.extras import execute_values
+
+from .geocoding import IRELAND_BOUNDS
+from .models import CoverageGap, EmergencyService, ServiceArea
+
+logger = logging.getLogger(__name__)
+
+# Voronoi cells are built in Irish Transverse Mercator (metres), so cell edges are close
+# to true equidistance lines rather than equal-degree ones
+VORONOI_SRID = 2157
+
+SERVICE_TABLE = EmergencyService._meta.db_table
+AREA_TABLE = ServiceArea._meta.db_table
+
+# One ServiceArea per service of the type: its Voronoi cell clipped to the extent. A type
+# with a single service gets the whole extent (no Voronoi cells to join)
+AREAS_SQL = f'''
+WITH extent AS (
+    SELECT ST_MakeEnvelope(%(min_lng)s, %(min_lat)s, %(max_lng)s, %(max_lat)s, 4326) AS geom
+), cells AS (
+    SELECT (ST_Dump(ST_VoronoiPolygons(
+        ST_Collect(ST_Transform(location, {VORONOI_SRID})), 0,
+        (SELECT ST_Transform(geom, {VORONOI_SRID}) FROM extent)
+    ))).geom AS cell
+    FROM {SERVICE_TABLE}
+    WHERE service_type = %(service_type)s
+)
+INSERT INTO {AREA_TABLE} (service_id, service_type, polygon, population, cells, computed_at)
+SELECT DISTINCT ON (service.id)
+    service.id, service.service_type,
+    ST_Multi(ST_CollectionExtract(ST_Intersection(
+        COALESCE(ST_Transform(cells.cell, 4326), extent.geom), extent.geom
+    ), 3)),
+    0, 0, now()
+FROM {SERVICE_TABLE} AS service
+CROSS JOIN extent
+LEFT JOIN cells ON ST_Contains(cells.cell, ST_Transform(service.location, {VORONOI_SRID}))
+WHERE service.service_type = %(service_type)s
+ORDER BY service.id
+'''
+LOAD_SQL = f'''
+UPDATE {AREA_TABLE} AS area SET
+    population = load.population,
+    cells = load.cells,
+    max_distance_m = load.max_distance_m,
+    mean_distance_m = load.mean_distance_m
+FROM (VALUES %s) AS load (service_id, population, cells, max_distance_m, mean_distance_m)
+WHERE area.service_id = load.service_id
+'''
+
+
+# Population grid CSV (lat/latitude, lng/lon/longitude, population/pop per cell centre) as
+# three parallel arrays; empty cells are dropped since they cannot affect any result
+def read_population(path):
+    lats, lngs, population = array('d'), array('d'), array('d')
+    skipped = 0
+    with open(path, newline='', encoding='utf-8') as handle:
+        for row in csv.DictReader(handle):
+            try:
+                lat = float(row.get('lat') or row.get('latitude'))
+                lng = float(row.get('lng') or row.get('lon') or row.get('longitude'))
+                people = float(row.get('population') or row.get('pop') or 0)
+            except (TypeError, ValueError):
+                skipped += 1
+                continue
+            if people > 0:
+                lats.append(lat)
+                lngs.append(lng)
+                population.append(people)
+    if skipped:
+        logger.warning(f'{skipped} population rows without numeric lat, lng and population skipped')
+    return lats, lngs, population
+
+
+# Index and population arrays for the workers; set in the parent before the pool forks,
+# so workers share them instead of receiving a pickled copy per task
+_shared = {}
+
+
+def share(index, population, service_types, gap_count):
+    _shared.update(index=index, population=population, service_types=service_types, gap_count=gap_count)
+
+
+# Worker entry point: assign population cells [start, stop) to their nearest service of
+# each type. Returns per type {service id: [population, cells, max m, population x m]}
+# and the chunk's gap_count farthest cells as (distance, population, lat, lng, service id)
+def assign_chunk(bounds):
+    start, stop = bounds
+    index = _shared['index']
+    lats, lngs, population = _shared['population']
+    gap_count = _shared['gap_count']
+    loads = {service_type: {} for service_type in _shared['service_types']}
+    gaps = {service_type: [] for service_type in _shared['service_types']}
+    for position in range(start, stop):
+        lat, lng, people = lats[position], lngs[position], population[position]
+        for service_type, type_loads in loads.items():
+            nearest = index.nearest(lat, lng, 1, service_type)
+            if not nearest:
+                continue
+            row, distance_m = nearest[0]
+            load = type_loads.get(row['id'])
+            if load is None:
+                load = type_loads[row['id']] = [0.0, 0, 0.0, 0.0]
+            load[0] += people
+            load[1] += 1
+            load[2] = max(load[2], distance_m)
+            load[3] += people * distance_m
+            heap = gaps[service_type]
+            gap = (distance_m, people, lat, lng, row['id'])
+            if len(heap) < gap_count:
+                heapq.heappush(heap, gap)
+            elif gap > heap[0]:
+                heapq.heapreplace(heap, gap)
+    return loads, gaps
+
+
+def merge_chunk(totals, chunk, gap_count):
+    loads, gaps = chunk
+    for service_type, type_loads in loads.items():
+        type_totals, type_gaps = totals.setdefault(service_type, ({}, []))
+        for service_id, (people, cells, max_m, weighted_m) in type_loads.items():
+            total = type_totals.setdefault(service_id, [0.0, 0, 0.0, 0.0])
+            total[0] += people
+            total[1] += cells
+            total[2] = max(total[2], max_m)
+            total[3] += weighted_m
+        type_gaps.extend(gaps[service_type])
+        type_gaps[:] = heapq.nlargest(gap_count, type_gaps)
+
+
+# Replace the stored areas and gaps of one type with a finished analysis
+# A service has one area: one that changed type since the last run still has its area
+# under the old type, which is dropped too or the insert would hit its service_id
+def store_results(service_type, loads, gaps):
+    with transaction.atomic():
+        ServiceArea.objects.filter(Q(service_type=service_type) | Q(service__service_type=service_type)).delete()
+        CoverageGap.objects.filter(service_type=service_type).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(AREAS_SQL, {**IRELAND_BOUNDS, 'service_type': service_type})
+            execute_values(cursor, LOAD_SQL, [
+                (service_id, round(people), cells, max_m, weighted_m / people if people else None)
+                for service_id, (people, cells, max_m, weighted_m) in loads.items()
+            ])
+        CoverageGap.objects.bulk_create([
+            CoverageGap(
+                service_type=service_type,
+                location=Point(lng, lat, srid=4326),
+                population=people,
+                distance_m=distance_m,
+                nearest_service_id=service_id,
+            )
+            for distance_m, people, lat, lng, service_id in sorted(gaps, reverse=True)
+        ])
+
+
+# Stored analysis for one type: summary, areas and the `gap_limit` worst gaps as GeoJSON
+def get_coverage(service_type, gap_limit):
+    areas = ServiceArea.objects.filter(service_type=service_type)
+    summary = areas.aggregate(
+        population=Sum('population'),
+        max_distance_m=Max('max_distance_m'),
+        weighted_m=Sum(F('mean_distance_m') * F('population')),
+        computed_at=Max('computed_at'),
+    )
+    people = summary['population'] or 0
+    area_rows = areas.values(
+        'service_id', 'service__name', 'population', 'cells', 'max_distance_m', 'mean_distance_m',
+        geometry=AsGeoJSON('polygon', precision=5),
+    )
+    gap_rows = CoverageGap.objects.filter(service_type=service_type).values(
+        'population', 'distance_m', 'nearest_service_id', geometry=AsGeoJSON('location', precision=5),
+    )[:max(gap_limit, 0)]
+    return {
+        'service_type': service_type,
+        'computed_at': summary['computed_at'],
+        'summary': {
+            'services': len(area_rows),
+            'population': people,
+            'max_distance_m': summary['max_distance_m'],
+            'mean_distance_m': summary['weighted_m'] / people if people else None,
+        },
+        'areas': {
+            'type': 'FeatureCollection',
+            'features': [
+                {
+                    'type': 'Feature',
+                    'geometry': json.loads(row.pop('geometry')),
+                    'properties': dict(row, name=row.pop('service__name')),
+                }
+                for row in area_rows
+            ],
+        },
+        'gaps': {
+            'type': 'FeatureCollection',
+            'features': [
+                {'type': 'Feature', 'geometry': json.loads(row.pop('geometry')), 'properties': row}
+                for row in gap_rows
+            ],
+        },
+    }
@@ -0,0 +1,189 @@
+import heapq
+import logging
+import math
+import time
+from array import array
+
+from .geocoding import IRELAND_BOUNDS
+from .spatial_index import chord_for_distance, haversine_m, to_unit_vector
+
+logger = logging.getLogger(__name__)
+
+# Chord bound meaning "every service of the type" (longer than any chord on the unit sphere)
+UNBOUNDED = 3.0
+
+
+def _squared_chord(a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+# Correctness bound: for a cell with centre c and radius r (centre to farthest corner) and
+# d_k the distance from c to its k-th nearest service of a type, every service among the
+# k nearest to any point q in the cell lies within d_k + 2r of c. The k services nearest c
+# are all within d_k + r of q, so q's k-th nearest is at most d_k + r from q and therefore
+# at most d_k + 2r from c. Storing every service within that bound makes a cell lookup
+# plus an exact re-rank return exactly what a full search would, for any limit up to k
+class CoverageGrid:
+    """Precomputed nearest-service shortlists per type for a lat/lng grid over Ireland"""
+
+    def __init__(self, cell_deg, k, max_shortlist, bounds=IRELAND_BOUNDS):
+        self.cell_deg = cell_deg
+        self.k = k
+        self.max_shortlist = max_shortlist
+        self.min_lat = bounds['min_lat']
+        self.max_lat = bounds['max_lat']
+        self.min_lng = bounds['min_lng']
+        self.max_lng = bounds['max_lng']
+        self.rows = max(1, math.ceil((self.max_lat - self.min_lat) / cell_deg))
+        self.cols = max(1, math.ceil((self.max_lng - self.min_lng) / cell_deg))
+
+        self._centers = []
+        self._center_coords = []
+        radii = []
+        for row in range(self.rows):
+            south = self.min_lat + row * cell_deg
+            north = min(south + cell_deg, self.max_lat)
+            for col in range(self.cols):
+                west = self.min_lng + col * cell_deg
+                east = min(west + cell_deg, self.max_lng)
+                lat, lng = (south + north) / 2, (west + east) / 2
+                self._centers.append(to_unit_vector(lat, lng))
+                self._center_coords.append((lat, lng))
+                # Small margin so float rounding can never put a point outside its cell radius
+                radii.append(max(
+                    haversine_m(lat, lng, corner_lat, corner_lng)
+                    for corner_lat in (south, north) for corner_lng in (west, east)
+                ) * 1.01 + 1.0)
+        self._radii = array('d', radii)
+
+        # Per service type: (ids, centre distances) per cell (None when the shortlist would be
+        # longer than max_shortlist, meaning "use the KD-tree") and the chord bound per cell.
+        # Lists are replaced on update, never mutated, so lock-free readers stay consistent
+        self._shortlists = {}
+        self._bounds = {}
+
+    def __len__(self):
+        return self.rows * self.cols
+
+    @classmethod
+    def build(cls, index, cell_deg, k, max_shortlist):
+        started = time.perf_counter()
+        grid = cls(cell_deg, k, max_shortlist)
+        for service_type in index.service_types():
+            grid._rebuild_type(index, service_type, range(len(grid)))
+        logger.info(
+            f'Coverage grid built with {len(grid)} cells in '
+            f'{(time.perf_counter() - started) * 1000:.1f} ms'
+        )
+        return grid
+
+    def _cell_for(self, lat, lng):
+        if not (self.min_lat <= lat <= self.max_lat and self.min_lng <= lng <= self.max_lng):
+            return None
+        row = min(int((lat - self.min_lat) / self.cell_deg), self.rows - 1)
+        col = min(int((lng - self.min_lng) / self.cell_deg), self.cols - 1)
+        return row * self.cols + col
+
+    # Shortlist and bound for one cell from the type's KD-tree; the shortlist is stored as
+    # (ids, centre distances) sorted by distance from the cell centre
+    def _compute_cell(self, tree, rows_by_id, cell):
+        center = self._centers[cell]
+        lat, lng = self._center_coords[cell]
+        if len(rows_by_id) <= self.k:
+            members, bound = rows_by_id.values(), UNBOUNDED
+        else:
+            kth = tree.nearest(center, self.k)[-1]
+            d_k = haversine_m(lat, lng, kth['latitude'], kth['longitude'])
+            # Chord and metres are both monotonic in angle, so the bound can be applied as a chord
+            bound = chord_for_distance(d_k + 2 * self._radii[cell])
+            members = tree.within(center, bound)
+        if len(members) > self.max_shortlist:
+            return None, bound
+        ranked = sorted(
+            (haversine_m(lat, lng, row['latitude'], row['longitude']), row['id']) for row in members
+        )
+        return (tuple(service_id for _, service_id in ranked),
+                tuple(distance for distance, _ in ranked)), bound
+
+    def _rebuild_type(self, index, service_type, cells):
+        tree, rows_by_id = index.tree_and_rows(service_type)
+        if tree is None:
+            self._shortlists.pop(service_type, None)
+            self._bounds.pop(service_type, None)
+            return
+        shortlists = list(self._shortlists.get(service_type, [((), ())] * len(self)))
+        bounds = array('d', self._bounds.get(service_type, array('d', [UNBOUNDED]) * len(self)))
+        for cell in cells:
+            shortlists[cell], bounds[cell] = self._compute_cell(tree, rows_by_id, cell)
+        self._shortlists[service_type] = shortlists
+        self._bounds[service_type] = bounds
+
+    # Cells whose shortlist can change when a service appears at / disappears from a
+    # position: exactly those whose bound reaches that position
+    def _cells_reaching(self, service_type, row):
+        bounds = self._bounds.get(service_type)
+        if bounds is None:
+            return set()
+        vector = to_unit_vector(row['latitude'], row['longitude'])
+        return {
+            cell for cell, center in enumerate(self._centers)
+            if _squared_chord(center, vector) <= bounds[cell] ** 2
+        }
+
+    # Incremental update after the index has applied an insert, move, retype or delete:
+    # only the affected cells of the affected types are recomputed
+    def service_changed(self, index, old_row, new_row):
+        started = time.perf_counter()
+        affected = {}
+        for row in (old_row, new_row):
+            if row is None:
+                continue
+            cells = self._cells_reaching(row['service_type'], row)
+            if row['service_type'] not in self._bounds:
+                # First service of a new type: build the whole layer
+                cells = range(len(self))
+            affected.setdefault(row['service_type'], set()).update(cells)
+        for service_type, cells in affected.items():
+            self._rebuild_type(index, service_type, sorted(cells))
+        logger.debug(
+            f'Coverage grid updated {sum(len(cells) for cells in affected.values())} cells in '
+            f'{(time.perf_counter() - started) * 1000:.1f} ms'
+        )
+
+    # Nearest services of the given types as unsorted (row, distance_m) pairs taken from the
+    # index's {type: {id: row}} mapping, or None when the grid cannot answer (outside the
+    # grid, limit above k, or an oversized cell). Each shortlist is walked in order of
+    # distance from the cell centre; since dist(q, s) >= dist(c, s) - r, the walk stops as
+    # soon as the next centre distance minus r exceeds the current limit-th best
+    def nearest(self, lat, lng, limit, service_types, rows):
+        if not 1 <= limit <= self.k:
+            return None
+        cell = self._cell_for(lat, lng)
+        if cell is None:
+            return None
+        radius = self._radii[cell]
+        results = []
+        for service_type in service_types:
+            shortlists = self._shortlists.get(service_type)
+            if shortlists is None:
+                continue
+            shortlist = shortlists[cell]
+            if shortlist is None:
+                return None
+            rows_by_id = rows.get(service_type, {})
+            # Max-heap of (-distance, id, row) holding the best `limit` so far
+            best = []
+            for service_id, center_distance in zip(*shortlist):
+                if len(best) == limit and center_distance - radius > -best[0][0]:
+                    break
+                row = rows_by_id.get(service_id)
+                # An id can vanish between a concurrent delete and its grid update
+                if row is None:
+                    continue
+                distance = haversine_m(lat, lng, row['latitude'], row['longitude'])
+                if len(best) < limit:
+                    heapq.heappush(best, (-distance, service_id, row))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, service_id, row))
+            results.extend((row, -negative) for negative, _, row in best)
+        return results
@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+DATA_VERSION_KEY = 'services:data-version'
+# Kept out of the 'default' cache, where tiles fill MAX_ENTRIES and culling could drop it
+CACHE_ALIAS = 'state'
+
+# (version, monotonic time read) for recent_data_version(); one tuple so threads never see
+# a version paired with another read's time
+_recent = (None, float('-inf'))
+
+
+# Current version of the EmergencyService table, shared by all workers through the cache
+# The value is the time of the last change in microseconds, so a missing key (first start,
+# cleared cache directory) is seeded with "now" and invalidates everything cached before
+def get_data_version():
+    cache = caches[CACHE_ALIAS]
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        cache.add(DATA_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = cache.get(DATA_VERSION_KEY)
+    return version
+
+
+# get_data_version for async views; the cache backend may block (files, sockets), so its
+# calls go through the backend's async API rather than running on the event loop
+async def aget_data_version():
+    cache = caches[CACHE_ALIAS]
+    version = await cache.aget(DATA_VERSION_KEY)
+    if version is None:
+        await cache.aadd(DATA_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = await cache.aget(DATA_VERSION_KEY)
+    return version
+
+
+# The data version as this process last read it, re-read from the cache at most every
+# DATA_VERSION_CHECK_MS. For the per-request checks of the in-memory index and ranker,
+# which would otherwise pay a cache read (a file open and unpickle) on every query; edits
+# made through other workers are seen that much later
+def recent_data_version():
+    global _recent
+    version, read_at = _recent
+    now = time.monotonic()
+    if version is None or (now - read_at) * 1000 >= settings.DATA_VERSION_CHECK_MS:
+        version = get_data_version()
+        _recent = (version, now)
+    return version
+
+
+# Called after any create/update/delete so cached tiles and responses stop matching
+def bump_data_version():
+    global _recent
+    version = time.time_ns() // 1000
+    caches[CACHE_ALIAS].set(DATA_VERSION_KEY, version, timeout=None)
+    # This worker sees its own edits at once
+    _recent = (version, time.monotonic())
+    return version
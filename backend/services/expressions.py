@@ -0,0 +1,86 @@
+from django.db.models import BooleanField, F, FloatField, Func, Value
+
+# The geography expressions cast the stored geometry with "location::geography" so the
+# planner can match the functional GiST index added in migration 0002
+
+
+class GeographyKNN(Func):
+    """PostGIS <-> KNN distance between a geometry column and a point, on the sphere"""
+    output_field = FloatField()
+
+    def __init__(self, expression, point, **extra):
+        super().__init__(expression, Value(point.ewkt), **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column_sql, column_params = compiler.compile(self.source_expressions[0])
+        point_sql, point_params = compiler.compile(self.source_expressions[1])
+        return (
+            f'({column_sql})::geography <-> ({point_sql})::geography',
+            [*column_params, *point_params],
+        )
+
+
+class GeographyDWithin(Func):
+    """ST_DWithin on geography so the radius is in metres and the same index applies"""
+    output_field = BooleanField()
+    conditional = True
+
+    def __init__(self, expression, point, distance_m, **extra):
+        super().__init__(expression, Value(point.ewkt), Value(float(distance_m)), **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column_sql, column_params = compiler.compile(self.source_expressions[0])
+        point_sql, point_params = compiler.compile(self.source_expressions[1])
+        distance_sql, distance_params = compiler.compile(self.source_expressions[2])
+        return (
+            f'ST_DWithin(({column_sql})::geography, ({point_sql})::geography, {distance_sql})',
+            [*column_params, *point_params, *distance_params],
+        )
+
+
+class PointX(Func):
+    """ST_X of a point column as a plain float (longitude for SRID 4326)"""
+    function = 'ST_X'
+    output_field = FloatField()
+
+
+class PointY(Func):
+    """ST_Y of a point column as a plain float (latitude for SRID 4326)"""
+    function = 'ST_Y'
+    output_field = FloatField()
+
+
+class SphereDistance(Func):
+    """ST_DistanceSphere in metres as a plain float, the same value Distance() returns
+    for this SRID 4326 column but without building a Distance object per row"""
+    output_field = FloatField()
+
+    def __init__(self, expression, point, **extra):
+        super().__init__(expression, Value(point.ewkt), **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column_sql, column_params = compiler.compile(self.source_expressions[0])
+        point_sql, point_params = compiler.compile(self.source_expressions[1])
+        return (
+            f'ST_DistanceSphere({column_sql}, ({point_sql})::geometry)',
+            [*column_params, *point_params],
+        )
+
+
+class RowAfter(Func):
+    """Row-value comparison "(a, b) > (x, y)" so a keyset page is one range scan of the
+    composite (a, b) index instead of an OR of two conditions"""
+    output_field = BooleanField()
+    conditional = True
+
+    def __init__(self, fields, values, **extra):
+        super().__init__(*[F(field) for field in fields], *[Value(value) for value in values], **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        compiled = [compiler.compile(expression) for expression in self.source_expressions]
+        half = len(compiled) // 2
+        columns, values = compiled[:half], compiled[half:]
+        return (
+            f'({", ".join(sql for sql, _ in columns)}) > ({", ".join(sql for sql, _ in values)})',
+            [param for _, params in compiled for param in params],
+        )
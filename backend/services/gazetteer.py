@@ -0,0 +1,196 @@
+import bisect
+import csv
+import heapq
+import logging
+import threading
+from array import array
+
+from django.conf import settings
+
+from .geocoding import in_ireland, normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Prefixes shorter than this match too many keys to scan per request,
+# so their top suggestions are precomputed when the gazetteer loads
+PRECOMPUTED_PREFIX_LENGTH = 3
+# Kinds whose bare name is too common to geocode on its own: a street is only matched
+# together with its county ("main street cork"), never as "main street"
+LOCALITY_KINDS = ('street',)
+
+
+class Gazetteer:
+    """Local Irish place/street gazetteer with a sorted-array prefix index"""
+
+    def __init__(self, entries, max_suggestions=10):
+        # Entries are (name, kind, county, lat, lng, population) tuples; their position in
+        # the list is their rank, most populous first, so smaller index = better match
+        self.entries = sorted(entries, key=lambda entry: (-entry[5], entry[0]))
+        self.max_suggestions = max_suggestions
+
+        # Prefix index: every word-start suffix of every name, sorted, with a parallel
+        # array of entry indices ("o connell street" is found by "conn" and "stre" too)
+        pairs = []
+        # Exact-match index used by geocoding: "name", "name county", "name co county".
+        # A more populous place wins a shared name; a name shared by equally ranked entries
+        # (two villages, two streets in one county) is ambiguous and left to the providers
+        self.exact = {}
+        ambiguous = set()
+        for index, (name, kind, county, lat, lng, population) in enumerate(self.entries):
+            key = normalize_query(name)
+            words = key.split(' ')
+            for start in range(len(words)):
+                pairs.append((' '.join(words[start:]), index))
+            county_key = normalize_query(county)
+            variants = [f'{key} {county_key}', f'{key} co {county_key}', f'{key} county {county_key}']
+            if kind not in LOCALITY_KINDS:
+                variants.append(key)
+            for variant in variants:
+                other = self.exact.setdefault(variant, index)
+                if other != index and self.entries[other][5] == population \
+                        and self.entries[other][3:5] != (lat, lng):
+                    ambiguous.add(variant)
+        for variant in ambiguous:
+            del self.exact[variant]
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.key_entries = array('I', (index for _, index in pairs))
+
+        # Min-segment tree over key_entries: node i holds the best rank below it, leaves
+        # start at len(key_entries). Any prefix range yields its best-ranked entries in
+        # O(limit log n) without scanning the range, however many keys it covers
+        size = len(self.key_entries)
+        self.rank_tree = array('I', [0]) * size + self.key_entries
+        for node in range(size - 1, 0, -1):
+            self.rank_tree[node] = min(self.rank_tree[2 * node], self.rank_tree[2 * node + 1])
+
+        self.precomputed = {}
+        for key, index in pairs:
+            for length in range(1, min(PRECOMPUTED_PREFIX_LENGTH, len(key) + 1)):
+                self.precomputed.setdefault(key[:length], set()).add(index)
+        self.precomputed = {
+            prefix: heapq.nsmallest(max_suggestions, indices)
+            for prefix, indices in self.precomputed.items()
+        }
+
+    @classmethod
+    def from_csv(cls, path, max_entries, max_suggestions=10):
+        entries = []
+        with open(path, newline='', encoding='utf-8') as handle:
+            for row in csv.DictReader(handle):
+                try:
+                    lat, lng = float(row['lat']), float(row['lng'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if not row.get('name') or not in_ireland(lat, lng):
+                    continue
+                entries.append((
+                    row['name'].strip(),
+                    (row.get('kind') or 'place').strip(),
+                    (row.get('county') or '').strip(),
+                    lat,
+                    lng,
+                    int(row.get('population') or 0),
+                ))
+                # Hard cap keeps memory bounded whatever file is configured
+                if len(entries) >= max_entries:
+                    logger.warning(f'Gazetteer truncated to {max_entries} entries')
+                    break
+        return cls(entries, max_suggestions)
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Best-ranked entry indices whose name (or any later word of it) starts with the prefix
+    def _match(self, prefix, limit):
+        if len(prefix) < PRECOMPUTED_PREFIX_LENGTH:
+            return self.precomputed.get(prefix, [])[:limit]
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + '\uffff', lo)
+        return self._best_ranked(lo, hi, limit)
+
+    # The `limit` smallest distinct entry indices in key_entries[lo:hi], smallest first:
+    # start from the tree nodes covering the range and expand the best one until enough
+    # leaves come out. An entry matched through several of its words comes out repeatedly
+    # in a row and is kept once
+    def _best_ranked(self, lo, hi, limit):
+        tree = self.rank_tree
+        size = len(self.key_entries)
+        heap = []
+        lo += size
+        hi += size
+        while lo < hi:
+            if lo & 1:
+                heap.append((tree[lo], lo))
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                heap.append((tree[hi], hi))
+            lo >>= 1
+            hi >>= 1
+        heapq.heapify(heap)
+        found = []
+        while heap and len(found) < limit:
+            index, node = heapq.heappop(heap)
+            if node >= size:
+                if not found or found[-1] != index:
+                    found.append(index)
+                continue
+            heapq.heappush(heap, (tree[2 * node], 2 * node))
+            heapq.heappush(heap, (tree[2 * node + 1], 2 * node + 1))
+        return found
+
+    def _entry_data(self, index):
+        name, kind, county, lat, lng, _ = self.entries[index]
+        return {'name': name, 'kind': kind, 'county': county, 'lat': lat, 'lng': lng}
+
+    def autocomplete(self, text, limit=None):
+        prefix = normalize_query(text)
+        if not prefix:
+            return []
+        limit = max(1, min(limit or self.max_suggestions, self.max_suggestions))
+        return [self._entry_data(index) for index in self._match(prefix, limit)]
+
+    # Geocode result in the same shape as the remote providers, or None
+    def lookup(self, normalized_query):
+        index = self.exact.get(normalized_query)
+        if index is None:
+            return None
+        name, kind, county, lat, lng, _ = self.entries[index]
+        return {
+            'lat': lat,
+            'lng': lng,
+            'formatted_address': f'{name}, Co. {county}' if county and county != name else name,
+            'confidence': 8,
+            'source': 'gazetteer'
+        }
+
+
+# Loaded once per worker; an empty gazetteer is used if the file is missing or disabled
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = load_gazetteer()
+    return _gazetteer
+
+
+def load_gazetteer():
+    if not settings.GAZETTEER_ENABLED:
+        return Gazetteer([])
+    try:
+        gazetteer = Gazetteer.from_csv(
+            settings.GAZETTEER_PATH,
+            settings.GAZETTEER_MAX_ENTRIES,
+            settings.GAZETTEER_MAX_SUGGESTIONS,
+        )
+    except OSError as e:
+        logger.warning(f'Gazetteer not loaded, using remote geocoding only: {e}')
+        return Gazetteer([])
+    logger.info(f'Gazetteer loaded with {len(gazetteer)} entries')
+    return gazetteer
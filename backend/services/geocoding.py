@@ -0,0 +1,582 @@
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import requests
+from asgiref.sync import sync_to_async
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from decouple import config
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+from .timing import phase
+
+# httpx is optional: it is only used by the async geocoding path (ASGI), which otherwise
+# runs the threaded remote lookup off the event loop
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# Bounding box of the island of Ireland; results outside it are rejected
+IRELAND_BOUNDS = {'min_lat': 51.4, 'max_lat': 55.4, 'min_lng': -10.5, 'max_lng': -5.5}
+
+
+class GeocodingError(Exception):
+    """Raised when providers fail or are unavailable (as opposed to finding nothing)"""
+
+
+def in_ireland(lat, lng):
+    return (IRELAND_BOUNDS['min_lat'] <= lat <= IRELAND_BOUNDS['max_lat']
+            and IRELAND_BOUNDS['min_lng'] <= lng <= IRELAND_BOUNDS['max_lng'])
+
+
+# Join the useful parts of a provider address (house number, road, suburb, city/town)
+def format_components(components):
+    address_parts = []
+    if components.get('house_number'):
+        address_parts.append(components['house_number'])
+    if components.get('road'):
+        address_parts.append(components['road'])
+    if components.get('suburb'):
+        address_parts.append(components['suburb'])
+    if components.get('city') or components.get('town'):
+        address_parts.append(components.get('city') or components.get('town'))
+    return ', '.join(address_parts)
+
+
+# One pooled keep-alive HTTP session per worker process, created lazily (after fork)
+# so provider calls reuse TCP/TLS connections instead of handshaking every time
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=settings.GEOCODE_POOL_SIZE,
+                    max_retries=0
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['User-Agent'] = 'EmergencyServicesLocator/1.0'
+                _session = session
+    return _session
+
+
+# One keep-alive async HTTP client per event loop (one per ASGI worker), for the async
+# geocoding path; connections are capped like the threaded path's provider calls
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            # Calls beyond the connection cap wait for a free connection without a deadline,
+            # as they would queue for a thread in the threaded path
+            timeout=httpx.Timeout(settings.GEOCODE_PROVIDER_TIMEOUT, pool=None),
+            limits=httpx.Limits(
+                max_connections=settings.GEOCODE_MAX_CONCURRENCY,
+                max_keepalive_connections=settings.GEOCODE_POOL_SIZE
+            ),
+            headers={'User-Agent': 'EmergencyServicesLocator/1.0'}
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def opencage_params(query):
+    return {
+        'q': f"{query}, Ireland",
+        'key': config('OPENCAGE_API_KEY', default=''),
+        'countrycode': 'ie',
+        'limit': 1,
+        'no_annotations': 1
+    }
+
+
+# Result dict from an OpenCage response body, or None when nothing usable is found
+def opencage_result(query, data):
+    if not data.get('results'):
+        return None
+    result = data['results'][0]
+    lat = result['geometry']['lat']
+    lng = result['geometry']['lng']
+    if not in_ireland(lat, lng):
+        return None
+
+    return {
+        'lat': lat,
+        'lng': lng,
+        'formatted_address': format_components(result.get('components', {})) or result.get('formatted', query),
+        'confidence': result.get('confidence', 0) / 10,
+        'source': 'opencage'
+    }
+
+
+def nominatim_params(query):
+    return {
+        'q': f"{query}, Ireland",
+        'format': 'json',
+        'limit': 1,
+        'addressdetails': 1,
+        'countrycodes': 'ie'
+    }
+
+
+# Result dict from a Nominatim response body, or None when nothing usable is found
+def nominatim_result(query, data):
+    if not data:
+        return None
+    result = data[0]
+    lat = float(result['lat'])
+    lng = float(result['lon'])
+    if not in_ireland(lat, lng):
+        return None
+
+    return {
+        'lat': lat,
+        'lng': lng,
+        'formatted_address': format_components(result.get('address') or {}) or result.get('display_name', query),
+        'confidence': 8,
+        'source': 'nominatim'
+    }
+
+
+# Query OpenCage; returns a result dict, or None when nothing usable is found
+def geocode_opencage(query):
+    response = get_session().get(
+        settings.GEOCODE_OPENCAGE_URL, params=opencage_params(query), timeout=settings.GEOCODE_PROVIDER_TIMEOUT
+    )
+    response.raise_for_status()
+    return opencage_result(query, response.json())
+
+
+# Query Nominatim; returns a result dict, or None when nothing usable is found
+def geocode_nominatim(query):
+    response = get_session().get(
+        settings.GEOCODE_NOMINATIM_URL, params=nominatim_params(query), timeout=settings.GEOCODE_PROVIDER_TIMEOUT
+    )
+    response.raise_for_status()
+    return nominatim_result(query, response.json())
+
+
+async def ageocode_opencage(query):
+    response = await get_async_client().get(settings.GEOCODE_OPENCAGE_URL, params=opencage_params(query))
+    response.raise_for_status()
+    return opencage_result(query, response.json())
+
+
+async def ageocode_nominatim(query):
+    response = await get_async_client().get(settings.GEOCODE_NOMINATIM_URL, params=nominatim_params(query))
+    response.raise_for_status()
+    return nominatim_result(query, response.json())
+
+
+class CircuitBreaker:
+    """Skips a provider after repeated failures, letting one trial call through after a cool-down"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            # Half-open: a single trial request decides whether to close again
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+PROVIDERS = {
+    'opencage': geocode_opencage,
+    'nominatim': geocode_nominatim,
+}
+ASYNC_PROVIDERS = {
+    'opencage': ageocode_opencage,
+    'nominatim': ageocode_nominatim,
+}
+
+breakers = {
+    name: CircuitBreaker(settings.GEOCODE_BREAKER_FAILURES, settings.GEOCODE_BREAKER_RESET)
+    for name in PROVIDERS
+}
+
+# Threads that run provider calls so a hedged request can start before the first returns
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _session_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.GEOCODE_MAX_CONCURRENCY, thread_name_prefix='geocode'
+                )
+    return _executor
+
+
+# Providers in priority order: OpenCage first when a key is configured, then Nominatim
+def provider_order():
+    api_key = config('OPENCAGE_API_KEY', default='')
+    if api_key and api_key.strip() != '':
+        return ['opencage', 'nominatim']
+    return ['nominatim']
+
+
+# Short error description that never includes the request URL (it carries the API key)
+def describe_error(error):
+    # requests.HTTPError and httpx.HTTPStatusError both carry the response
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return f'HTTP {response.status_code}'
+    return type(error).__name__
+
+
+# Circuit breaker state per provider, for the stats endpoint
+def provider_status():
+    return {name: breaker.state for name, breaker in breakers.items()}
+
+
+def _call_provider(name, query):
+    started = time.perf_counter()
+    try:
+        result = PROVIDERS[name](query)
+    except Exception:
+        breakers[name].record_failure()
+        metrics.observe_provider(name, 'error', time.perf_counter() - started)
+        raise
+    breakers[name].record_success()
+    metrics.observe_provider(name, 'ok' if result else 'empty', time.perf_counter() - started)
+    return result
+
+
+# Resolve a query through the remote providers with hedging: the next provider is started
+# if the in-flight ones have not answered within GEOCODE_HEDGE_DELAY_MS (or all came back
+# empty), and the first valid Ireland-bounded result wins. Providers whose circuit breaker
+# is open are skipped. Returns (result, complete): result is None when no provider found the
+# query, and complete is False when some provider failed or was skipped, so that miss is not
+# cached. Raises GeocodingError only when no provider answered at all
+def geocode_remote(query):
+    executor = get_executor()
+    hedge_delay = settings.GEOCODE_HEDGE_DELAY_MS / 1000
+    remaining = provider_order()
+    pending = {}
+    errors = []
+    skipped = []
+    answered = False
+
+    def launch_next():
+        while remaining:
+            name = remaining.pop(0)
+            if breakers[name].allow():
+                pending[executor.submit(_call_provider, name, query)] = name
+                return
+            skipped.append(f'{name}: circuit open')
+
+    launch_next()
+    while pending:
+        done, _ = wait(pending, timeout=hedge_delay if remaining else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.warning(f'Geocoding provider {name} failed: {describe_error(e)}')
+                errors.append(f'{name}: {describe_error(e)}')
+                continue
+            if result:
+                return result, True
+            answered = True
+        # Hedge when the delay passed without an answer or every in-flight call came back empty
+        if not done or not pending:
+            launch_next()
+
+    if answered:
+        return None, not (errors or skipped)
+    raise GeocodingError('; '.join(errors + skipped) or 'No geocoding provider available')
+
+
+async def _acall_provider(name, query):
+    started = time.perf_counter()
+    try:
+        result = await ASYNC_PROVIDERS[name](query)
+    except Exception:
+        breakers[name].record_failure()
+        metrics.observe_provider(name, 'error', time.perf_counter() - started)
+        raise
+    breakers[name].record_success()
+    metrics.observe_provider(name, 'ok' if result else 'empty', time.perf_counter() - started)
+    return result
+
+
+# geocode_remote on the event loop: provider calls are tasks instead of threads, so a
+# worker can wait on any number of slow providers while it keeps serving other requests.
+# Same hedging, breakers and result rules; a losing hedged call is left to finish so its
+# breaker still records the outcome
+async def ageocode_remote(query):
+    if httpx is None:
+        return await sync_to_async(geocode_remote, thread_sensitive=False)(query)
+
+    hedge_delay = settings.GEOCODE_HEDGE_DELAY_MS / 1000
+    remaining = provider_order()
+    pending = {}
+    errors = []
+    skipped = []
+    answered = False
+
+    def launch_next():
+        while remaining:
+            name = remaining.pop(0)
+            if breakers[name].allow():
+                pending[asyncio.ensure_future(_acall_provider(name, query))] = name
+                return
+            skipped.append(f'{name}: circuit open')
+
+    launch_next()
+    while pending:
+        done, _ = await asyncio.wait(
+            pending, timeout=hedge_delay if remaining else None, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            name = pending.pop(task)
+            try:
+                result = task.result()
+            except Exception as e:
+                logger.warning(f'Geocoding provider {name} failed: {describe_error(e)}')
+                errors.append(f'{name}: {describe_error(e)}')
+                continue
+            if result:
+                return result, True
+            answered = True
+        if not done or not pending:
+            launch_next()
+
+    if answered:
+        return None, not (errors or skipped)
+    raise GeocodingError('; '.join(errors + skipped) or 'No geocoding provider available')
+
+
+# Normalise query text so trivially different spellings share a cache entry:
+# case, punctuation, repeated whitespace and a trailing "Ireland" are ignored
+_APOSTROPHES = re.compile(r"['\u2019]")
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+_IRELAND_SUFFIX = re.compile(r"(?:\s+(?:republic of\s+)?(?:ireland|eire|ie))+$")
+
+
+def normalize_query(query):
+    text = _APOSTROPHES.sub('', query.lower())
+    text = _PUNCTUATION.sub(' ', text)
+    text = _WHITESPACE.sub(' ', text).strip()
+    return _IRELAND_SUFFIX.sub('', text).strip()
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU mapping with a per-entry expiry time"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Returns (found, value); expired entries count as missing and are dropped
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Marker stored in the shared tier for "no result" so it is distinguishable from a miss
+NEGATIVE_RESULT = {'not_found': True}
+
+
+class GeocodeCache:
+    """Two-tier geocode cache: per-process LRU in front of a shared Django cache"""
+
+    COUNTERS = ('memory_hits', 'shared_hits', 'negative_hits', 'misses', 'stores')
+
+    def __init__(self, max_size, ttl, negative_ttl, shared_alias='geocode'):
+        self.memory = LRUCache(max_size)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.shared_alias = shared_alias
+        self._counts = dict.fromkeys(self.COUNTERS, 0)
+        self._counts_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._counts_lock:
+            self._counts[name] += 1
+
+    # Hashed so arbitrary query text is a safe key for any cache backend
+    @staticmethod
+    def _shared_key(key):
+        return 'geocode:' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    # Returns (found, result); result is None for a cached "not found"
+    def get(self, key):
+        found, value = self.memory.get(key)
+        if found:
+            self._count('negative_hits' if value is None else 'memory_hits')
+            return True, value
+
+        try:
+            shared = caches[self.shared_alias].get(self._shared_key(key))
+        except Exception as e:
+            logger.warning(f'Shared geocode cache unavailable: {e}')
+            shared = None
+        if shared is not None:
+            value = None if shared == NEGATIVE_RESULT else shared
+            # Promote into this process; the shared tier already enforces its own expiry
+            self.memory.set(key, value, self.negative_ttl if value is None else self.ttl)
+            self._count('negative_hits' if value is None else 'shared_hits')
+            return True, value
+
+        self._count('misses')
+        return False, None
+
+    def set(self, key, result):
+        ttl = self.negative_ttl if result is None else self.ttl
+        self.memory.set(key, result, ttl)
+        try:
+            caches[self.shared_alias].set(
+                self._shared_key(key), NEGATIVE_RESULT if result is None else result, ttl
+            )
+        except Exception as e:
+            logger.warning(f'Shared geocode cache unavailable: {e}')
+        self._count('stores')
+
+    def stats(self):
+        with self._counts_lock:
+            counts = dict(self._counts)
+        lookups = sum(counts[name] for name in ('memory_hits', 'shared_hits', 'negative_hits', 'misses'))
+        hits = lookups - counts['misses']
+        return {
+            **counts,
+            'lookups': lookups,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'memory_entries': len(self.memory),
+            'memory_max_entries': self.memory.max_size,
+        }
+
+
+geocode_cache = GeocodeCache(
+    max_size=settings.GEOCODE_CACHE_MAX_ENTRIES,
+    ttl=settings.GEOCODE_CACHE_TTL,
+    negative_ttl=settings.GEOCODE_CACHE_NEGATIVE_TTL,
+)
+
+
+# Geocode locally first: the in-memory gazetteer, then the result cache, and only then
+# the remote providers. Provider failures are not cached so the next request retries:
+# neither GeocodingError nor a "not found" from some providers while others failed
+def geocode(query):
+    from .gazetteer import get_gazetteer
+
+    key = normalize_query(query)
+    if not key:
+        return None
+    result = get_gazetteer().lookup(key)
+    if result is not None:
+        metrics.count_geocode_lookup('gazetteer')
+        return result
+    found, result = geocode_cache.get(key)
+    if found:
+        metrics.count_geocode_lookup('cache')
+        return result
+    metrics.count_geocode_lookup('remote')
+    with phase('external'):
+        result, complete = geocode_remote(query)
+    if result is not None or complete:
+        geocode_cache.set(key, result)
+    return result
+
+
+# geocode for async views; the shared cache tier may block, so it is read and written
+# from a thread
+async def ageocode(query):
+    from .gazetteer import get_gazetteer
+
+    key = normalize_query(query)
+    if not key:
+        return None
+    result = get_gazetteer().lookup(key)
+    if result is not None:
+        metrics.count_geocode_lookup('gazetteer')
+        return result
+    found, result = await sync_to_async(geocode_cache.get)(key)
+    if found:
+        metrics.count_geocode_lookup('cache')
+        return result
+    metrics.count_geocode_lookup('remote')
+    with phase('external'):
+        result, complete = await ageocode_remote(query)
+    if result is not None or complete:
+        await sync_to_async(geocode_cache.set)(key, result)
+    return result
@@ -0,0 +1,209 @@
+import csv
+import hashlib
+import io
+import json
+import re
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+
+from .geocoding import in_ireland
+from .models import EmergencyService
+
+# Staging table columns, in COPY order
+STAGING_COLUMNS = (
+    'line_no', 'external_id', 'name', 'service_type', 'address', 'phone', 'email',
+    'lat', 'lng', 'capacity', 'is_24_hours', 'description',
+)
+SERVICE_TYPES = {value for value, _ in EmergencyService.SERVICE_TYPES}
+FIELD_LENGTHS = {
+    field: EmergencyService._meta.get_field(field).max_length
+    for field in ('external_id', 'name', 'address', 'phone', 'email')
+}
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n'}
+FEATURES_START = re.compile(r'"features"\s*:\s*\[')
+READ_SIZE = 1 << 16
+
+
+# Input readers: each yields one record at a time without loading the whole file
+# NDJSON lines are yielded undecoded so JSON parsing happens in the worker processes
+def read_csv(handle):
+    for row in csv.DictReader(handle):
+        yield row
+
+
+def read_ndjson(handle):
+    for line in handle:
+        line = line.strip()
+        if line:
+            yield line
+
+
+# Stream the features of a GeoJSON FeatureCollection one object at a time
+def read_geojson(handle):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        match = FEATURES_START.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        chunk = handle.read(READ_SIZE)
+        if not chunk:
+            raise ValueError('No "features" array found in GeoJSON input')
+        # Keep only a tail long enough to contain a split "features" key
+        buffer = buffer[-64:] + chunk
+
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,')
+        if not buffer:
+            chunk = handle.read(READ_SIZE)
+            if not chunk:
+                raise ValueError('GeoJSON input ended inside the "features" array')
+            buffer = chunk
+            continue
+        if buffer[0] == ']':
+            return
+        try:
+            feature, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = handle.read(READ_SIZE)
+            if not chunk:
+                raise ValueError('GeoJSON input ended inside a feature')
+            buffer += chunk
+            continue
+        yield feature
+        buffer = buffer[end:]
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson, 'geojson': read_geojson}
+
+
+def detect_format(path):
+    lowered = path.lower()
+    if lowered.endswith('.csv'):
+        return 'csv'
+    if lowered.endswith(('.ndjson', '.jsonl', '.geojsonl', '.geojsons')):
+        return 'ndjson'
+    if lowered.endswith(('.geojson', '.json')):
+        return 'geojson'
+    raise ValueError(f'Cannot detect the format of {path}; pass --format')
+
+
+def _first(record, *keys):
+    for key in keys:
+        value = record.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def _text(record, field, *keys, required=False):
+    value = _first(record, field, *keys)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f'{field} is required')
+    max_length = FIELD_LENGTHS.get(field)
+    if max_length and len(value) > max_length:
+        raise ValueError(f'{field} is longer than {max_length} characters')
+    return value
+
+
+def _boolean(value, default):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    lowered = str(value).strip().lower()
+    if lowered in TRUE_VALUES:
+        return True
+    if lowered in FALSE_VALUES:
+        return False
+    raise ValueError(f'is_24_hours must be a boolean, got {value!r}')
+
+
+# Validate one input record (flat CSV/NDJSON object or GeoJSON Feature) into staging values
+def clean_record(record):
+    if isinstance(record, str):
+        record = json.loads(record)
+    if not isinstance(record, dict):
+        raise ValueError('record is not an object')
+    if record.get('type') == 'Feature':
+        geometry = record.get('geometry') or {}
+        if geometry.get('type') != 'Point':
+            raise ValueError('geometry must be a Point')
+        lng, lat = geometry['coordinates'][:2]
+        properties = dict(record.get('properties') or {})
+        if record.get('id') is not None:
+            properties.setdefault('external_id', record['id'])
+        record = {**properties, 'lat': lat, 'lng': lng}
+
+    name = _text(record, 'name', required=True)
+    service_type = _text(record, 'service_type', 'type', required=True).lower()
+    if service_type not in SERVICE_TYPES:
+        raise ValueError(f'unknown service_type {service_type!r}')
+    address = _text(record, 'address', required=True)
+    phone = _text(record, 'phone')
+    email = _text(record, 'email')
+    if email:
+        try:
+            validate_email(email)
+        except ValidationError:
+            raise ValueError(f'invalid email {email!r}')
+
+    try:
+        lat = float(_first(record, 'lat', 'latitude'))
+        lng = float(_first(record, 'lng', 'lon', 'longitude'))
+    except (TypeError, ValueError):
+        raise ValueError('lat and lng must be numbers')
+    if not in_ireland(lat, lng):
+        raise ValueError(f'location {lat}, {lng} is outside Ireland')
+
+    capacity = _first(record, 'capacity')
+    try:
+        capacity = int(float(capacity)) if capacity is not None else 0
+    except (TypeError, ValueError):
+        raise ValueError('capacity must be a whole number')
+    if not 0 <= capacity <= 2 ** 31 - 1:
+        raise ValueError('capacity is out of range')
+
+    # Rows without a source id get a stable key from type, name and address
+    external_id = _text(record, 'external_id', 'id')
+    if not external_id:
+        digest = hashlib.sha1(f'{service_type}|{name.lower()}|{address.lower()}'.encode()).hexdigest()
+        external_id = f'auto:{digest}'
+
+    return (
+        external_id, name, service_type, address, phone, email, lat, lng, capacity,
+        _boolean(_first(record, 'is_24_hours'), True), _text(record, 'description'),
+    )
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, float):
+        return repr(value)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+# Worker entry point: validate a batch of (line_no, record) and render the valid rows as
+# COPY text, so the parent only has to stream bytes into PostgreSQL
+def validate_batch(batch):
+    buffer = io.StringIO()
+    valid = 0
+    errors = []
+    for line_no, record in batch:
+        try:
+            values = clean_record(record)
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            errors.append((line_no, str(e)))
+            continue
+        buffer.write('\t'.join(_copy_value(value) for value in (line_no, *values)))
+        buffer.write('\n')
+        valid += 1
+    return buffer.getvalue().encode(), valid, len(batch), errors
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.db import IntegrityError, connection
+
+from . import routing
+from .models import ServiceIsochrone
+
+logger = logging.getLogger(__name__)
+
+# Reached points are thinned to this grid (degrees, about 55 x 35 m) before the hull
+POINT_GRID_DEG = 0.0005
+# Margin added around the hull of reached roads; also turns a hull of one or two points
+# (a station on a tiny network) into an area
+ROAD_MARGIN_M = 50
+
+TABLE = ServiceIsochrone._meta.db_table
+SAVE_SQL = f'''
+INSERT INTO {TABLE} AS isochrone (service_id, minutes, method, signature, polygon, computed_at)
+VALUES (%s, %s, %s, %s, {{polygon}}, now())
+ON CONFLICT (service_id, minutes) DO UPDATE SET
+    method = EXCLUDED.method,
+    signature = EXCLUDED.signature,
+    polygon = EXCLUDED.polygon,
+    computed_at = EXCLUDED.computed_at
+'''
+# Concave hull of the reached points, widened by the road margin
+ROAD_POLYGON = (
+    'ST_Multi(ST_Buffer(ST_ConcaveHull(ST_GeomFromText(%s, 4326), %s)::geography, %s)::geometry)'
+)
+# Distance model: a circle of the distance coverable at the fallback speed
+DISTANCE_POLYGON = 'ST_Multi(ST_Buffer(ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, %s)::geometry)'
+
+
+# Hash of everything the polygon depends on; a stored isochrone whose signature differs
+# (service moved, new road graph, changed settings) is recomputed
+def isochrone_signature(lat, lng, minutes):
+    graph = routing.load_graph()
+    if graph is not None:
+        model = (f"road:{graph.meta.get('built_at')}:{settings.ROUTING_ACCESS_SPEED_KMH}:"
+                 f'{settings.ROUTING_MAX_SNAP_M}:{settings.ISOCHRONE_CONCAVITY}')
+    else:
+        model = f'distance:{settings.ISOCHRONE_FALLBACK_SPEED_KMH}'
+    return hashlib.sha1(f'{lat:.6f},{lng:.6f}|{minutes}|{model}'.encode()).hexdigest()
+
+
+# Upper bound on the distance from a service to any point of its isochrone: the fastest
+# road (or the fallback speed) for the whole time, plus the grid rounding and road margin
+def reach_m(minutes):
+    speed_kmh = max(settings.ISOCHRONE_MAX_SPEED_KMH, settings.ISOCHRONE_FALLBACK_SPEED_KMH)
+    return minutes * 60 * speed_kmh / 3.6 + POINT_GRID_DEG * 111_320 + ROAD_MARGIN_M
+
+
+# Worker entry point (no database access): ('road', MULTIPOINT WKT of the reachable area)
+# over the road graph, or ('distance', radius in metres) when there is no graph or the
+# service is too far from a road
+def compute_isochrone(lat, lng, minutes):
+    limit = minutes * 60
+    graph = routing.load_graph()
+    if graph is not None:
+        snapped = graph.snap(lat, lng, settings.ROUTING_MAX_SNAP_M)
+        if snapped is not None:
+            node, metres = snapped
+            budget = limit - metres / (settings.ROUTING_ACCESS_SPEED_KMH / 3.6)
+            if budget > 0:
+                cells = {
+                    (round(point_lng / POINT_GRID_DEG), round(point_lat / POINT_GRID_DEG))
+                    for point_lng, point_lat in graph.isochrone_points(node, budget)
+                }
+                cells.add((round(lng / POINT_GRID_DEG), round(lat / POINT_GRID_DEG)))
+                points = ','.join(
+                    f'{x * POINT_GRID_DEG:.6f} {y * POINT_GRID_DEG:.6f}' for x, y in cells
+                )
+                return 'road', f'MULTIPOINT({points})'
+    return 'distance', limit * settings.ISOCHRONE_FALLBACK_SPEED_KMH / 3.6
+
+
+def save_isochrone(service_id, lat, lng, minutes, signature, method, shape):
+    if method == 'road':
+        sql = SAVE_SQL.format(polygon=ROAD_POLYGON)
+        params = [shape, settings.ISOCHRONE_CONCAVITY, ROAD_MARGIN_M]
+    else:
+        sql = SAVE_SQL.format(polygon=DISTANCE_POLYGON)
+        params = [lng, lat, shape]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [service_id, minutes, method, signature, *params])
+    except IntegrityError:
+        # The service was deleted while its isochrone was being computed
+        logger.info(f'Isochrone for deleted service {service_id} discarded')
+
+
+# Stored isochrone as {'method', 'signature', 'computed_at', 'geometry'} or None
+def stored_isochrone(service_id, minutes):
+    row = ServiceIsochrone.objects.filter(service_id=service_id, minutes=minutes).values(
+        'method', 'signature', 'computed_at', geometry=AsGeoJSON('polygon', precision=6)
+    ).first()
+    if row is not None:
+        row['geometry'] = json.loads(row['geometry'])
+    return row
+
+
+# Background computation in this worker: a process pool runs the searches and a few
+# threads wait on it and save the results with their own database connections. The pool
+# is spawned, not forked (forking a threaded web worker can copy held locks into the
+# child); each child sets up Django and loads its own copy of the graph on first use.
+# Each (service, minutes) is queued once
+_processes = None
+_savers = None
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _get_processes():
+    global _processes
+    with _pending_lock:
+        if _processes is None:
+            _processes = ProcessPoolExecutor(
+                settings.ISOCHRONE_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup
+            )
+        return _processes
+
+
+# A pool whose child died (killed, out of memory) fails every later submit; it is dropped
+# so the next computation starts a new one
+def _discard_processes(pool):
+    global _processes
+    with _pending_lock:
+        if _processes is pool:
+            _processes = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _compute_and_save(service_id, lat, lng, minutes, signature):
+    try:
+        pool = _get_processes()
+        try:
+            method, shape = pool.submit(compute_isochrone, lat, lng, minutes).result()
+        except BrokenProcessPool:
+            logger.warning('Isochrone process pool broken, starting a new one')
+            _discard_processes(pool)
+            method, shape = _get_processes().submit(compute_isochrone, lat, lng, minutes).result()
+        save_isochrone(service_id, lat, lng, minutes, signature, method, shape)
+    except Exception as e:
+        logger.error(f'Isochrone for service {service_id} ({minutes} min) failed: {e}')
+    finally:
+        with _pending_lock:
+            _pending.discard((service_id, minutes))
+        connection.close()
+
+
+def schedule(service_id, lat, lng, minutes, signature):
+    global _savers
+    with _pending_lock:
+        if (service_id, minutes) in _pending:
+            return
+        if _savers is None:
+            _savers = ThreadPoolExecutor(settings.ISOCHRONE_WORKERS, thread_name_prefix='isochrone')
+        _pending.add((service_id, minutes))
+    _savers.submit(_compute_and_save, service_id, lat, lng, minutes, signature)
+
+
+def is_pending(service_id, minutes):
+    return (service_id, minutes) in _pending
+
+
+# Current isochrone for a service, or None after queueing its (re)computation
+def get_isochrone(service, minutes):
+    signature = isochrone_signature(service.latitude, service.longitude, minutes)
+    isochrone = stored_isochrone(service.id, minutes)
+    if isochrone is not None and isochrone['signature'] == signature:
+        return isochrone
+    schedule(service.id, service.latitude, service.longitude, minutes, signature)
+    return None
+
+
+# After a service is saved: compute the ISOCHRONE_PRECOMPUTE_MINUTES isochrones it lacks
+# (a new service has none) and recompute stored ones whose inputs changed (a new
+# location); edits to name, phone etc. leave them alone
+def service_changed(service):
+    stored = dict(ServiceIsochrone.objects.filter(service_id=service.id).values_list('minutes', 'signature'))
+    for minutes in sorted(set(stored) | set(settings.ISOCHRONE_PRECOMPUTE_MINUTES)):
+        current = isochrone_signature(service.latitude, service.longitude, minutes)
+        if stored.get(minutes) != current:
+            schedule(service.id, service.latitude, service.longitude, minutes, current)
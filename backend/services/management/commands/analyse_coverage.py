@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from services import coverage
+from services.models import EmergencyService
+from services.spatial_index import ServiceIndex
+
+SERVICE_TYPES = [value for value, _ in EmergencyService.SERVICE_TYPES]
+
+
+class Command(BaseCommand):
+    help = (
+        'Assign a population grid to the nearest service of each type and store per-station '
+        'Voronoi areas, loads and the worst-served cells for the coverage endpoint and map overlay'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('population', help='CSV of population grid cells: lat, lng, population')
+        parser.add_argument('--type', nargs='+', dest='types', choices=SERVICE_TYPES, help='Service types (default: all)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Assignment processes')
+        parser.add_argument('--gaps', type=int, default=200, help='Worst-served cells stored per type')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            population = coverage.read_population(options['population'])
+        except OSError as e:
+            raise CommandError(f'Population grid not read: {e}')
+        cells = len(population[0])
+        if not cells:
+            raise CommandError('The population grid has no populated cells')
+
+        service_types = options['types'] or SERVICE_TYPES
+        index = ServiceIndex(ServiceIndex.load_rows(), coverage_grid=settings.COVERAGE_GRID_ENABLED)
+        service_types = [service_type for service_type in service_types if service_type in index.service_types()]
+        if not service_types:
+            raise CommandError('No services of the requested types')
+        self.stdout.write(
+            f'Assigning {cells:,} populated cells to {len(index):,} services '
+            f'({", ".join(service_types)})'
+        )
+
+        workers = max(1, options['workers'])
+        gap_count = max(0, options['gaps'])
+        # Enough chunks to keep every worker busy to the end without per-cell task overhead
+        chunk = max(1000, cells // (workers * 8) + 1)
+        chunks = [(start, min(start + chunk, cells)) for start in range(0, cells, chunk)]
+        coverage.share(index, population, service_types, gap_count)
+        totals = {}
+        # Workers are forked after the index is built (shared, not rebuilt) and before any
+        # database connection is opened in this process
+        connections.close_all()
+        with multiprocessing.Pool(workers) as pool:
+            for done, result in enumerate(pool.imap_unordered(coverage.assign_chunk, chunks), start=1):
+                coverage.merge_chunk(totals, result, gap_count)
+                if done % workers == 0 or done == len(chunks):
+                    self.stdout.write(f'{min(done * chunk, cells):,} of {cells:,} cells assigned')
+
+        for service_type in service_types:
+            loads, gaps = totals.get(service_type, ({}, []))
+            coverage.store_results(service_type, loads, gaps)
+            self._report(service_type, loads, gaps)
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - started:.1f}s'))
+
+    def _report(self, service_type, loads, gaps):
+        people = sum(load[0] for load in loads.values())
+        weighted = sum(load[3] for load in loads.values())
+        farthest = max((load[2] for load in loads.values()), default=0.0)
+        busiest = max(loads.items(), key=lambda item: item[1][0], default=None)
+        self.stdout.write(
+            f'{service_type}: {people:,.0f} people, mean {weighted / max(people, 1) / 1000:.1f} km, '
+            f'max {farthest / 1000:.1f} km'
+            + (f', busiest service {busiest[0]} ({busiest[1][0]:,.0f} people)' if busiest else '')
+            + (f', worst gap {max(gaps)[0] / 1000:.1f} km' if gaps else '')
+        )
@@ -0,0 +1,173 @@
+import json
+import platform
+import resource
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from services import bench
+from services.models import EmergencyService
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Settings that change which code path serves a request, recorded with every results file
+RECORDED_SETTINGS = (
+    'SPATIAL_BACKEND', 'COVERAGE_GRID_ENABLED', 'ASYNC_READ_VIEWS', 'DATABASE_POOL',
+    'DATABASE_PREPARED_STATEMENTS',
+)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, timeout=5,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the read endpoints on seeded synthetic national-scale datasets: load 1k to 1M '
+        'services clustered around Irish towns, replay a query mix through the test client and/or '
+        'over HTTP, and write latency percentiles, queries per request and memory to a JSON file. '
+        'Synthetic rows are committed while the run lasts, so use a development or staging database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Synthetic services per run, up to 1000000 (each size grows the previous dataset)')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the datasets and the default query mix')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests in the default query mix')
+        parser.add_argument('--mix', help='Recorded query mix: request paths or access-log lines, one per line')
+        parser.add_argument('--url', help='Also replay over HTTP against this server (bypass nginx)')
+        parser.add_argument('--no-client', action='store_true', help='Skip the in-process test client replay')
+        parser.add_argument('--warmup', type=int, default=50, help='Untimed requests before each replay')
+        parser.add_argument('--memory-samples', type=int, default=20,
+                            help='Requests per endpoint traced for allocation peaks (test client only)')
+        parser.add_argument('--timeout', type=float, default=30, help='HTTP request timeout in seconds')
+        parser.add_argument('--output', default='bench_results.json', help='Results file')
+        parser.add_argument('--baseline', help='Earlier results file to compare p50/p99 against')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative p99 slowdown against the baseline that fails the run (0.2 = 20%%)')
+        parser.add_argument('--keep', action='store_true', help='Leave the largest synthetic dataset loaded')
+
+    def handle(self, *args, **options):
+        sizes = sorted(set(options['sizes']))
+        if not sizes or sizes[0] < 1 or sizes[-1] > 1000000:
+            raise CommandError('Sizes must be between 1 and 1000000')
+        if options['url'] and httpx is None:
+            raise CommandError('Replaying over HTTP needs httpx (pip install httpx)')
+        transports = ([] if options['no_client'] else ['client']) + (['http'] if options['url'] else [])
+        if not transports:
+            raise CommandError('Nothing to replay: give --url or drop --no-client')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as handle:
+                    baseline = json.load(handle)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Baseline not read: {e}')
+
+        try:
+            mix = bench.read_mix(options['mix']) if options['mix'] else None
+            # The dataset and the query mix draw from separate streams, so changing the
+            # number of requests does not change the data
+            data_sampler = bench.Sampler(options['seed'])
+            if mix is None:
+                mix = bench.default_mix(bench.Sampler(options['seed'] + 1), options['requests'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if not mix:
+            raise CommandError('The query mix has no requests for this project')
+
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'seed': options['seed'],
+                'mix': options['mix'] or f"default ({options['requests']} requests)",
+                'settings': {name: getattr(settings, name, None) for name in RECORDED_SETTINGS},
+            },
+            'runs': [],
+        }
+
+        removed = bench.remove_services()
+        if removed:
+            self.stdout.write(f'Removed {removed:,} synthetic services left by an earlier run')
+        loaded = 0
+        try:
+            for size in sizes:
+                started = time.perf_counter()
+                bench.load_services(data_sampler, loaded, size)
+                loaded = size
+                rows = EmergencyService.objects.count()
+                self.stdout.write(
+                    f'{rows:,} services ({size:,} synthetic) loaded in {time.perf_counter() - started:.1f}s'
+                )
+                for transport in transports:
+                    started = time.perf_counter()
+                    if transport == 'client':
+                        endpoints = bench.replay_client(mix, options['warmup'], options['memory_samples'])
+                    else:
+                        endpoints = bench.replay_http(mix, options['url'], options['warmup'], options['timeout'])
+                    run = {
+                        'rows': rows,
+                        'synthetic': size,
+                        'transport': transport,
+                        'endpoints': endpoints,
+                        'seconds': time.perf_counter() - started,
+                    }
+                    if transport == 'client':
+                        # Linux reports ru_maxrss in KiB
+                        run['max_rss_mib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                    results['runs'].append(run)
+                    self._report(run)
+        finally:
+            if not options['keep']:
+                bench.remove_services()
+
+        bench.write_results(options['output'], results)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        if baseline is not None:
+            self._compare(baseline, results, options['threshold'])
+
+    def _report(self, run):
+        self.stdout.write(f"{run['rows']:,} rows, {run['transport']}:")
+        self.stdout.write(
+            f"  {'endpoint':<16}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'max ms':>9}{'queries':>9}{'alloc KiB':>11}"
+        )
+        for endpoint, result in run['endpoints'].items():
+            cells = [result[key] for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+            line = f"  {endpoint:<16}{result['requests']:>9}{result['errors']:>8}"
+            line += ''.join(f'{cell:>9.1f}' if cell is not None else f"{'-':>9}" for cell in cells)
+            queries = result.get('queries_per_request')
+            line += f'{queries:>9.1f}' if queries is not None else f"{'-':>9}"
+            alloc = result.get('peak_alloc_kib')
+            line += f'{alloc:>11.0f}' if alloc is not None else f"{'-':>11}"
+            self.stdout.write(line)
+
+    def _compare(self, baseline, results, threshold):
+        changes = bench.compare(baseline, results)
+        if not changes:
+            self.stdout.write('No runs in common with the baseline')
+            return
+        regressions = []
+        self.stdout.write(f"Against the baseline ({baseline.get('meta', {}).get('commit') or 'unknown commit'}):")
+        for rows, transport, endpoint, metric, before, after, change in changes:
+            self.stdout.write(
+                f'  {rows:>9,} {transport:<7}{endpoint:<16}{metric:<8}{before:>9.1f} -> {after:>9.1f}  {change:+.0%}'
+            )
+            if metric == 'p99_ms' and change > threshold:
+                regressions.append(f'{endpoint} ({rows:,} rows, {transport}) p99 {change:+.0%}')
+        if regressions:
+            raise CommandError(f'p99 regressions over {threshold:.0%}: ' + '; '.join(regressions))
@@ -0,0 +1,137 @@
+import random
+import time
+
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from services.models import EmergencyService
+from services.renderers import FastJSONRenderer
+from services.rows import distance_values, encode_distance_rows, list_values
+
+# Synthetic services are spread over the island of Ireland around this point
+DUBLIN = (53.3498, -6.2603)
+
+
+class _Rollback(Exception):
+    pass
+
+
+# Previous list/by_type code path: model instances, GEOS-backed properties, Distance
+# objects and DRF's stdlib JSONRenderer
+def legacy_list(queryset):
+    data = [
+        {
+            'id': service.id,
+            'name': service.name,
+            'service_type': service.service_type,
+            'address': service.address,
+            'phone': service.phone,
+            'email': service.email,
+            'latitude': service.latitude,
+            'longitude': service.longitude,
+            'capacity': service.capacity,
+            'is_24_hours': service.is_24_hours,
+            'description': service.description
+        }
+        for service in queryset
+    ]
+    return JSONRenderer().render(data)
+
+
+def legacy_distance(queryset, point):
+    data = [
+        {
+            'id': service.id,
+            'name': service.name,
+            'service_type': service.service_type,
+            'address': service.address,
+            'phone': service.phone,
+            'latitude': service.latitude,
+            'longitude': service.longitude,
+            'is_24_hours': service.is_24_hours,
+            'distance': {'m': float(service.distance.m), 'km': round(service.distance.m / 1000, 2)}
+        }
+        for service in queryset.annotate(distance=Distance('location', point)).order_by('distance')
+    ]
+    return JSONRenderer().render(data)
+
+
+def fast_list(queryset):
+    return FastJSONRenderer().render(list(list_values(queryset)))
+
+
+def fast_distance(queryset, point):
+    return FastJSONRenderer().render(
+        encode_distance_rows(distance_values(queryset, point).order_by('distance_m'))
+    )
+
+
+class Command(BaseCommand):
+    help = 'Benchmark list/distance serialization (rows/sec) before and after the values() fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the best is reported')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        # Synthetic rows are inserted in a transaction that is always rolled back
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, options):
+        rng = random.Random(options['seed'])
+        point = Point(DUBLIN[1], DUBLIN[0], srid=4326)
+        baseline = EmergencyService.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        created = 0
+
+        self.stdout.write(f'{"rows":>8}  {"case":<10}  {"before rows/s":>14}  {"after rows/s":>14}  {"speed-up":>8}')
+        for size in sorted(options['sizes']):
+            EmergencyService.objects.bulk_create(
+                [self._synthetic(rng, created + i) for i in range(size - created)],
+                batch_size=5000,
+            )
+            created = max(created, size)
+            queryset = EmergencyService.objects.filter(id__gt=baseline)
+
+            for case, before, after in (
+                ('list', lambda: legacy_list(queryset), lambda: fast_list(queryset)),
+                ('distance', lambda: legacy_distance(queryset, point), lambda: fast_distance(queryset, point)),
+            ):
+                before_s = self._best(before, options['repeat'])
+                after_s = self._best(after, options['repeat'])
+                self.stdout.write(
+                    f'{size:>8}  {case:<10}  {size / before_s:>14,.0f}  {size / after_s:>14,.0f}'
+                    f'  {before_s / after_s:>7.1f}x'
+                )
+
+    @staticmethod
+    def _best(func, repeat):
+        timings = []
+        for _ in range(max(repeat, 1)):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    @staticmethod
+    def _synthetic(rng, number):
+        service_type = rng.choice(['hospital', 'police', 'fire'])
+        return EmergencyService(
+            name=f'Benchmark {service_type} {number}',
+            service_type=service_type,
+            address=f'{number} Benchmark Street, Dublin',
+            phone='+353 1 000 0000',
+            email='benchmark@example.com',
+            location=Point(rng.uniform(-10.4, -6.0), rng.uniform(51.4, 55.4), srid=4326),
+            capacity=rng.randint(0, 800),
+            is_24_hours=rng.random() < 0.5,
+            description='Synthetic row for benchmark_serialization',
+        )
@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from services.ingest import detect_format
+from services.roads import build_graph
+from services.routing import write_graph
+
+# Road extracts this command reads; PBF files are converted first (see help)
+GRAPH_FORMATS = ('geojson', 'ndjson')
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the road graph used by ?rank=travel_time from a GeoJSON or GeoJSON-sequence '
+        'road extract (convert OSM PBF first, e.g. osmium export ireland.osm.pbf -o roads.geojsonseq)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Road extract with LineString features tagged highway=*')
+        parser.add_argument('--format', choices=GRAPH_FORMATS, help='Input format (default: from the file extension)')
+        parser.add_argument('--output', default=settings.ROUTING_GRAPH_PATH, help='Graph file to write')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path.lower().endswith('.pbf'):
+            raise CommandError('PBF input is not read directly; convert it with osmium export or ogr2ogr first')
+        try:
+            fmt = options['format'] or detect_format(path)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if fmt not in GRAPH_FORMATS:
+            raise CommandError(f'Unsupported road extract format: {fmt}')
+
+        started = time.perf_counter()
+
+        def progress(done, total):
+            self.stdout.write(f'Contracted {done:,} of {total:,} nodes ({time.perf_counter() - started:.0f}s)')
+
+        try:
+            meta, arrays = build_graph(path, fmt, progress)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Road graph not built: {e}')
+        write_graph(options['output'], meta, arrays)
+
+        stats = meta['stats']
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['output']} ({os.path.getsize(options['output']) / 1e6:.1f} MB): "
+            f"{stats['nodes']:,} nodes ({stats['junctions'] - stats['nodes']:,} disconnected dropped), "
+            f"{stats['upward_edges']:,} upward edges in {stats['seconds']:.0f}s"
+        ))
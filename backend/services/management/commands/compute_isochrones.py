@@ -0,0 +1,67 @@
+import multiprocessing
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from services import routing
+from services.isochrones import compute_isochrone, isochrone_signature, save_isochrone
+from services.models import EmergencyService, ServiceIsochrone
+from services.rows import list_values
+
+
+def _compute(job):
+    service_id, lat, lng, minutes, signature = job
+    return (service_id, lat, lng, minutes, signature, *compute_isochrone(lat, lng, minutes))
+
+
+class Command(BaseCommand):
+    help = 'Compute service-area isochrones for many services at once (only missing or outdated ones)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, nargs='+', default=[8], help='Travel time limits')
+        parser.add_argument('--type', nargs='+', dest='types', choices=['hospital', 'police', 'fire'],
+                            help='Service types (default: all)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Search processes')
+        parser.add_argument('--force', action='store_true', help='Recompute current isochrones too')
+
+    def handle(self, *args, **options):
+        for minutes in options['minutes']:
+            if not 1 <= minutes <= settings.ISOCHRONE_MAX_MINUTES:
+                raise CommandError(f'--minutes must be from 1 to {settings.ISOCHRONE_MAX_MINUTES}')
+
+        services = EmergencyService.objects.all()
+        if options['types']:
+            services = services.filter(service_type__in=options['types'])
+        stored = {
+            (service_id, minutes): signature
+            for service_id, minutes, signature in ServiceIsochrone.objects.filter(
+                service__in=services
+            ).values_list('service_id', 'minutes', 'signature')
+        }
+        jobs = []
+        for row in list_values(services):
+            for minutes in options['minutes']:
+                signature = isochrone_signature(row['latitude'], row['longitude'], minutes)
+                if options['force'] or stored.get((row['id'], minutes)) != signature:
+                    jobs.append((row['id'], row['latitude'], row['longitude'], minutes, signature))
+        if not jobs:
+            self.stdout.write(self.style.SUCCESS('All isochrones are current'))
+            return
+
+        method = 'road graph' if routing.load_graph() is not None else 'distance model'
+        self.stdout.write(f'Computing {len(jobs):,} isochrones with the {method}')
+        started = time.perf_counter()
+        # Workers are forked after the graph is loaded (shared, not reloaded) and before
+        # any database connection is opened in this process
+        connections.close_all()
+        with multiprocessing.Pool(max(1, options['workers'])) as pool:
+            for done, result in enumerate(pool.imap_unordered(_compute, jobs), start=1):
+                save_isochrone(*result)
+                if done % 100 == 0:
+                    self.stdout.write(f'{done:,} of {len(jobs):,} saved')
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved {len(jobs):,} isochrones in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,180 @@
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from io import BytesIO
+from itertools import islice
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from services.data_version import bump_data_version
+from services.ingest import READERS, STAGING_COLUMNS, detect_format, validate_batch
+from services.models import EmergencyService
+
+# Errors printed in full; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+TABLE = EmergencyService._meta.db_table
+UPDATED_COLUMNS = (
+    'name', 'service_type', 'address', 'phone', 'email', 'location', 'capacity',
+    'is_24_hours', 'description',
+)
+
+STAGING_SQL = '''
+CREATE TEMPORARY TABLE IF NOT EXISTS import_services_staging (
+    line_no bigint,
+    external_id text,
+    name text,
+    service_type text,
+    address text,
+    phone text,
+    email text,
+    lat double precision,
+    lng double precision,
+    capacity integer,
+    is_24_hours boolean,
+    description text
+) ON COMMIT DELETE ROWS
+'''
+
+# Upsert on the external_id natural key; the last occurrence of a key in a batch wins, and
+# rows whose values did not change are left alone so updated_at (delta sync) stays put
+UPSERT_SQL = f'''
+INSERT INTO {TABLE} AS service (
+    external_id, name, service_type, address, phone, email, location, capacity,
+    is_24_hours, description, created_at, updated_at
+)
+SELECT DISTINCT ON (external_id)
+    external_id, name, service_type, address, phone, email,
+    ST_SetSRID(ST_MakePoint(lng, lat), 4326), capacity, is_24_hours, description, now(), now()
+FROM import_services_staging
+ORDER BY external_id, line_no DESC
+ON CONFLICT (external_id) DO UPDATE SET
+    {', '.join(f'{column} = EXCLUDED.{column}' for column in UPDATED_COLUMNS)},
+    updated_at = EXCLUDED.updated_at
+WHERE ({', '.join(f'service.{column}' for column in UPDATED_COLUMNS)})
+    IS DISTINCT FROM ({', '.join(f'EXCLUDED.{column}' for column in UPDATED_COLUMNS)})
+RETURNING (xmax = 0) AS inserted
+'''
+
+
+def _batches(records, size):
+    numbered = enumerate(records, start=1)
+    while True:
+        batch = list(islice(numbered, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Stream services from CSV, NDJSON or GeoJSON and upsert them on external_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin")
+        parser.add_argument('--format', choices=sorted(READERS), help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per validation batch and transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Validation processes')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, write nothing')
+        parser.add_argument('--no-isochrones', action='store_true',
+                            help='Skip computing isochrones for new and moved services')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            fmt = options['format'] or detect_format(path)
+        except ValueError as e:
+            raise CommandError(str(e))
+        batch_size = max(1, options['batch_size'])
+        workers = max(1, options['workers'])
+
+        self.totals = {'read': 0, 'valid': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'errors': 0}
+        # Whether any committed batch inserted or updated a row
+        self.changed = False
+        self.started = time.perf_counter()
+        self.last_report = 0.0
+
+        handle = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        # Workers are forked before any database connection is opened in this process
+        connections.close_all()
+        try:
+            with multiprocessing.Pool(workers) as pool:
+                # At most two batches per worker are in flight, so memory stays bounded
+                # whatever the input size
+                pending = deque()
+                for batch in _batches(READERS[fmt](handle), batch_size):
+                    pending.append(pool.apply_async(validate_batch, (batch,)))
+                    if len(pending) >= workers * 2:
+                        self._write(pending.popleft().get(), options['dry_run'])
+                while pending:
+                    self._write(pending.popleft().get(), options['dry_run'])
+        except ValueError as e:
+            raise CommandError(f'Import stopped: {e}')
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+            # Caches, tiles and the in-memory indexes of every worker follow the data version.
+            # It is bumped once for the whole import (also one stopped part way, whose earlier
+            # batches are committed), and not at all when nothing changed: every bump makes
+            # each serving worker reload the table
+            if self.changed:
+                bump_data_version()
+
+        self._report(final=True)
+        # The upsert bypasses the save signal, so the isochrones it would have queued for new
+        # and moved services are computed here (only missing or outdated ones)
+        if self.changed and not options['no_isochrones']:
+            call_command(
+                'compute_isochrones', minutes=settings.ISOCHRONE_PRECOMPUTE_MINUTES,
+                workers=workers, stdout=self.stdout, stderr=self.stderr,
+            )
+
+    # Load one validated batch: COPY into the staging table and upsert, in one transaction
+    def _write(self, result, dry_run):
+        copy_data, valid, read, errors = result
+        for line_no, message in errors[:max(0, MAX_REPORTED_ERRORS - self.totals['errors'])]:
+            self.stderr.write(f'Record {line_no}: {message}')
+        self.totals['read'] += read
+        self.totals['valid'] += valid
+        self.totals['errors'] += len(errors)
+
+        if valid and not dry_run:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(STAGING_SQL)
+                    cursor.copy_expert(
+                        f"COPY import_services_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN",
+                        BytesIO(copy_data),
+                    )
+                    cursor.execute(UPSERT_SQL)
+                    changed = [inserted for (inserted,) in cursor.fetchall()]
+                    cursor.execute('SELECT count(DISTINCT external_id) FROM import_services_staging')
+                    distinct = cursor.fetchone()[0]
+            self.changed = self.changed or bool(changed)
+            inserted = sum(changed)
+            self.totals['inserted'] += inserted
+            self.totals['updated'] += len(changed) - inserted
+            self.totals['unchanged'] += distinct - len(changed)
+
+        self._report()
+
+    def _report(self, final=False):
+        now = time.perf_counter()
+        if not final and now - self.last_report < 1.0:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        totals = self.totals
+        message = (
+            f"{totals['read']:,} read, {totals['valid']:,} valid, {totals['errors']:,} rejected | "
+            f"{totals['inserted']:,} inserted, {totals['updated']:,} updated, "
+            f"{totals['unchanged']:,} unchanged | {totals['read'] / elapsed:,.0f} rows/s"
+        )
+        if final:
+            self.stdout.write(self.style.SUCCESS(f'Done in {elapsed:.1f}s: {message}'))
+        else:
+            self.stdout.write(message)
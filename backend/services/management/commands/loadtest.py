@@ -0,0 +1,146 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Random incident points are drawn from this box around Dublin
+DUBLIN_BOX = (53.28, 53.42, -6.40, -6.10)
+# Fast read requests, cycled by every fast client
+FAST_ENDPOINTS = [
+    ('nearest', '/api/services/nearest/?lat={lat}&lng={lng}&limit=5'),
+    ('within_radius', '/api/services/within_radius/?lat={lat}&lng={lng}&radius=5'),
+    ('by_type', '/api/services/by_type/?lat={lat}&lng={lng}&type=hospital'),
+    ('statistics', '/api/services/statistics/'),
+]
+STUB_RESULT = json.dumps([{
+    'lat': '53.3498', 'lon': '-6.2603', 'display_name': 'Load test stub, Dublin', 'address': {}
+}]).encode()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Load-test a running server: many concurrent fast read requests while slow, uncached '
+            'geocode calls are in flight, to show whether slow requests block fast ones')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Server to test (bypass nginx)')
+        parser.add_argument('--duration', type=float, default=20, help='Seconds to run')
+        parser.add_argument('--concurrency', type=int, default=200, help='Concurrent fast-request clients')
+        parser.add_argument('--slow', type=int, default=50, help='Concurrent clients making uncached geocode calls')
+        parser.add_argument('--stub-port', type=int, default=None,
+                            help='Also serve a slow Nominatim stub on this port; start the server with '
+                                 'GEOCODE_NOMINATIM_URL=http://127.0.0.1:<port>/search')
+        parser.add_argument('--stub-delay', type=float, default=3.0, help='Seconds the stub takes per answer')
+
+    def handle(self, *args, **options):
+        if httpx is None:
+            raise CommandError('The load test needs httpx (pip install httpx)')
+        asyncio.run(self.run(options))
+
+    # Minimal HTTP/1.1 keep-alive server answering every request with one Nominatim result,
+    # after the configured delay: a provider that is slow but never fails
+    async def serve_stub(self, reader, writer, delay):
+        try:
+            while True:
+                await reader.readuntil(b'\r\n\r\n')
+                await asyncio.sleep(delay)
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: %d\r\n\r\n%s' % (len(STUB_RESULT), STUB_RESULT)
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Client gone, or the stub is shutting down with keep-alive connections open
+            pass
+        finally:
+            writer.close()
+
+    async def run(self, options):
+        stub = None
+        if options['stub_port'] is not None:
+            delay = options['stub_delay']
+            stub = await asyncio.start_server(
+                lambda reader, writer: self.serve_stub(reader, writer, delay), '127.0.0.1', options['stub_port']
+            )
+            self.stdout.write(f"Slow geocoder stub on 127.0.0.1:{options['stub_port']} ({delay}s per answer)")
+
+        latencies = {name: [] for name, _ in FAST_ENDPOINTS}
+        latencies['geocode'] = []
+        errors = dict.fromkeys(latencies, 0)
+        in_flight = {'fast': 0, 'slow': 0, 'peak': 0, 'peak_slow': 0}
+        deadline = time.monotonic() + options['duration']
+        clients = options['concurrency'] + options['slow']
+        query_ids = itertools.count()
+
+        async def request(client, name, path, kind):
+            in_flight[kind] += 1
+            in_flight['peak'] = max(in_flight['peak'], in_flight['fast'] + in_flight['slow'])
+            in_flight['peak_slow'] = max(in_flight['peak_slow'], in_flight['slow'])
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code >= 500:
+                    errors[name] += 1
+                else:
+                    latencies[name].append((time.perf_counter() - started) * 1000)
+            except httpx.HTTPError:
+                errors[name] += 1
+            finally:
+                in_flight[kind] -= 1
+
+        async def fast_client(client, offset):
+            for name, template in itertools.islice(itertools.cycle(FAST_ENDPOINTS), offset, None):
+                if time.monotonic() >= deadline:
+                    return
+                min_lat, max_lat, min_lng, max_lng = DUBLIN_BOX
+                path = template.format(lat=random.uniform(min_lat, max_lat), lng=random.uniform(min_lng, max_lng))
+                await request(client, name, path, 'fast')
+
+        # Every query is new, so it misses the gazetteer and both cache tiers
+        async def slow_client(client):
+            while time.monotonic() < deadline:
+                await request(client, 'geocode', f'/api/geocode/?query=loadtest+street+{next(query_ids)}', 'slow')
+
+        limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+        timeout = httpx.Timeout(options['duration'] + 60)
+        started = time.monotonic()
+        async with httpx.AsyncClient(base_url=options['url'], limits=limits, timeout=timeout) as client:
+            await asyncio.gather(
+                *(fast_client(client, offset) for offset in range(options['concurrency'])),
+                *(slow_client(client) for _ in range(options['slow']))
+            )
+        elapsed = time.monotonic() - started
+        if stub is not None:
+            stub.close()
+            await stub.wait_closed()
+
+        # Rates are over the test duration; slow calls still queued at the deadline are waited
+        # for, so the run itself can take longer
+        duration = options['duration']
+        self.stdout.write(
+            f"{clients} clients for {duration:.0f}s (finished after {elapsed:.1f}s); "
+            f"peak {in_flight['peak']} requests in flight, {in_flight['peak_slow']} of them slow geocodes"
+        )
+        self.stdout.write(
+            f"{'endpoint':<14}{'ok':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        )
+        for name, values in latencies.items():
+            values.sort()
+            self.stdout.write(
+                f'{name:<14}{len(values):>8}{errors[name]:>8}{len(values) / duration:>9.1f}'
+                f'{percentile(values, 0.50):>9.1f}{percentile(values, 0.95):>9.1f}'
+                f'{percentile(values, 0.99):>9.1f}{(values[-1] if values else 0):>9.1f}'
+            )
@@ -0,0 +1,168 @@
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+
+# prometheus_client is optional: without it (or with METRICS_ENABLED off) nothing is
+# recorded and /metrics is not routed. Under Gunicorn, start.sh sets
+# PROMETHEUS_MULTIPROC_DIR, so every worker writes its samples to memory-mapped files in
+# that directory and /metrics, served by any worker, sums them across the workers
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+except ImportError:
+    prometheus_client = None
+
+SERVICE_TYPES = ('hospital', 'police', 'fire')
+
+# Latency buckets in seconds; in-memory index answers take well under a millisecond
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROVIDER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0)
+RESULT_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 2500)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+if prometheus_client is not None:
+    REQUEST_DURATION = Histogram(
+        'emergency_api_request_duration_seconds', 'API request latency by endpoint action and service type',
+        ['action', 'service_type'], buckets=LATENCY_BUCKETS,
+    )
+    RESPONSES = Counter(
+        'emergency_api_responses_total', 'API responses by endpoint action and status class', ['action', 'status'],
+    )
+    WITHIN_RADIUS_RESULTS = Histogram(
+        'emergency_within_radius_results', 'Services returned per within_radius request', ['service_type'],
+        buckets=RESULT_COUNT_BUCKETS,
+    )
+    GEOCODE_LOOKUPS = Counter(
+        'emergency_geocode_lookups_total', 'Geocode lookups by the tier that answered them', ['source'],
+    )
+    PROVIDER_DURATION = Histogram(
+        'emergency_geocode_provider_duration_seconds', 'Geocoding provider call latency by outcome',
+        ['provider', 'outcome'], buckets=PROVIDER_BUCKETS,
+    )
+    DB_CONNECTIONS = Counter('emergency_db_connections_opened_total', 'Database connections opened', ['alias'])
+    DB_QUERIES = Histogram(
+        'emergency_db_query_duration_seconds', 'Database query latency', ['alias'], buckets=QUERY_BUCKETS,
+    )
+    DB_QUERY_ERRORS = Counter('emergency_db_query_errors_total', 'Database queries that raised an error', ['alias'])
+    AVAILABILITY_REPORTS = Counter('emergency_availability_reports_total', 'Availability reports stored')
+    # livesum: the open streams of the live workers
+    AVAILABILITY_STREAMS = Gauge(
+        'emergency_availability_streams', 'Open availability event streams', multiprocess_mode='livesum',
+    )
+
+
+def is_enabled():
+    return prometheus_client is not None and settings.METRICS_ENABLED
+
+
+# Action label of a resolved URL name: "service-within-radius" and its async route
+# "service-within-radius-async" are both "within_radius", "service-list" is "list"
+def action_name(url_name):
+    return url_name.removeprefix('service-').removesuffix('-async').replace('-', '_')
+
+
+# service_type label from ?type=; anything else would let clients create label values
+def service_type_label(request):
+    service_type = request.GET.get('type')
+    if not service_type:
+        return 'all'
+    return service_type if service_type in SERVICE_TYPES else 'invalid'
+
+
+def observe_within_radius(request, count):
+    if is_enabled():
+        WITHIN_RADIUS_RESULTS.labels(service_type_label(request)).observe(count)
+
+
+def count_geocode_lookup(source):
+    if is_enabled():
+        GEOCODE_LOOKUPS.labels(source).inc()
+
+
+# outcome: ok (usable result), empty (answered, nothing found) or error
+def observe_provider(provider, outcome, seconds):
+    if is_enabled():
+        PROVIDER_DURATION.labels(provider, outcome).observe(seconds)
+
+
+def count_availability_reports(count):
+    if is_enabled():
+        AVAILABILITY_REPORTS.inc(count)
+
+
+def stream_opened():
+    if is_enabled():
+        AVAILABILITY_STREAMS.inc()
+
+
+def stream_closed():
+    if is_enabled():
+        AVAILABILITY_STREAMS.dec()
+
+
+# connection_created receiver: count the connection and add the query wrapper, once per
+# connection wrapper object (they reconnect with the same object)
+def install_db_metrics(sender, connection, **kwargs):
+    DB_CONNECTIONS.labels(connection.alias).inc()
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_query(execute, sql, params, many, context):
+    alias = context['connection'].alias
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    except Exception:
+        DB_QUERY_ERRORS.labels(alias).inc()
+        raise
+    finally:
+        DB_QUERIES.labels(alias).observe(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """Records latency and status per resolved endpoint action"""
+    sync_capable = True
+    async_capable = True
+
+    # Under ASGI the handler chain is async when the rest of the middleware allows it;
+    # this one then stays on the event loop instead of adding a thread hop
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    def record(self, request, response, started):
+        # Static files and unrouted paths have no action and are not recorded
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.url_name and match.url_name != 'metrics':
+            action = action_name(match.url_name)
+            REQUEST_DURATION.labels(action, service_type_label(request)).observe(time.perf_counter() - started)
+            RESPONSES.labels(action, f'{response.status_code // 100}xx').inc()
+
+
+# Prometheus text format; in multiprocess mode the samples of every worker, live or dead
+def metrics_view(request):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return HttpResponse(prometheus_client.generate_latest(registry), content_type=prometheus_client.CONTENT_TYPE_LATEST)
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0001_initial'),
+    ]
+
+    # Functional GiST index on location::geography
+    # Lets nearest use index-driven KNN (<->) and within_radius use ST_DWithin in metres
+    operations = [
+        migrations.RunSQL(
+            sql=(
+                'CREATE INDEX IF NOT EXISTS services_em_location_geog_gist '
+                'ON services_emergencyservice USING GIST ((location::geography));'
+            ),
+            reverse_sql='DROP INDEX IF EXISTS services_em_location_geog_gist;',
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0003_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emergencyservice',
+            index=models.Index(fields=['name', 'id'], name='services_em_name_b3aae5_idx'),
+        ),
+    ]
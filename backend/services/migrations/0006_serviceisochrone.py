@@ -0,0 +1,32 @@
+from django.db import migrations, models
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0005_emergencyservice_external_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceIsochrone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minutes', models.PositiveSmallIntegerField()),
+                ('method', models.CharField(choices=[('road', 'Road network'), ('distance', 'Distance model')], max_length=10)),
+                ('signature', models.CharField(max_length=40)),
+                ('polygon', django.contrib.gis.db.models.fields.MultiPolygonField(srid=4326)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='isochrones', to='services.emergencyservice')),
+            ],
+            options={
+                'ordering': ['service', 'minutes'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='serviceisochrone',
+            constraint=models.UniqueConstraint(fields=('service', 'minutes'), name='unique_service_isochrone'),
+        ),
+    ]
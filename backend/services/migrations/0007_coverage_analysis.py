@@ -0,0 +1,45 @@
+from django.db import migrations, models
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0006_serviceisochrone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceArea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_type', models.CharField(db_index=True, max_length=20)),
+                ('polygon', django.contrib.gis.db.models.fields.MultiPolygonField(srid=4326)),
+                ('population', models.BigIntegerField(default=0)),
+                ('cells', models.IntegerField(default=0)),
+                ('max_distance_m', models.FloatField(null=True)),
+                ('mean_distance_m', models.FloatField(null=True)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='coverage_area', to='services.emergencyservice')),
+            ],
+            options={
+                'ordering': ['service_type', '-population'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CoverageGap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_type', models.CharField(db_index=True, max_length=20)),
+                ('location', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+                ('population', models.FloatField()),
+                ('distance_m', models.FloatField()),
+                ('computed_at', models.DateTimeField(auto_now_add=True)),
+                ('nearest_service', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='services.emergencyservice')),
+            ],
+            options={
+                'ordering': ['service_type', '-distance_m'],
+            },
+        ),
+    ]
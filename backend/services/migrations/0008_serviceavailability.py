@@ -0,0 +1,42 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0007_coverage_analysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceAvailability',
+            fields=[
+                ('service', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='availability', serialize=False, to='services.emergencyservice')),
+                ('available', models.IntegerField()),
+                ('status', models.CharField(choices=[('open', 'Open'), ('diverting', 'Diverting'), ('closed', 'Closed')], default='open', max_length=10)),
+                ('wait_minutes', models.IntegerField(null=True)),
+                ('updated_at', models.DateTimeField()),
+                ('seq', models.BigIntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'service availability',
+            },
+        ),
+        # Unlogged: no WAL for the frequent updates (the table is emptied after a crash and
+        # is not replicated). Half-empty pages and no index besides the key keep every update
+        # a HOT update in place; the table has one row per publishing service, so the feeds'
+        # polls scan it. The sequence orders the reports of a service
+        migrations.RunSQL(
+            sql=(
+                'ALTER TABLE services_serviceavailability SET UNLOGGED;'
+                'ALTER TABLE services_serviceavailability SET (fillfactor = 50);'
+                'CREATE SEQUENCE IF NOT EXISTS services_availability_seq;'
+            ),
+            reverse_sql=(
+                'DROP SEQUENCE IF EXISTS services_availability_seq;'
+                'ALTER TABLE services_serviceavailability RESET (fillfactor);'
+                'ALTER TABLE services_serviceavailability SET LOGGED;'
+            ),
+        ),
+    ]
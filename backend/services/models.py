@@ -28,6 +28,8 @@ class EmergencyService(models.Model):
     capacity = models.IntegerField(default=0, help_text="Bed capacity for hospitals") # Number of beds/seats
     is_24_hours = models.BooleanField(default=True) # Whether service operates 24/7
     description = models.TextField(blank=True) # Additional description
+    # Natural key from the source dataset, used by import_services to upsert
+    external_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True) # Set when record is created
@@ -37,6 +39,8 @@ class EmergencyService(models.Model):
         ordering = ['name'] # Order by name alphabetically
         indexes = [
             models.Index(fields=['service_type']), # Index for faster filtering by type
+            models.Index(fields=['updated_at']), # Index for delta sync (changes since a cursor)
+            models.Index(fields=['name', 'id']), # Index for keyset pagination in list order
         ]
     
     def __str__(self):
@@ -52,4 +56,116 @@ class EmergencyService(models.Model):
     @property
     def longitude(self):
         """Return longitude from Point"""
-        return self.location.x if self.location else None
\ No newline at end of file
+        return self.location.x if self.location else None
+
+
+# Tombstone recorded when an EmergencyService is deleted
+# Lets delta-sync clients remove rows from their local replica
+class ServiceDeletion(models.Model):
+    """Deletion log entry for delta sync"""
+    
+    service_id = models.BigIntegerField() # ID of the deleted service
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True) # When it was deleted
+    
+    class Meta:
+        ordering = ['deleted_at']
+    
+    def __str__(self):
+        return f"Service {self.service_id} deleted at {self.deleted_at}"
+
+
+# Area reachable from a service within a number of minutes (road network or distance model)
+# Recomputed in the background when the inputs recorded in `signature` change
+class ServiceIsochrone(models.Model):
+    """Service-area polygon for one service and travel time"""
+    
+    METHODS = [
+        ('road', 'Road network'),
+        ('distance', 'Distance model'),
+    ]
+    
+    service = models.ForeignKey(EmergencyService, on_delete=models.CASCADE, related_name='isochrones')
+    minutes = models.PositiveSmallIntegerField() # Travel time limit
+    method = models.CharField(max_length=10, choices=METHODS) # How the area was computed
+    signature = models.CharField(max_length=40) # Hash of the inputs (location, minutes, model)
+    polygon = models.MultiPolygonField(srid=4326) # Spatially indexed for point-in-polygon queries
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['service', 'minutes']
+        constraints = [
+            models.UniqueConstraint(fields=['service', 'minutes'], name='unique_service_isochrone'),
+        ]
+    
+    def __str__(self):
+        return f"{self.service} within {self.minutes} min"
+
+
+# Output of `manage.py analyse_coverage`: a service's Voronoi cell among services of its type
+# and the population that has it as the nearest service (its load)
+class ServiceArea(models.Model):
+    """Coverage analysis result for one service"""
+    
+    service = models.OneToOneField(EmergencyService, on_delete=models.CASCADE, related_name='coverage_area')
+    service_type = models.CharField(max_length=20, db_index=True) # Copied from the service for per-type runs
+    polygon = models.MultiPolygonField(srid=4326) # Voronoi cell clipped to the analysis extent
+    population = models.BigIntegerField(default=0) # People for whom this is the nearest service
+    cells = models.IntegerField(default=0) # Population grid cells assigned
+    max_distance_m = models.FloatField(null=True) # Farthest assigned cell
+    mean_distance_m = models.FloatField(null=True) # Population-weighted mean distance
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['service_type', '-population']
+    
+    def __str__(self):
+        return f"{self.service} serves {self.population}"
+
+
+# Worst-served population grid cells per service type, from the same analysis
+class CoverageGap(models.Model):
+    """Population cell far from its nearest service of a type"""
+    
+    service_type = models.CharField(max_length=20, db_index=True)
+    location = models.PointField(srid=4326) # Population grid cell centre
+    population = models.FloatField()
+    distance_m = models.FloatField() # To the nearest service of the type
+    nearest_service = models.ForeignKey(EmergencyService, on_delete=models.SET_NULL, null=True, related_name='+')
+    computed_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['service_type', '-distance_m']
+    
+    def __str__(self):
+        return f"{self.population:.0f} people {self.distance_m / 1000:.1f} km from a {self.service_type}"
+
+
+# Live availability published by the services themselves (POST /api/availability/)
+# Kept out of EmergencyService so updates every few seconds never lock or bloat its rows:
+# no foreign key constraint (which would take a share lock on the service row per write),
+# and the table is UNLOGGED (migration 0008), so writes skip the WAL. Its contents are lost
+# on a database crash, which is fine for figures that are republished every few seconds
+class ServiceAvailability(models.Model):
+    """Latest availability report for one service"""
+    
+    STATUSES = [
+        ('open', 'Open'), # Accepting patients / calls
+        ('diverting', 'Diverting'), # Asking ambulances to go elsewhere
+        ('closed', 'Closed'),
+    ]
+    
+    service = models.OneToOneField(
+        EmergencyService, on_delete=models.DO_NOTHING, db_constraint=False, primary_key=True,
+        related_name='availability'
+    )
+    available = models.IntegerField() # Free beds (hospitals) or units (police, fire)
+    status = models.CharField(max_length=10, choices=STATUSES, default='open')
+    wait_minutes = models.IntegerField(null=True) # Emergency department wait, if reported
+    updated_at = models.DateTimeField() # Set by the database on every report
+    seq = models.BigIntegerField() # From services_availability_seq; orders reports of a service
+    
+    class Meta:
+        verbose_name_plural = 'service availability'
+    
+    def __str__(self):
+        return f"{self.service_id}: {self.available} available ({self.status})"
@@ -0,0 +1,79 @@
+import base64
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .expressions import RowAfter
+
+# Keyset order: name as shown in the list, id to break ties between equal names
+KEYSET_FIELDS = ('name', 'id')
+
+
+def encode_cursor(row):
+    payload = json.dumps([row[field] for field in KEYSET_FIELDS], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    padded = token + '=' * (-len(token) % 4)
+    name, service_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    if not isinstance(name, str) or not isinstance(service_id, int):
+        raise ValueError('Malformed cursor')
+    return name, service_id
+
+
+# Each page seeks past the last row of the previous one through the (name, id) index,
+# so page 1000 costs the same as page 1. Every list response is a page: PAGE_SIZE rows
+# unless ?page_size= asks for more (up to KEYSET_MAX_PAGE_SIZE); the whole table is only
+# available as a streamed export (?stream=)
+class KeysetPagination(BasePagination):
+    """Cursor pagination on (name, id)"""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, api_settings.PAGE_SIZE))
+        except (TypeError, ValueError):
+            size = api_settings.PAGE_SIZE
+        return max(1, min(size, settings.KEYSET_MAX_PAGE_SIZE))
+
+    # Expects a values() queryset whose rows include the keyset fields
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*KEYSET_FIELDS)
+        token = request.query_params.get(self.cursor_query_param)
+        if token:
+            try:
+                after = decode_cursor(token)
+            except (ValueError, TypeError, UnicodeDecodeError):
+                raise NotFound('Invalid cursor')
+            queryset = queryset.filter(RowAfter(KEYSET_FIELDS, after))
+
+        # One extra row tells whether another page follows without a COUNT(*)
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.next_cursor = encode_cursor(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'cursor': self.next_cursor,
+            'results': data
+        })
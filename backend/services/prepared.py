@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db import connection
+
+from .models import EmergencyService
+
+# Server-side prepared statements for the database-backend nearest and within_radius
+# queries. Each is prepared once per connection, so later requests on the same (persistent
+# or pooled) connection skip parsing and planning and only send EXECUTE with the parameters.
+# Needs the project's database engine, whose connections track what they have prepared;
+# DATABASE_PREPARED_STATEMENTS is off behind PgBouncer, where consecutive transactions can
+# run on different server connections
+
+TABLE = EmergencyService._meta.db_table
+
+# $1 = lat, $2 = lng. Columns and order match rows.distance_values()
+POINT = 'ST_SetSRID(ST_MakePoint($2, $1), 4326)'
+DISTANCE_SELECT = f'''
+SELECT id, name, service_type, address, phone,
+    ST_Y(location) AS latitude, ST_X(location) AS longitude, is_24_hours,
+    ST_DistanceSphere(location, {POINT}) AS distance_m
+FROM {TABLE}
+'''
+# KNN order on the location::geography GiST index, as rows.nearest_rows(); $3 = limit
+NEAREST_ORDER = f'ORDER BY location::geography <-> {POINT}::geography LIMIT $3'
+# $3 = radius in metres
+WITHIN = f'ST_DWithin(location::geography, {POINT}::geography, $3)'
+
+# name: (parameter types, query); $4 is the service type where there is one
+STATEMENTS = {
+    'services_nearest': ('float8, float8, int8', f'{DISTANCE_SELECT} {NEAREST_ORDER}'),
+    'services_nearest_type': (
+        'float8, float8, int8, text', f'{DISTANCE_SELECT} WHERE service_type = $4 {NEAREST_ORDER}'
+    ),
+    'services_within': ('float8, float8, float8', f'{DISTANCE_SELECT} WHERE {WITHIN} ORDER BY distance_m'),
+    'services_within_type': (
+        'float8, float8, float8, text',
+        f'{DISTANCE_SELECT} WHERE {WITHIN} AND service_type = $4 ORDER BY distance_m'
+    ),
+}
+
+
+def is_enabled():
+    return settings.DATABASE_PREPARED_STATEMENTS
+
+
+# Run a prepared statement on this thread's connection, preparing it first if the
+# connection has not yet; rows come back as dicts like distance_values() rows
+def execute(name, params):
+    connection.ensure_connection()
+    prepared = connection.connection.prepared_statements
+    with connection.cursor() as cursor:
+        if name not in prepared:
+            types, query = STATEMENTS[name]
+            cursor.execute(f'PREPARE {name} ({types}) AS {query}')
+            prepared.add(name)
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+        columns = [column.name for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def nearest(lat, lng, limit, service_type=None):
+    if service_type:
+        return execute('services_nearest_type', [lat, lng, limit, service_type])
+    return execute('services_nearest', [lat, lng, limit])
+
+
+def within_radius(lat, lng, radius_m, service_type=None):
+    if service_type:
+        return execute('services_within_type', [lat, lng, radius_m, service_type])
+    return execute('services_within', [lat, lng, radius_m])
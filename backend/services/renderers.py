@@ -0,0 +1,133 @@
+import json
+import struct
+
+from rest_framework.utils import encoders
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .timing import timed
+
+# orjson and msgpack are optional; without orjson responses fall back to DRF's
+# stdlib-json renderer, without msgpack the binary format is simply not offered
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Columnar spatial responses: service types as small integer codes (index into 'types'),
+# coordinates as integers in millionths of a degree (about 11 cm), distances in whole metres
+SERVICE_TYPE_CODES = ['hospital', 'police', 'fire']
+COORDINATE_SCALE = 1_000_000
+MAX_UINT32 = 2 ** 32 - 1
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson when it is installed"""
+
+    # Types orjson does not know natively (Decimal, lazy strings, ...) go through DRF's encoder
+    _fallback = encoders.JSONEncoder().default
+
+    @timed('render')
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Indented output (?indent= / Accept: application/json; indent=4) keeps the stdlib path
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=self._fallback, option=orjson.OPT_NON_STR_KEYS)
+
+
+# Compact UTF-8 JSON bytes for one value, for code that writes JSON without a renderer
+# (streamed responses); same encoder choice as FastJSONRenderer
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=FastJSONRenderer._fallback, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')
+    ).encode()
+
+
+# Turn a spatial response ({..., 'services': [row, ...]}) into one array per field,
+# so key names are sent once and numbers are small integers. Other payloads (errors,
+# statistics) pass through unchanged. With binary=True the numeric columns are packed
+# little-endian (uint32 ids/distances, int32 coordinates, uint8 codes/flags) for typed arrays
+def columnar_payload(data, binary=False):
+    if not isinstance(data, dict) or not isinstance(data.get('services'), list):
+        return data
+    services = data['services']
+    numeric = {
+        'id': ('I', [service['id'] for service in services]),
+        'type': ('B', [SERVICE_TYPE_CODES.index(service['service_type']) for service in services]),
+        'lat': ('i', [round(service['latitude'] * COORDINATE_SCALE) for service in services]),
+        'lng': ('i', [round(service['longitude'] * COORDINATE_SCALE) for service in services]),
+        'distance_m': ('I', [
+            min(round(service['distance']['m']), MAX_UINT32) for service in services
+        ]),
+        'is_24_hours': ('B', [1 if service['is_24_hours'] else 0 for service in services]),
+    }
+    # ?rank=travel_time: whole seconds, MAX_UINT32 when there is no road route
+    if services and 'travel_time' in services[0]:
+        numeric['travel_time_s'] = ('I', [
+            MAX_UINT32 if service['travel_time'] is None
+            else min(round(service['travel_time']['s']), MAX_UINT32 - 1)
+            for service in services
+        ])
+    # ?rank=availability / ?min_available=: free capacity, -1 when there is no current report
+    if services and 'availability' in services[0]:
+        numeric['available'] = ('i', [
+            -1 if service['availability'] is None else service['availability']['available']
+            for service in services
+        ])
+    columns = {
+        name: struct.pack(f'<{len(values)}{code}', *values) if binary else values
+        for name, (code, values) in numeric.items()
+    }
+    for name in ('name', 'address', 'phone'):
+        columns[name] = [service[name] for service in services]
+    if 'available' in numeric:
+        columns['availability_status'] = [
+            None if service['availability'] is None else service['availability']['status'] for service in services
+        ]
+
+    payload = {key: value for key, value in data.items() if key != 'services'}
+    payload['types'] = SERVICE_TYPE_CODES
+    payload['scale'] = COORDINATE_SCALE
+    payload['columns'] = columns
+    return payload
+
+
+class ColumnarJSONRenderer(BaseRenderer):
+    """Spatial results as columnar JSON (Accept: application/vnd.emergency.columnar+json)"""
+    media_type = 'application/vnd.emergency.columnar+json'
+    format = 'columnar'
+    charset = None
+
+    @timed('render')
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(columnar_payload(data))
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Spatial results as columnar MessagePack with packed numeric columns
+    (Accept: application/x-msgpack)"""
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+    charset = None
+
+    @timed('render')
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(columnar_payload(data, binary=True), use_bin_type=True)
+
+
+# Extra renderers offered by the spatial actions, after JSON so */* still gets JSON
+COLUMNAR_RENDERERS = [ColumnarJSONRenderer]
+if msgpack is not None:
+    COLUMNAR_RENDERERS.append(MessagePackRenderer)
@@ -0,0 +1,345 @@
+import heapq
+import json
+import logging
+import math
+import re
+import time
+from array import array
+
+from .ingest import read_geojson, read_ndjson
+from .spatial_index import haversine_m
+
+logger = logging.getLogger(__name__)
+
+# Free-flow speeds in km/h by OSM highway class, used when a road has no usable maxspeed
+# Classes not listed (footways, tracks, ...) are not routable
+HIGHWAY_SPEEDS = {
+    'motorway': 100, 'motorway_link': 60,
+    'trunk': 80, 'trunk_link': 50,
+    'primary': 65, 'primary_link': 40,
+    'secondary': 55, 'secondary_link': 35,
+    'tertiary': 45, 'tertiary_link': 30,
+    'unclassified': 35, 'residential': 25, 'living_street': 10,
+    'service': 15, 'road': 30,
+}
+ONEWAY_FORWARD = {'yes', 'true', '1'}
+ONEWAY_BACKWARD = {'-1', 'reverse'}
+ONEWAY_JUNCTIONS = {'roundabout', 'circular'}
+MAXSPEED = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(mph)?', re.IGNORECASE)
+# Settled-node bound for witness searches during contraction; a witness missed because
+# of the bound only adds a redundant shortcut, never a wrong distance
+WITNESS_SETTLE_LIMIT = 50
+# Snapping grid cell size in degrees (about 1.1 x 0.7 km)
+SNAP_CELL_DEG = 0.01
+
+INFINITY = float('inf')
+
+
+def _maxspeed(value):
+    match = MAXSPEED.match(str(value or ''))
+    if not match:
+        return None
+    speed = float(match.group(1)) * (1.609344 if match.group(2) else 1.0)
+    return speed if speed > 0 else None
+
+
+def _features(path, fmt):
+    reader = read_geojson if fmt == 'geojson' else read_ndjson
+    with open(path, encoding='utf-8') as handle:
+        for feature in reader(handle):
+            # GeoJSON sequence lines arrive undecoded
+            yield json.loads(feature) if isinstance(feature, str) else feature
+
+
+# Routable roads as (coordinates, speed km/h, forward allowed, backward allowed)
+def _road_lines(path, fmt):
+    for feature in _features(path, fmt):
+        properties = feature.get('properties') or {}
+        highway = properties.get('highway')
+        default_speed = HIGHWAY_SPEEDS.get(highway)
+        if default_speed is None:
+            continue
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') == 'LineString':
+            parts = [geometry.get('coordinates') or []]
+        elif geometry.get('type') == 'MultiLineString':
+            parts = geometry.get('coordinates') or []
+        else:
+            continue
+        speed = _maxspeed(properties.get('maxspeed')) or default_speed
+        oneway = str(properties.get('oneway') or '').lower()
+        if oneway in ONEWAY_BACKWARD:
+            forward, backward = False, True
+        elif oneway in ONEWAY_FORWARD or (oneway != 'no' and (
+                highway == 'motorway' or properties.get('junction') in ONEWAY_JUNCTIONS)):
+            forward, backward = True, False
+        else:
+            forward, backward = True, True
+        for coordinates in parts:
+            if len(coordinates) >= 2:
+                yield coordinates, speed, forward, backward
+
+
+def _key(lng, lat):
+    return round(lat * 1e7), round(lng * 1e7)
+
+
+# Read the extract into junction-to-junction edges. Pass 1 finds the vertices shared by
+# several roads or ending one; pass 2 joins the vertices in between into single edges,
+# so only junctions become graph nodes
+def read_network(path, fmt):
+    uses = {}
+    for coordinates, _, _, _ in _road_lines(path, fmt):
+        last = len(coordinates) - 1
+        for position, point in enumerate(coordinates):
+            key = _key(point[0], point[1])
+            uses[key] = uses.get(key, 0) + (2 if position in (0, last) else 1)
+
+    node_ids = {}
+    lats, lngs = array('d'), array('d')
+    edges = {}
+
+    def node_for(key):
+        node = node_ids.get(key)
+        if node is None:
+            node = node_ids[key] = len(lats)
+            lats.append(key[0] / 1e7)
+            lngs.append(key[1] / 1e7)
+        return node
+
+    def add_edge(source, target, seconds):
+        if seconds < edges.get((source, target), INFINITY):
+            edges[source, target] = seconds
+
+    for coordinates, speed, forward, backward in _road_lines(path, fmt):
+        metres_per_second = speed / 3.6
+        start, length, previous = None, 0.0, None
+        for point in coordinates:
+            lng, lat = point[0], point[1]
+            if previous is not None:
+                length += haversine_m(previous[1], previous[0], lat, lng)
+            previous = (lng, lat)
+            key = _key(lng, lat)
+            if uses.get(key, 0) < 2:
+                continue
+            node = node_for(key)
+            if start is not None and node != start:
+                seconds = length / metres_per_second
+                if forward:
+                    add_edge(start, node, seconds)
+                if backward:
+                    add_edge(node, start, seconds)
+            start, length = node, 0.0
+    return lats, lngs, edges
+
+
+# Nodes of the largest strongly connected component (iterative Kosaraju), so every kept
+# node can reach every other one; islands and one-way dead ends are dropped
+def largest_component(count, out_adj, in_adj):
+    seen = bytearray(count)
+    order = []
+    for root in range(count):
+        if seen[root]:
+            continue
+        seen[root] = 1
+        stack = [(root, iter(out_adj[root]))]
+        while stack:
+            node, neighbours = stack[-1]
+            for target in neighbours:
+                if not seen[target]:
+                    seen[target] = 1
+                    stack.append((target, iter(out_adj[target])))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
+
+    component = array('i', [-1]) * count
+    sizes = []
+    for root in reversed(order):
+        if component[root] >= 0:
+            continue
+        label = len(sizes)
+        component[root] = label
+        stack = [root]
+        size = 0
+        while stack:
+            node = stack.pop()
+            size += 1
+            for source in in_adj[node]:
+                if component[source] < 0:
+                    component[source] = label
+                    stack.append(source)
+        sizes.append(size)
+    if not sizes:
+        return []
+    largest = max(range(len(sizes)), key=sizes.__getitem__)
+    return [node for node in range(count) if component[node] == largest]
+
+
+def _witness_distances(out_adj, source, skip, targets, max_seconds):
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    remaining = set(targets)
+    settled = 0
+    while heap and remaining and settled < WITNESS_SETTLE_LIMIT:
+        seconds, node = heapq.heappop(heap)
+        if seconds > dist[node]:
+            continue
+        if seconds > max_seconds:
+            break
+        remaining.discard(node)
+        settled += 1
+        for target, weight in out_adj[node].items():
+            if target == skip:
+                continue
+            candidate = seconds + weight
+            if candidate < dist.get(target, INFINITY):
+                dist[target] = candidate
+                heapq.heappush(heap, (candidate, target))
+    return dist
+
+
+# Shortcuts (source, target, seconds) needed so that removing `node` changes no distance:
+# u -> node -> x is kept as a shortcut unless a witness path u -> x avoiding node is as short
+def _shortcuts(out_adj, in_adj, node):
+    found = []
+    outgoing = out_adj[node]
+    for source, weight_in in in_adj[node].items():
+        targets = {
+            target: weight_in + weight_out
+            for target, weight_out in outgoing.items() if target != source
+        }
+        if not targets:
+            continue
+        dist = _witness_distances(out_adj, source, node, targets, max(targets.values()))
+        for target, via in targets.items():
+            if dist.get(target, INFINITY) > via:
+                found.append((source, target, via))
+    return found
+
+
+# Contraction hierarchy: nodes are removed cheapest first (edge difference plus contracted
+# neighbours, updated lazily), adding shortcuts as needed. The edges a node still has when
+# it is removed all lead to later (higher) nodes and form the upward graphs
+def contract(out_adj, in_adj, progress=None):
+    count = len(out_adj)
+    contracted_neighbours = [0] * count
+    # Hierarchy depth below each node; preferring shallow nodes keeps upward searches short
+    levels = [0] * count
+
+    def priority(node, shortcuts):
+        return (len(shortcuts) - len(in_adj[node]) - len(out_adj[node])
+                + contracted_neighbours[node] + levels[node])
+
+    heap = [(priority(node, _shortcuts(out_adj, in_adj, node)), node) for node in range(count)]
+    heapq.heapify(heap)
+    up_out = [None] * count
+    up_in = [None] * count
+    done = 0
+    while heap:
+        _, node = heapq.heappop(heap)
+        shortcuts = _shortcuts(out_adj, in_adj, node)
+        current = priority(node, shortcuts)
+        if heap and current > heap[0][0]:
+            heapq.heappush(heap, (current, node))
+            continue
+
+        up_out[node], up_in[node] = out_adj[node], in_adj[node]
+        out_adj[node], in_adj[node] = {}, {}
+        for target in up_out[node]:
+            del in_adj[target][node]
+        for source in up_in[node]:
+            del out_adj[source][node]
+        for neighbour in up_out[node].keys() | up_in[node].keys():
+            contracted_neighbours[neighbour] += 1
+            levels[neighbour] = max(levels[neighbour], levels[node] + 1)
+        for source, target, seconds in shortcuts:
+            if seconds < out_adj[source].get(target, INFINITY):
+                out_adj[source][target] = seconds
+                in_adj[target][source] = seconds
+
+        done += 1
+        if progress and done % 10000 == 0:
+            progress(done, count)
+    return up_out, up_in
+
+
+def _csr(adjacency):
+    offsets = array('I', [0])
+    targets = array('I')
+    weights = array('f')
+    for edges in adjacency:
+        for target, seconds in edges.items():
+            targets.append(target)
+            weights.append(seconds)
+        offsets.append(len(targets))
+    return offsets, targets, weights
+
+
+# Nodes bucketed by SNAP_CELL_DEG cell for nearest-node lookups
+def _snap_grid(lats, lngs):
+    min_lat, min_lng = min(lats), min(lngs)
+    rows = math.floor((max(lats) - min_lat) / SNAP_CELL_DEG) + 1
+    cols = math.floor((max(lngs) - min_lng) / SNAP_CELL_DEG) + 1
+    cells = sorted(
+        (math.floor((lat - min_lat) / SNAP_CELL_DEG) * cols + math.floor((lng - min_lng) / SNAP_CELL_DEG), node)
+        for node, (lat, lng) in enumerate(zip(lats, lngs))
+    )
+    offsets = array('I', [0]) * (rows * cols + 1)
+    for cell, _ in cells:
+        offsets[cell + 1] += 1
+    for cell in range(rows * cols):
+        offsets[cell + 1] += offsets[cell]
+    grid = {'min_lat': min_lat, 'min_lng': min_lng, 'cell_deg': SNAP_CELL_DEG, 'rows': rows, 'cols': cols}
+    return grid, offsets, array('I', (node for _, node in cells))
+
+
+# Full pipeline from a road extract to the arrays and metadata written by write_graph
+def build_graph(path, fmt, progress=None):
+    started = time.perf_counter()
+    lats, lngs, edges = read_network(path, fmt)
+    count = len(lats)
+    out_adj = [{} for _ in range(count)]
+    in_adj = [{} for _ in range(count)]
+    for (source, target), seconds in edges.items():
+        out_adj[source][target] = seconds
+        in_adj[target][source] = seconds
+    stats = {'junctions': count, 'edges': len(edges)}
+    del edges
+
+    keep = largest_component(count, out_adj, in_adj)
+    if not keep:
+        raise ValueError('No routable roads found in the extract')
+    renumber = {old: new for new, old in enumerate(keep)}
+    out_adj = [
+        {renumber[target]: seconds for target, seconds in out_adj[old].items() if target in renumber}
+        for old in keep
+    ]
+    in_adj = [
+        {renumber[source]: seconds for source, seconds in in_adj[old].items() if source in renumber}
+        for old in keep
+    ]
+    lats = array('d', (lats[old] for old in keep))
+    lngs = array('d', (lngs[old] for old in keep))
+    stats['nodes'] = len(keep)
+    logger.info(f"Road network read: {stats['junctions']} junctions, {stats['nodes']} connected")
+
+    # The plain graph is kept for one-to-all searches (isochrones); contraction consumes it
+    out_offsets, out_targets, out_weights = _csr(out_adj)
+    up_out, up_in = contract(out_adj, in_adj, progress)
+    fwd_offsets, fwd_targets, fwd_weights = _csr(up_out)
+    bwd_offsets, bwd_targets, bwd_weights = _csr(up_in)
+    stats['upward_edges'] = len(fwd_targets) + len(bwd_targets)
+
+    grid, cell_offsets, cell_nodes = _snap_grid(lats, lngs)
+    stats['seconds'] = round(time.perf_counter() - started, 1)
+    meta = {'grid': grid, 'stats': stats, 'built_at': time.time()}
+    arrays = {
+        'lat': lats, 'lng': lngs,
+        'out_offsets': out_offsets, 'out_targets': out_targets, 'out_weights': out_weights,
+        'fwd_offsets': fwd_offsets, 'fwd_targets': fwd_targets, 'fwd_weights': fwd_weights,
+        'bwd_offsets': bwd_offsets, 'bwd_targets': bwd_targets, 'bwd_weights': bwd_weights,
+        'cell_offsets': cell_offsets, 'cell_nodes': cell_nodes,
+    }
+    return meta, arrays
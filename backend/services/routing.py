@@ -0,0 +1,353 @@
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+from array import array
+
+from django.conf import settings
+
+from .data_version import get_data_version, recent_data_version
+from .spatial_index import EARTH_RADIUS_M, ServiceIndex, haversine_m, refresh_in_background
+
+logger = logging.getLogger(__name__)
+
+GRAPH_FORMAT = 'emergency-road-graph/1'
+# Travel time sentinel for "not reachable"
+INFINITY = float('inf')
+
+
+# Road graph file: one JSON header line (format, metadata, array names/typecodes/lengths)
+# followed by the raw array bytes in native byte order, so loading is a few reads
+def write_graph(path, meta, arrays):
+    header = {
+        'format': GRAPH_FORMAT,
+        'meta': meta,
+        'arrays': [[name, data.typecode, len(data)] for name, data in arrays.items()],
+    }
+    partial = f'{path}.partial'
+    with open(partial, 'wb') as handle:
+        handle.write(json.dumps(header).encode() + b'\n')
+        for data in arrays.values():
+            data.tofile(handle)
+    os.replace(partial, path)
+
+
+def read_graph(path):
+    with open(path, 'rb') as handle:
+        header = json.loads(handle.readline())
+        if header.get('format') != GRAPH_FORMAT:
+            raise ValueError(f'{path} is not a {GRAPH_FORMAT} file')
+        arrays = {}
+        for name, typecode, length in header['arrays']:
+            data = array(typecode)
+            data.fromfile(handle, length)
+            arrays[name] = data
+    return header['meta'], arrays
+
+
+class RoadGraph:
+    """Contraction-hierarchy road graph: upward searches plus nearest-node snapping"""
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.lats = arrays['lat']
+        self.lngs = arrays['lng']
+        # Upward edges in CSR form: forward (node -> higher node) and backward
+        # (higher node -> node, stored on the lower node), weights in seconds
+        self._forward = (arrays['fwd_offsets'], arrays['fwd_targets'], arrays['fwd_weights'])
+        self._backward = (arrays['bwd_offsets'], arrays['bwd_targets'], arrays['bwd_weights'])
+        # The plain (uncontracted) graph for one-to-all searches
+        self._plain = (arrays['out_offsets'], arrays['out_targets'], arrays['out_weights'])
+        # Snapping grid: nodes bucketed by cell, cells in row-major order
+        grid = meta['grid']
+        self.min_lat = grid['min_lat']
+        self.min_lng = grid['min_lng']
+        self.cell_deg = grid['cell_deg']
+        self.rows = grid['rows']
+        self.cols = grid['cols']
+        self._cell_offsets = arrays['cell_offsets']
+        self._cell_nodes = arrays['cell_nodes']
+        # Shortest side of any cell in metres (east-west side at the northern edge)
+        north = math.radians(self.min_lat + self.rows * self.cell_deg)
+        self._min_cell_m = math.radians(self.cell_deg) * EARTH_RADIUS_M * max(math.cos(north), 0.01)
+
+    @classmethod
+    def load(cls, path):
+        meta, arrays = read_graph(path)
+        return cls(meta, arrays)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _ring(self, row, col, ring):
+        for r in range(max(row - ring, 0), min(row + ring, self.rows - 1) + 1):
+            edge = abs(r - row) == ring
+            for c in range(max(col - ring, 0), min(col + ring, self.cols - 1) + 1):
+                if edge or abs(c - col) == ring:
+                    yield r * self.cols + c
+
+    # Nearest graph node within max_m metres as (node, metres), or None
+    # Rings of cells are scanned outwards until the next ring cannot hold anything closer
+    def snap(self, lat, lng, max_m):
+        row = math.floor((lat - self.min_lat) / self.cell_deg)
+        col = math.floor((lng - self.min_lng) / self.cell_deg)
+        offsets, nodes = self._cell_offsets, self._cell_nodes
+        best, best_m = None, max_m
+        for ring in range(int(max_m / self._min_cell_m) + 2):
+            for cell in self._ring(row, col, ring):
+                for position in range(offsets[cell], offsets[cell + 1]):
+                    node = nodes[position]
+                    metres = haversine_m(lat, lng, self.lats[node], self.lngs[node])
+                    if metres < best_m:
+                        best, best_m = node, metres
+            if ring * self._min_cell_m >= best_m:
+                break
+        return None if best is None else (best, best_m)
+
+    # Dijkstra over upward edges only, yielding (node, seconds) in settle order
+    # Forward searches start at a service, backward searches at the incident; a shortest
+    # route is the best sum over nodes both searches reach
+    def upward(self, source, backward=False):
+        offsets, targets, weights = self._backward if backward else self._forward
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        while heap:
+            seconds, node = heapq.heappop(heap)
+            if seconds > dist[node]:
+                continue
+            yield node, seconds
+            for edge in range(offsets[node], offsets[node + 1]):
+                target = targets[edge]
+                candidate = seconds + weights[edge]
+                if candidate < dist.get(target, INFINITY):
+                    dist[target] = candidate
+                    heapq.heappush(heap, (candidate, target))
+
+    # (lng, lat) points reachable from source within max_seconds over the plain graph:
+    # every reached junction plus, on each edge leaving the area, the point where the
+    # time runs out (interpolated along the straight line between its junctions)
+    def isochrone_points(self, source, max_seconds):
+        offsets, targets, weights = self._plain
+        lats, lngs = self.lats, self.lngs
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        points = []
+        while heap:
+            seconds, node = heapq.heappop(heap)
+            if seconds > dist[node]:
+                continue
+            lat, lng = lats[node], lngs[node]
+            points.append((lng, lat))
+            for edge in range(offsets[node], offsets[node + 1]):
+                target = targets[edge]
+                candidate = seconds + weights[edge]
+                if candidate <= max_seconds:
+                    if candidate < dist.get(target, INFINITY):
+                        dist[target] = candidate
+                        heapq.heappush(heap, (candidate, target))
+                else:
+                    fraction = (max_seconds - seconds) / weights[edge]
+                    points.append((
+                        lng + (lngs[target] - lng) * fraction,
+                        lat + (lats[target] - lat) * fraction,
+                    ))
+        return points
+
+
+def _placement(row):
+    return row['service_type'], row['latitude'], row['longitude']
+
+
+class TravelTimeRanker:
+    """Many-to-one travel times from every service to an incident over a RoadGraph"""
+
+    def __init__(self, graph, access_speed_kmh, max_snap_m):
+        self.graph = graph
+        # Off-network legs (point to nearest road node) are covered at this speed
+        self.access_speed = access_speed_kmh / 3.6
+        self.max_snap_m = max_snap_m
+        self._rows = {}
+        self._nodes = {}
+        # Per type: {graph node: ((service id, seconds from the service to that node), ...)}
+        # Each service's forward upward search is stored once; a query is then a single
+        # backward search from the incident. A published ranker is never changed: sync
+        # works on a copy (see copy()), so lock-free readers stay consistent
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    # A ranker with the same services that can be synced without affecting this one. The
+    # dicts are copied; the bucket tuples are shared, since sync replaces them
+    def copy(self):
+        ranker = TravelTimeRanker.__new__(TravelTimeRanker)
+        ranker.graph = self.graph
+        ranker.access_speed = self.access_speed
+        ranker.max_snap_m = self.max_snap_m
+        ranker._rows = dict(self._rows)
+        ranker._nodes = dict(self._nodes)
+        ranker._buckets = {service_type: dict(buckets) for service_type, buckets in self._buckets.items()}
+        return ranker
+
+    # Bring the services in line with a fresh snapshot; only services that were added,
+    # moved or retyped are searched again. Changes this ranker in place, so only call it
+    # on one that requests cannot see yet
+    def sync(self, rows):
+        fresh = {row['id']: row for row in rows}
+        for service_id, row in list(self._rows.items()):
+            new_row = fresh.get(service_id)
+            if new_row is None or _placement(new_row) != _placement(row):
+                self._remove(row)
+        for service_id, row in fresh.items():
+            old_row = self._rows.get(service_id)
+            if old_row is None:
+                self._add(row)
+            else:
+                self._rows[service_id] = row
+
+    def _add(self, row):
+        self._rows[row['id']] = row
+        snapped = self.graph.snap(row['latitude'], row['longitude'], self.max_snap_m)
+        if snapped is None:
+            # Too far from any road: still listed, without a travel time
+            return
+        node, metres = snapped
+        self._nodes[row['id']] = node
+        access = metres / self.access_speed
+        buckets = self._buckets.setdefault(row['service_type'], {})
+        for meeting, seconds in self.graph.upward(node):
+            buckets[meeting] = buckets.get(meeting, ()) + ((row['id'], access + seconds),)
+
+    def _remove(self, row):
+        del self._rows[row['id']]
+        node = self._nodes.pop(row['id'], None)
+        if node is None:
+            return
+        buckets = self._buckets.get(row['service_type'], {})
+        for meeting, _ in self.graph.upward(node):
+            remaining = tuple(entry for entry in buckets.get(meeting, ()) if entry[0] != row['id'])
+            if remaining:
+                buckets[meeting] = remaining
+            else:
+                buckets.pop(meeting, None)
+
+    # Services of the given types (None = all) as (row, distance_m, seconds) fastest first,
+    # the `limit` fastest or all of them. Services with no road route (seconds None) come
+    # last, by straight-line distance
+    def rank(self, lat, lng, service_types=None, limit=None):
+        best = {}
+        snapped = self.graph.snap(lat, lng, self.max_snap_m)
+        if snapped is not None:
+            node, metres = snapped
+            access = metres / self.access_speed
+            buckets = [
+                buckets for service_type, buckets in self._buckets.items()
+                if service_types is None or service_type in service_types
+            ]
+            cutoff = INFINITY
+            # Meeting nodes are settled in order of their backward time, which is a lower
+            # bound for any route through them, so the search stops once it passes the
+            # current limit-th best
+            for meeting, seconds in self.graph.upward(node, backward=True):
+                if seconds >= cutoff:
+                    break
+                improved = False
+                for bucket in buckets:
+                    for service_id, to_meeting in bucket.get(meeting, ()):
+                        total = to_meeting + seconds
+                        if total < best.get(service_id, INFINITY):
+                            best[service_id] = total
+                            improved = True
+                if improved and limit and len(best) >= limit:
+                    cutoff = heapq.nsmallest(limit, best.values())[-1]
+            best = {service_id: access + seconds for service_id, seconds in best.items()}
+
+        results = []
+        for service_id, seconds in sorted(best.items(), key=lambda item: item[1]):
+            row = self._rows.get(service_id)
+            if row is not None:
+                results.append((row, haversine_m(lat, lng, row['latitude'], row['longitude']), seconds))
+        if limit is not None and len(results) >= limit:
+            return results[:limit]
+
+        unreachable = [
+            (row, haversine_m(lat, lng, row['latitude'], row['longitude']), None)
+            for service_id, row in self._rows.items()
+            if service_id not in best
+            and (service_types is None or row['service_type'] in service_types)
+        ]
+        unreachable.sort(key=lambda result: result[1])
+        results.extend(unreachable)
+        return results if limit is None else results[:limit]
+
+
+# Per-worker state: the graph is loaded once, the services follow the data version
+_graph = None
+_ranker = None
+_ranker_version = None
+# Held while the ranker is created or synced, so only one sync runs at a time
+_ranker_lock = threading.Lock()
+
+
+def load_graph():
+    global _graph
+    if _graph is None:
+        try:
+            _graph = RoadGraph.load(settings.ROUTING_GRAPH_PATH)
+            logger.info(f'Road graph loaded with {len(_graph)} nodes')
+        except (OSError, ValueError, EOFError, KeyError) as e:
+            logger.warning(f'Road graph not loaded, travel-time ranking disabled: {e}')
+            # Remember the failure so every request does not retry the load
+            _graph = False
+    return _graph or None
+
+
+# Publish a ranker in line with the current data version; called with _ranker_lock held.
+# The sync runs on `ranker` (a new one) or on a copy of the current one, which is then
+# swapped in with one assignment, as rebuild_index() does, so requests keep ranking on
+# the previous ranker meanwhile
+def sync_ranker(ranker=None):
+    global _ranker, _ranker_version
+    version = get_data_version()
+    if ranker is None:
+        if version == _ranker_version:
+            return
+        ranker = _ranker.copy()
+    ranker.sync(ServiceIndex.load_rows())
+    _ranker = ranker
+    _ranker_version = version
+
+
+# Ranker for this worker, or None when no road graph is available. Only the first load
+# runs on the request path; edits made through other workers (seen within
+# DATA_VERSION_CHECK_MS) are synced on a background thread while the current services
+# are served
+def get_ranker():
+    ranker = _ranker
+    if ranker is not None:
+        if recent_data_version() != _ranker_version:
+            refresh_in_background(_ranker_lock, sync_ranker, 'travel-time-ranker')
+        return ranker
+    with _ranker_lock:
+        graph = load_graph()
+        if graph is None:
+            return None
+        if _ranker is None:
+            ranker = TravelTimeRanker(
+                graph, settings.ROUTING_ACCESS_SPEED_KMH, settings.ROUTING_MAX_SNAP_M
+            )
+            # Published only once every service has been searched
+            sync_ranker(ranker)
+    return _ranker
+
+
+# Load the graph and search every service at worker startup (no-op without a graph file)
+def warm_ranker():
+    if not os.path.exists(settings.ROUTING_GRAPH_PATH):
+        return
+    try:
+        get_ranker()
+    except Exception as e:
+        logger.warning(f'Travel-time ranker warm-up failed, will load on first request: {e}')
@@ -0,0 +1,113 @@
+from django.contrib.gis.geos import Point
+
+from . import prepared
+from .timing import timed
+from .expressions import GeographyDWithin, GeographyKNN, PointX, PointY, SphereDistance
+from .models import EmergencyService
+
+# Columns returned by the list and delta-sync endpoints, in response order
+LIST_FIELDS = (
+    'id', 'name', 'service_type', 'address', 'phone', 'email', 'latitude', 'longitude',
+    'capacity', 'is_24_hours', 'description',
+)
+# Columns returned by the spatial actions, plus the distance
+DISTANCE_FIELDS = (
+    'id', 'name', 'service_type', 'address', 'phone', 'latitude', 'longitude', 'is_24_hours',
+)
+
+
+# Format a distance in metres as returned by every spatial action
+def format_distance(distance_m):
+    return {
+        'm': float(distance_m),
+        'km': round(distance_m / 1000, 2)
+    }
+
+
+# Plain-dict rows straight from the database: coordinates come back as ST_X/ST_Y floats
+# and the distance as ST_DistanceSphere metres, so no model instance, GEOS Point or
+# Distance object is built per row. Slice after calling this, not before
+def list_values(queryset):
+    return queryset.annotate(
+        latitude=PointY('location'),
+        longitude=PointX('location'),
+    ).values(*LIST_FIELDS)
+
+
+def distance_values(queryset, point):
+    return queryset.annotate(
+        latitude=PointY('location'),
+        longitude=PointX('location'),
+        distance_m=SphereDistance('location', point),
+    ).values(*DISTANCE_FIELDS, 'distance_m')
+
+
+# Database-backend rows of the spatial actions as lists of distance_values() dicts, shared
+# by the viewset and the async views. nearest orders with the KNN <-> operator so PostGIS
+# walks the geography GiST index instead of sorting the table; the exact distance column
+# is only evaluated for the rows the index scan returns. The type filter comes before the
+# slice so the limit applies to it. nearest and within_radius run as prepared statements
+# when enabled (see prepared.py), with the same SQL shape
+def nearest_rows(lat, lng, limit, service_type=None):
+    if prepared.is_enabled():
+        return prepared.nearest(lat, lng, limit, service_type)
+    point = Point(lng, lat, srid=4326)
+    queryset = EmergencyService.objects.all()
+    if service_type:
+        queryset = queryset.filter(service_type=service_type)
+    return list(distance_values(queryset, point).order_by(GeographyKNN('location', point))[:limit])
+
+
+# ST_DWithin on geography (radius in metres); the GiST index restricts the scan to
+# candidates near the point
+def within_radius_rows(lat, lng, radius_m, service_type=None):
+    if prepared.is_enabled():
+        return prepared.within_radius(lat, lng, radius_m, service_type)
+    point = Point(lng, lat, srid=4326)
+    queryset = EmergencyService.objects.filter(GeographyDWithin('location', point, radius_m))
+    if service_type:
+        queryset = queryset.filter(service_type=service_type)
+    return list(distance_values(queryset, point).order_by('distance_m'))
+
+
+def by_type_rows(lat, lng, service_type):
+    point = Point(lng, lat, srid=4326)
+    queryset = EmergencyService.objects.filter(service_type=service_type)
+    return list(distance_values(queryset, point).order_by('distance_m'))
+
+
+# Response entries for distance_values() rows; each row is a fresh dict, so it is
+# updated in place rather than copied
+@timed('serialize')
+def encode_distance_rows(rows):
+    data = []
+    for row in rows:
+        row['distance'] = format_distance(row.pop('distance_m'))
+        data.append(row)
+    return data
+
+
+# Response entries for in-memory index (row, distance_m) pairs; index rows are shared
+# between requests, so these are copied
+@timed('serialize')
+def encode_indexed_rows(results):
+    return [dict(row, distance=format_distance(distance_m)) for row, distance_m in results]
+
+
+# Road travel time as returned with ?rank=travel_time (None when there is no road route)
+def format_travel_time(seconds):
+    if seconds is None:
+        return None
+    return {
+        's': round(seconds, 1),
+        'min': round(seconds / 60, 1)
+    }
+
+
+# Response entries for travel-time ranked (row, distance_m, seconds) triples
+@timed('serialize')
+def encode_travel_time_rows(results):
+    return [
+        dict(row, distance=format_distance(distance_m), travel_time=format_travel_time(seconds))
+        for row, distance_m, seconds in results
+    ]
@@ -0,0 +1,50 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import isochrones, spatial_index, sync
+from .data_version import bump_data_version
+from .models import EmergencyService, ServiceAvailability
+
+
+# Keep this worker's in-memory spatial index in step with admin/API edits, once they are
+# committed: a save that is rolled back must not leave a phantom or moved row in the index.
+# The row is taken at save time, so later changes to the instance are not picked up
+@receiver(post_save, sender=EmergencyService)
+def update_spatial_index(sender, instance, **kwargs):
+    row = spatial_index.service_to_row(instance)
+    transaction.on_commit(lambda: spatial_index.service_saved(row))
+
+
+@receiver(post_delete, sender=EmergencyService)
+def remove_from_spatial_index(sender, instance, **kwargs):
+    service_id = instance.id
+    transaction.on_commit(lambda: spatial_index.service_deleted(service_id))
+
+
+# Queue the isochrones of a new service, and recompute those of a moved one, once the
+# save is committed
+@receiver(post_save, sender=EmergencyService)
+def refresh_isochrones(sender, instance, **kwargs):
+    transaction.on_commit(lambda: isochrones.service_changed(instance))
+
+
+# Tombstone for delta-sync clients, which cannot see a deleted row's updated_at
+@receiver(post_delete, sender=EmergencyService)
+def record_service_deletion(sender, instance, **kwargs):
+    sync.record_deletion(instance.id)
+
+
+# Availability has no foreign key constraint (see ServiceAvailability), so its report is
+# removed here
+@receiver(post_delete, sender=EmergencyService)
+def remove_availability(sender, instance, **kwargs):
+    ServiceAvailability.objects.filter(service_id=instance.id).delete()
+
+
+# Bump the shared data version once the change is committed, so no other worker can
+# cache pre-change data under the new version
+@receiver(post_save, sender=EmergencyService)
+@receiver(post_delete, sender=EmergencyService)
+def bump_version_on_change(sender, **kwargs):
+    transaction.on_commit(bump_data_version)
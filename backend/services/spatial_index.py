@@ -0,0 +1,404 @@
+import heapq
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .data_version import get_data_version, recent_data_version
+
+logger = logging.getLogger(__name__)
+
+# Mean Earth radius in metres (same sphere PostGIS uses for ST_DistanceSphere on WGS84)
+EARTH_RADIUS_M = 6371008.8
+
+
+# Convert lat/lng in degrees to a 3D point on the unit sphere
+# Straight-line (chord) distance between these points grows monotonically with
+# great-circle distance, so a plain 3D KD-tree can answer spherical queries
+def to_unit_vector(lat, lng):
+    phi = math.radians(lat)
+    lam = math.radians(lng)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+
+# Exact great-circle distance in metres using the haversine formula
+def haversine_m(lat1, lng1, lat2, lng2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lam = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lam / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Chord length on the unit sphere matching a great-circle distance in metres
+def chord_for_distance(distance_m):
+    angle = min(max(distance_m, 0.0) / EARTH_RADIUS_M, math.pi)
+    return 2 * math.sin(angle / 2)
+
+
+class KDTree:
+    """Static 3D KD-tree over unit-sphere vectors, each carrying an item"""
+
+    def __init__(self, entries):
+        # Nodes are stored in a flat list as (vector, item, axis, left, right)
+        self._nodes = []
+        self._root = self._build(list(entries), 0)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def _build(self, entries, depth):
+        if not entries:
+            return -1
+        axis = depth % 3
+        entries.sort(key=lambda entry: entry[0][axis])
+        mid = len(entries) // 2
+        vector, item = entries[mid]
+        index = len(self._nodes)
+        self._nodes.append(None)
+        left = self._build(entries[:mid], depth + 1)
+        right = self._build(entries[mid + 1:], depth + 1)
+        self._nodes[index] = (vector, item, axis, left, right)
+        return index
+
+    # Return up to k items closest to the target vector, nearest first
+    def nearest(self, target, k):
+        if k <= 0 or self._root < 0:
+            return []
+        nodes = self._nodes
+        # Max-heap of (-squared chord distance, node index) holding the best k so far
+        best = []
+
+        def search(index):
+            vector, _, axis, left, right = nodes[index]
+            d2 = ((vector[0] - target[0]) ** 2 + (vector[1] - target[1]) ** 2
+                  + (vector[2] - target[2]) ** 2)
+            if len(best) < k:
+                heapq.heappush(best, (-d2, index))
+            elif d2 < -best[0][0]:
+                heapq.heapreplace(best, (-d2, index))
+            diff = target[axis] - vector[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            if near >= 0:
+                search(near)
+            # Only cross the splitting plane if it is closer than the current k-th best
+            if far >= 0 and (len(best) < k or diff * diff < -best[0][0]):
+                search(far)
+
+        search(self._root)
+        return [nodes[index][1] for _, index in sorted(best, key=lambda pair: -pair[0])]
+
+    # Return all items within the given chord distance of the target vector
+    def within(self, target, chord):
+        if self._root < 0:
+            return []
+        nodes = self._nodes
+        limit = chord * chord
+        found = []
+        stack = [self._root]
+        while stack:
+            vector, item, axis, left, right = nodes[stack.pop()]
+            d2 = ((vector[0] - target[0]) ** 2 + (vector[1] - target[1]) ** 2
+                  + (vector[2] - target[2]) ** 2)
+            if d2 <= limit:
+                found.append(item)
+            diff = target[axis] - vector[axis]
+            if left >= 0 and diff <= chord:
+                stack.append(left)
+            if right >= 0 and -diff <= chord:
+                stack.append(right)
+        return found
+
+
+# Plain dict snapshot of a service holding the fields the spatial actions return
+def service_to_row(service):
+    return {
+        'id': service.id,
+        'name': service.name,
+        'service_type': service.service_type,
+        'address': service.address,
+        'phone': service.phone,
+        'latitude': service.latitude,
+        'longitude': service.longitude,
+        'is_24_hours': service.is_24_hours,
+    }
+
+
+class ServiceIndex:
+    """Per-service-type KD-trees answering nearest, radius and by-type queries"""
+
+    def __init__(self, rows=(), coverage_grid=False):
+        # Rows and trees are replaced (never mutated) so concurrent readers stay consistent
+        self._rows = {}
+        self._trees = {}
+        self._grid = None
+        grouped = {}
+        for row in rows:
+            grouped.setdefault(row['service_type'], {})[row['id']] = row
+        for service_type, rows_by_id in grouped.items():
+            self._set_rows(service_type, rows_by_id)
+        if coverage_grid:
+            # Imported here because the grid module builds on this one
+            from .coverage_grid import CoverageGrid
+            self._grid = CoverageGrid.build(
+                self,
+                settings.COVERAGE_GRID_CELL_DEG,
+                settings.COVERAGE_GRID_K,
+                settings.COVERAGE_GRID_MAX_SHORTLIST,
+            )
+
+    @staticmethod
+    def load_rows():
+        from .models import EmergencyService
+        queryset = EmergencyService.objects.only(
+            'id', 'name', 'service_type', 'address', 'phone', 'location', 'is_24_hours'
+        ).order_by()
+        return [service_to_row(service) for service in queryset.iterator(chunk_size=2000)]
+
+    @classmethod
+    def from_database(cls, coverage_grid=False):
+        return cls(cls.load_rows(), coverage_grid=coverage_grid)
+
+    @property
+    def has_coverage_grid(self):
+        return self._grid is not None
+
+    # Bring the index in line with a fresh snapshot by patching only the rows that differ
+    # Returns False without changing anything when more than max_changes rows differ
+    def sync(self, rows, max_changes):
+        current = {
+            service_id: row
+            for rows_by_id in self._rows.values()
+            for service_id, row in rows_by_id.items()
+        }
+        fresh = {row['id']: row for row in rows}
+        changed = [row for service_id, row in fresh.items() if current.get(service_id) != row]
+        removed = [service_id for service_id in current if service_id not in fresh]
+        if len(changed) + len(removed) > max_changes:
+            return False
+        for row in changed:
+            self.upsert(row)
+        for service_id in removed:
+            self.remove(service_id)
+        return True
+
+    def __len__(self):
+        return sum(len(rows) for rows in self._rows.values())
+
+    def _set_rows(self, service_type, rows_by_id):
+        if rows_by_id:
+            tree = KDTree(
+                (to_unit_vector(row['latitude'], row['longitude']), row)
+                for row in rows_by_id.values()
+            )
+            self._rows[service_type] = rows_by_id
+            self._trees[service_type] = tree
+        else:
+            self._rows.pop(service_type, None)
+            self._trees.pop(service_type, None)
+
+    def service_types(self):
+        return list(self._trees)
+
+    def tree_and_rows(self, service_type):
+        return self._trees.get(service_type), self._rows.get(service_type, {})
+
+    def _find(self, service_id):
+        for rows_by_id in self._rows.values():
+            if service_id in rows_by_id:
+                return rows_by_id[service_id]
+        return None
+
+    # Trees to search for an optional type filter (copied so patches cannot race the loop)
+    def _trees_for(self, service_type):
+        if service_type:
+            tree = self._trees.get(service_type)
+            return [tree] if tree is not None else []
+        return list(self._trees.values())
+
+    # Insert or replace one service, rebuilding only the trees (and grid cells) of the
+    # affected types
+    def upsert(self, row):
+        old_row = self._find(row['id'])
+        self._remove_rows(row['id'], keep_type=row['service_type'])
+        rows_by_id = dict(self._rows.get(row['service_type'], {}))
+        rows_by_id[row['id']] = row
+        self._set_rows(row['service_type'], rows_by_id)
+        if self._grid is not None:
+            self._grid.service_changed(self, old_row, row)
+
+    def remove(self, service_id):
+        old_row = self._find(service_id)
+        if old_row is None:
+            return
+        self._remove_rows(service_id)
+        if self._grid is not None:
+            self._grid.service_changed(self, old_row, None)
+
+    def _remove_rows(self, service_id, keep_type=None):
+        for service_type, rows_by_id in list(self._rows.items()):
+            if service_id in rows_by_id and service_type != keep_type:
+                remaining = dict(rows_by_id)
+                del remaining[service_id]
+                self._set_rows(service_type, remaining)
+
+    # Attach exact haversine distances and sort nearest first
+    @staticmethod
+    def _with_distances(rows, lat, lng):
+        results = [
+            (row, haversine_m(lat, lng, row['latitude'], row['longitude'])) for row in rows
+        ]
+        results.sort(key=lambda pair: pair[1])
+        return results
+
+    # N nearest services, optionally of one type, as (row, distance_m) pairs
+    def nearest(self, lat, lng, limit, service_type=None):
+        # Coverage grid: cell lookup plus an exact re-rank of a short, provably sufficient list
+        if self._grid is not None:
+            types = [service_type] if service_type else self.service_types()
+            results = self._grid.nearest(lat, lng, limit, types, self._rows)
+            if results is not None:
+                results.sort(key=lambda pair: pair[1])
+                return results[:limit]
+        target = to_unit_vector(lat, lng)
+        candidates = []
+        # Each type tree yields its own top N; merging them gives the overall top N
+        for tree in self._trees_for(service_type):
+            candidates.extend(tree.nearest(target, limit))
+        return self._with_distances(candidates, lat, lng)[:max(limit, 0)]
+
+    # All services within radius_m, optionally of one type, nearest first
+    def within_radius(self, lat, lng, radius_m, service_type=None):
+        target = to_unit_vector(lat, lng)
+        chord = chord_for_distance(radius_m)
+        candidates = []
+        for tree in self._trees_for(service_type):
+            candidates.extend(tree.within(target, chord))
+        results = self._with_distances(candidates, lat, lng)
+        # Chord test is exact in theory; re-check in metres to absorb float rounding
+        return [pair for pair in results if pair[1] <= radius_m]
+
+    # Every service of a type ranked by distance (no pruning possible, so a linear pass)
+    def by_type(self, lat, lng, service_type):
+        return self._with_distances(self._rows.get(service_type, {}).values(), lat, lng)
+
+
+# Above this many differing rows a refresh rebuilds the index instead of patching it
+MAX_PATCH_CHANGES = 20
+
+# Per-worker index state, built lazily and swapped atomically under a lock
+_index = None
+_index_built_at = 0.0
+_index_version = None
+_index_lock = threading.RLock()
+# Held for the whole of a rebuild, so only one runs at a time
+_build_lock = threading.Lock()
+
+
+def is_enabled():
+    return settings.SPATIAL_BACKEND == 'memory'
+
+
+# Stale when another worker changed the data (shared data version moved) or past max age
+def _is_expired(version):
+    if version != _index_version:
+        return True
+    max_age = settings.SPATIAL_INDEX_MAX_AGE
+    return bool(max_age) and time.monotonic() - _index_built_at > max_age
+
+
+# Reload the rows and patch or replace the index. Rows are loaded and a new index is built
+# without holding _index_lock, so requests (and save/delete signal hooks) keep using the
+# current index until the new one is swapped in
+def rebuild_index():
+    global _index, _index_built_at, _index_version
+    started = time.perf_counter()
+    # Read the version first so a change during the build triggers another rebuild
+    version = get_data_version()
+    rows = ServiceIndex.load_rows()
+    coverage_grid = settings.COVERAGE_GRID_ENABLED
+    # A few edits made through other workers are patched in (only their trees and grid
+    # cells are recomputed); a full build is only done for large changes
+    with _index_lock:
+        index = _index
+        patched = (index is not None and index.has_coverage_grid == coverage_grid
+                   and index.sync(rows, MAX_PATCH_CHANGES))
+    if not patched:
+        index = ServiceIndex(rows, coverage_grid=coverage_grid)
+    with _index_lock:
+        _index = index
+        _index_version = version
+        _index_built_at = time.monotonic()
+    logger.info(
+        f'Spatial index {"refreshed" if patched else "built"} with {len(index)} services in '
+        f'{(time.perf_counter() - started) * 1000:.1f} ms'
+    )
+    return index
+
+
+# Run refresh() on a background thread unless one already holds `lock` (a rebuild is in
+# progress). The thread closes its database connection when done
+def refresh_in_background(lock, refresh, name):
+    if not lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh()
+        except Exception as e:
+            logger.warning(f'Background {name} refresh failed, still serving the previous one: {e}')
+        finally:
+            connection.close()
+            lock.release()
+
+    try:
+        threading.Thread(target=run, name=f'{name}-refresh', daemon=True).start()
+    except BaseException:
+        lock.release()
+        raise
+
+
+# Return the current index. Only the first build runs on the request path; when the
+# shared data version has changed (edits made through another worker, checked at most
+# every DATA_VERSION_CHECK_MS) or the index is older than SPATIAL_INDEX_MAX_AGE, it is
+# rebuilt on a background thread and the current index is served meanwhile
+def get_index():
+    index = _index
+    if index is None:
+        with _build_lock:
+            if _index is None:
+                rebuild_index()
+        return _index
+    if _is_expired(recent_data_version()):
+        refresh_in_background(_build_lock, rebuild_index, 'spatial-index')
+    return index
+
+
+# Build the index at worker startup so the first request does not pay for it
+def warm_index():
+    if not is_enabled():
+        return
+    try:
+        with _build_lock:
+            rebuild_index()
+    except Exception as e:
+        logger.warning(f'Spatial index warm-up failed, will build on first request: {e}')
+
+
+# Signal hooks (run on commit): patch the local index in place instead of rebuilding from
+# the database
+def service_saved(row):
+    with _index_lock:
+        if _index is not None:
+            _index.upsert(row)
+
+
+def service_deleted(service_id):
+    with _index_lock:
+        if _index is not None:
+            _index.remove(service_id)
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .data_version import aget_data_version, get_data_version
+from .models import EmergencyService
+
+# Response labels for each service type, as used by the original statistics payload
+TYPE_LABELS = {
+    'hospital': 'hospitals',
+    'police': 'police_stations',
+    'fire': 'fire_stations',
+}
+
+
+# All dashboard figures in one conditional-aggregation query (a single table scan)
+def statistics_aggregates():
+    aggregates = {
+        'total': Count('id'),
+        'available_24h': Count('id', filter=Q(is_24_hours=True)),
+        'capacity': Coalesce(Sum('capacity'), 0),
+    }
+    for service_type in TYPE_LABELS:
+        in_type = Q(service_type=service_type)
+        aggregates[f'{service_type}_count'] = Count('id', filter=in_type)
+        aggregates[f'{service_type}_24h'] = Count('id', filter=in_type & Q(is_24_hours=True))
+        aggregates[f'{service_type}_capacity'] = Coalesce(Sum('capacity', filter=in_type), 0)
+    return aggregates
+
+
+def format_statistics(row):
+    return {
+        'total_services': row['total'],
+        'by_type': {
+            label: row[f'{service_type}_count'] for service_type, label in TYPE_LABELS.items()
+        },
+        'available_24_hours': row['available_24h'],
+        'available_24_hours_by_type': {
+            label: row[f'{service_type}_24h'] for service_type, label in TYPE_LABELS.items()
+        },
+        'capacity': {
+            'total': row['capacity'],
+            'by_type': {
+                label: row[f'{service_type}_capacity'] for service_type, label in TYPE_LABELS.items()
+            },
+        },
+    }
+
+
+def compute_statistics():
+    return format_statistics(EmergencyService.objects.aggregate(**statistics_aggregates()))
+
+
+# Statistics cached under the current data version; any save/delete bumps the version,
+# so a stale payload is never returned and the next request recomputes it
+def get_statistics():
+    key = f'statistics:{get_data_version()}'
+    data = cache.get(key)
+    if data is None:
+        data = compute_statistics()
+        cache.set(key, data, settings.STATISTICS_CACHE_TIMEOUT)
+    return data
+
+
+async def aget_statistics():
+    key = f'statistics:{await aget_data_version()}'
+    data = await cache.aget(key)
+    if data is None:
+        data = format_statistics(await EmergencyService.objects.aaggregate(**statistics_aggregates()))
+        await cache.aset(key, data, settings.STATISTICS_CACHE_TIMEOUT)
+    return data
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from .renderers import dumps
+
+# ?stream= value -> (content type, framing); "1" is shorthand for NDJSON
+STREAM_FORMATS = {
+    '1': 'ndjson',
+    'ndjson': 'ndjson',
+    'geojson': 'geojson',
+    'json': 'json',
+}
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'geojson': 'application/geo+json',
+    'json': 'application/json',
+}
+
+
+def service_feature(row):
+    properties = dict(row)
+    service_id = properties.pop('id')
+    lat = properties.pop('latitude')
+    lng = properties.pop('longitude')
+    return {
+        'type': 'Feature',
+        'id': service_id,
+        'geometry': {'type': 'Point', 'coordinates': [lng, lat]},
+        'properties': properties,
+    }
+
+
+def _encode_feature(row):
+    return dumps(service_feature(row))
+
+
+# Encode rows one at a time as they arrive from the server-side cursor and yield them in
+# batches, so memory stays constant however many services are exported
+def _stream_chunks(rows, fmt):
+    if fmt == 'ndjson':
+        head, separator, tail, encode = b'', b'\n', b'\n', dumps
+    elif fmt == 'geojson':
+        head, separator, tail = b'{"type":"FeatureCollection","features":[', b',', b']}'
+        encode = _encode_feature
+    else:
+        head, separator, tail, encode = b'[', b',', b']', dumps
+
+    batch = [head]
+    first = True
+    for row in rows:
+        if not first:
+            batch.append(separator)
+        batch.append(encode(row))
+        first = False
+        if len(batch) >= 1000:
+            yield b''.join(batch)
+            batch = []
+    if not first or fmt != 'ndjson':
+        batch.append(tail)
+    yield b''.join(batch)
+
+
+# Stream a values() queryset through a server-side cursor (.iterator) in the given format
+def stream_rows(queryset, fmt):
+    rows = queryset.iterator(chunk_size=settings.STREAM_CHUNK_SIZE)
+    return StreamingHttpResponse(_stream_chunks(rows, fmt), content_type=CONTENT_TYPES[fmt])
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import EmergencyService, ServiceDeletion
+
+
+# Cursors are opaque to clients; internally they are UTC timestamps in microseconds
+def make_cursor(moment):
+    return str(int(moment.timestamp() * 1_000_000))
+
+
+def parse_cursor(value):
+    if not value:
+        return None
+    micros = int(value)
+    return datetime.fromtimestamp(micros / 1_000_000, tz=dt_timezone.utc)
+
+
+# Rows changed and ids deleted since the cursor, plus the cursor for the next call
+# A missing cursor, or one older than the tombstone retention, gets a full snapshot
+# (full=True) because deletions before the retention window can no longer be listed
+def get_changes(since):
+    now = timezone.now()
+    retention = timedelta(days=settings.DELTA_SYNC_TOMBSTONE_DAYS)
+    if since is None or since < now - retention:
+        return {
+            'cursor': make_cursor(now),
+            'full': True,
+            'changed': EmergencyService.objects.all(),
+            'deleted': [],
+        }
+
+    # Re-read a short overlap before the cursor so rows committed by transactions that
+    # started before the previous sync are not missed (clients apply changes idempotently)
+    window_start = since - timedelta(seconds=settings.DELTA_SYNC_OVERLAP)
+    return {
+        'cursor': make_cursor(now),
+        'full': False,
+        'changed': EmergencyService.objects.filter(updated_at__gt=window_start),
+        'deleted': list(
+            ServiceDeletion.objects.filter(deleted_at__gt=window_start)
+            .order_by().values_list('service_id', flat=True).distinct()
+        ),
+    }
+
+
+# Called from post_delete: record a tombstone and drop ones past the retention window
+def record_deletion(service_id):
+    ServiceDeletion.objects.create(service_id=service_id)
+    cutoff = timezone.now() - timedelta(days=settings.DELTA_SYNC_TOMBSTONE_DAYS)
+    ServiceDeletion.objects.filter(deleted_at__lt=cutoff).delete()
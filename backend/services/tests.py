@@ -0,0 +1,1108 @@
+import base64
+import io
+import json
+import os
+import random
+import re
+import struct
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipIf
+
+import psycopg2
+from asgiref.sync import async_to_sync
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from emergency_project.database.pool import ConnectionPool
+
+from . import coverage, geocoding, ingest
+from .batch import parse_batch_request
+from .gazetteer import Gazetteer
+from .models import EmergencyService, ServiceArea
+from .pagination import decode_cursor, encode_cursor
+from . import renderers
+from .routing import TravelTimeRanker
+from .rows import encode_indexed_rows, encode_travel_time_rows, nearest_rows
+from .spatial_index import ServiceIndex, haversine_m
+
+# Run against a PostGIS database: python manage.py test services
+# The test runner creates a throwaway database with the migrations applied
+
+# Rows seeded for the query plan tests; the planner only prefers an index over a
+# sequential scan and sort once the table is large enough for it to matter
+PLAN_ROWS = 100_000
+GEOGRAPHY_INDEX = 'services_em_location_geog_gist'
+
+
+# Insert `count` services scattered over Ireland in one statement, bypassing signals
+def seed_services(count):
+    table = connection.ops.quote_name(EmergencyService._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT setseed(0.25)')
+        cursor.execute(f'''
+            INSERT INTO {table} (name, service_type, address, phone, email, location, capacity,
+                                 is_24_hours, description, created_at, updated_at)
+            SELECT 'Service ' || n, (ARRAY['hospital', 'police', 'fire'])[n % 3 + 1], 'Address ' || n, '', '',
+                   ST_SetSRID(ST_MakePoint(-10.5 + random() * 4.5, 51.4 + random() * 4.0), 4326), 0,
+                   true, '', now(), now()
+            FROM generate_series(1, %s) AS n
+        ''', [count])
+        cursor.execute(f'ANALYZE {table}')
+
+
+# Every node of an EXPLAIN (FORMAT JSON) plan
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+class NearestPlanTests(TestCase):
+    """nearest_rows() is answered by a KNN scan of the location::geography index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_services(PLAN_ROWS)
+
+    # EXPLAIN the statement nearest_rows() sent last, exactly as it was sent
+    def explain_nearest(self, service_type=None):
+        with CaptureQueriesContext(connection) as queries:
+            rows = nearest_rows(53.3498, -6.2603, 5, service_type)
+        self.assertEqual(len(rows), 5)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {queries.captured_queries[-1]['sql']}")
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return list(plan_nodes(plan[0]['Plan']))
+
+    def assert_knn_index_scan(self, nodes):
+        node_types = [node['Node Type'] for node in nodes]
+        self.assertIn(
+            GEOGRAPHY_INDEX, [node.get('Index Name') for node in nodes if node['Node Type'] == 'Index Scan'],
+            f'expected an Index Scan on {GEOGRAPHY_INDEX}, got {node_types}',
+        )
+        self.assertNotIn('Sort', node_types)
+
+    @override_settings(DATABASE_PREPARED_STATEMENTS=False)
+    def test_nearest_uses_geography_index(self):
+        self.assert_knn_index_scan(self.explain_nearest())
+
+    @override_settings(DATABASE_PREPARED_STATEMENTS=False)
+    def test_nearest_by_type_uses_geography_index(self):
+        self.assert_knn_index_scan(self.explain_nearest('hospital'))
+
+    @override_settings(DATABASE_PREPARED_STATEMENTS=True)
+    def test_prepared_nearest_uses_geography_index(self):
+        self.assert_knn_index_scan(self.explain_nearest())
+        self.assert_knn_index_scan(self.explain_nearest('fire'))
+
+
+class NearestResponseTests(TestCase):
+    """nearest always names the ranking it applied"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_services(20)
+
+    def test_rank_is_reported_for_every_ranking(self):
+        for params, rank in [({}, 'distance'), ({'rank': 'distance'}, 'distance'),
+                             ({'rank': 'availability'}, 'availability'), ({'min_available': 0}, 'distance')]:
+            response = self.client.get(
+                '/api/services/nearest/', {'lat': 53.35, 'lng': -6.26, 'limit': 3, **params},
+                HTTP_ACCEPT='application/json',
+            )
+            self.assertEqual(response.status_code, 200, params)
+            self.assertEqual(response.json()['rank'], rank, params)
+
+
+# A new raw connection to the test database, as the project's engine opens them
+def connect():
+    return psycopg2.connect(**connection.get_connection_params())
+
+
+class ConnectionPoolTests(TransactionTestCase):
+    """The per-process pool against a real server: exhaustion, timeout and reuse"""
+
+    def setUp(self):
+        self.opened = []
+        self.pool = ConnectionPool(size=2, timeout=0.2, check_after=0)
+
+    def tearDown(self):
+        for raw in self.opened:
+            raw.close()
+
+    def connect(self):
+        raw = connect()
+        self.opened.append(raw)
+        return raw
+
+    def test_get_times_out_when_exhausted(self):
+        self.pool.get(self.connect)
+        self.pool.get(self.connect)
+        started = time.monotonic()
+        with self.assertRaisesRegex(psycopg2.OperationalError, 'No free database connection after 0.2s'):
+            self.pool.get(self.connect)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(len(self.opened), 2)
+
+    def test_put_frees_a_slot_and_is_reused(self):
+        first = self.pool.get(self.connect)
+        self.pool.get(self.connect)
+        self.pool.put(first)
+        self.assertIs(self.pool.get(self.connect), first)
+        self.assertEqual(len(self.opened), 2)
+
+    def test_put_rolls_back_open_transaction(self):
+        raw = self.pool.get(self.connect)
+        with raw.cursor() as cursor:
+            cursor.execute('CREATE TEMPORARY TABLE pool_probe (id int)')
+        self.pool.put(raw)
+        reused = self.pool.get(self.connect)
+        self.assertIs(reused, raw)
+        with reused.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('pg_temp.pool_probe')")
+            self.assertIsNone(cursor.fetchone()[0])
+
+    def test_closed_connection_is_replaced(self):
+        raw = self.pool.get(self.connect)
+        self.pool.put(raw)
+        raw.close()
+        self.assertIsNot(self.pool.get(self.connect), raw)
+        self.assertEqual(len(self.opened), 2)
+
+
+# Statements the server holds for the current session
+def server_prepared():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT name FROM pg_prepared_statements')
+        return {name for (name,) in cursor.fetchall()}
+
+
+@override_settings(DATABASE_PREPARED_STATEMENTS=True)
+class PreparedStatementTests(TransactionTestCase):
+    """Tracked statements match the server's, including across a reconnect"""
+
+    # Each test starts on a new session, with nothing prepared
+    def setUp(self):
+        connection.close()
+        seed_services(50)
+
+    def test_tracking_matches_server(self):
+        rows = nearest_rows(53.3498, -6.2603, 5)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(connection.connection.prepared_statements, {'services_nearest'})
+        self.assertEqual(server_prepared(), {'services_nearest'})
+
+    def test_reprepared_after_reconnect(self):
+        before = nearest_rows(53.3498, -6.2603, 5, 'fire')
+        connection.close()
+        connection.ensure_connection()
+        # A new session: nothing prepared on either side until the first call
+        self.assertEqual(connection.connection.prepared_statements, set())
+        self.assertEqual(server_prepared(), set())
+        self.assertEqual(nearest_rows(53.3498, -6.2603, 5, 'fire'), before)
+        self.assertEqual(server_prepared(), {'services_nearest_type'})
+
+
+# Road graph double for the ranker: every snapped point is its own node, and all of them
+# meet at node 0 (the top of the hierarchy) after their straight-line time at 10 m/s.
+# on_forward, if set, runs at the start of every forward search, i.e. mid-sync
+class StarGraph:
+    def __init__(self, lat, lng):
+        self.top = (lat, lng)
+        self.nodes = {self.top: 0}
+        self.on_forward = None
+
+    def snap(self, lat, lng, max_snap_m):
+        return self.nodes.setdefault((lat, lng), len(self.nodes)), 0.0
+
+    def upward(self, node, backward=False):
+        if not backward and self.on_forward is not None:
+            self.on_forward()
+        yield node, 0.0
+        if node:
+            point = next(point for point, point_node in self.nodes.items() if point_node == node)
+            yield 0, haversine_m(*point, *self.top) / 10
+
+
+def service_row(service_id, lat, lng, service_type='fire'):
+    return {'id': service_id, 'name': f'Service {service_id}', 'service_type': service_type,
+            'address': '', 'phone': '', 'latitude': lat, 'longitude': lng, 'is_24_hours': True}
+
+
+class TravelTimeRankerTests(SimpleTestCase):
+    """A sync never changes the ranker that requests are ranking on"""
+
+    def setUp(self):
+        self.graph = StarGraph(53.35, -6.26)
+        self.ranker = TravelTimeRanker(self.graph, 20, 2000)
+        self.rows = [service_row(i, 53.3 + i / 100, -6.3 + i / 100, ('fire', 'police')[i % 2]) for i in range(1, 9)]
+        self.ranker.sync(self.rows)
+
+    def ranked_ids(self, ranker, service_types=None):
+        return [row['id'] for row, _, _ in ranker.rank(53.36, -6.25, service_types)]
+
+    def test_rank_during_sync_sees_previous_services(self):
+        before = self.ranker.rank(53.36, -6.25)
+        during = []
+        self.graph.on_forward = lambda: during.append(self.ranker.rank(53.36, -6.25))
+        fresh = [service_row(1, 53.5, -6.1), *self.rows[2:], service_row(20, 53.4, -6.2, 'police')]
+        synced = self.ranker.copy()
+        synced.sync(fresh)
+        # Service 1 moved (removed and searched again), 2 removed and 20 added
+        self.assertEqual(len(during), 4)
+        for ranked in during:
+            self.assertEqual(ranked, before)
+        self.assertEqual(self.ranker.rank(53.36, -6.25), before)
+        self.assertEqual(sorted(self.ranked_ids(synced)), sorted(row['id'] for row in fresh))
+
+    def test_synced_copy_matches_fresh_ranker(self):
+        fresh = [service_row(3, 53.31, -6.4, 'police'), *self.rows[3:], service_row(30, 53.2, -6.0)]
+        synced = self.ranker.copy()
+        synced.sync(fresh)
+        built = TravelTimeRanker(self.graph, 20, 2000)
+        built.sync(fresh)
+        for service_types in (None, {'fire'}, {'police'}):
+            self.assertEqual(
+                synced.rank(53.36, -6.25, service_types), built.rank(53.36, -6.25, service_types)
+            )
+
+
+# Local stand-in for the geocoding providers: GET /opencage and /nominatim answer after
+# `delays[path]` seconds with `statuses[path]` (200 by default) and a Dublin result, and
+# every request is counted in `calls`
+class ProviderStub(BaseHTTPRequestHandler):
+    BODIES = {
+        '/opencage': {'results': [{'geometry': {'lat': 53.3498, 'lng': -6.2603},
+                                   'components': {'city': 'Dublin'}, 'confidence': 9}]},
+        '/nominatim': [{'lat': '53.3498', 'lon': '-6.2603', 'display_name': 'Dublin',
+                        'address': {'city': 'Dublin'}}],
+    }
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        server = self.server
+        with server.lock:
+            server.calls[path] = server.calls.get(path, 0) + 1
+        time.sleep(server.delays.get(path, 0))
+        body = json.dumps(self.BODIES[path]).encode()
+        try:
+            self.send_response(server.statuses.get(path, 200))
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # A losing hedged call whose client has gone away
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GeocodingProviderTests(SimpleTestCase):
+    """Hedging, circuit breakers and fallback of geocode_remote() against a stub server"""
+
+    HEDGE_DELAY_MS = 100
+    BREAKER_FAILURES = 2
+    BREAKER_RESET = 0.3
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ProviderStub)
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.calls = {}
+        self.server.delays = {}
+        self.server.statuses = {}
+        base = f'http://127.0.0.1:{self.server.server_port}'
+        stub_settings = override_settings(
+            GEOCODE_OPENCAGE_URL=f'{base}/opencage', GEOCODE_NOMINATIM_URL=f'{base}/nominatim',
+            GEOCODE_HEDGE_DELAY_MS=self.HEDGE_DELAY_MS, GEOCODE_PROVIDER_TIMEOUT=5,
+        )
+        stub_settings.enable()
+        self.addCleanup(stub_settings.disable)
+        for patcher in (
+            # A key puts OpenCage first, Nominatim second
+            mock.patch.dict(os.environ, {'OPENCAGE_API_KEY': 'test'}),
+            mock.patch.dict(geocoding.breakers, {
+                name: geocoding.CircuitBreaker(self.BREAKER_FAILURES, self.BREAKER_RESET)
+                for name in geocoding.PROVIDERS
+            }),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    # Wait for stub requests still running after geocode_remote() returned
+    def wait_for_calls(self, path, count):
+        deadline = time.monotonic() + 5
+        while self.server.calls.get(path, 0) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.server.calls.get(path, 0)
+
+    def test_primary_answering_within_delay_is_not_hedged(self):
+        result, complete = geocoding.geocode_remote('Dublin')
+        self.assertEqual((result['source'], complete), ('opencage', True))
+        time.sleep(self.HEDGE_DELAY_MS / 1000 * 2)
+        self.assertNotIn('/nominatim', self.server.calls)
+
+    def test_hedge_fires_after_delay_and_first_answer_wins(self):
+        self.server.delays['/opencage'] = 1.0
+        started = time.monotonic()
+        result, complete = geocoding.geocode_remote('Dublin')
+        elapsed = time.monotonic() - started
+        self.assertEqual((result['source'], complete), ('nominatim', True))
+        self.assertGreaterEqual(elapsed, self.HEDGE_DELAY_MS / 1000)
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(self.server.calls, {'/opencage': 1, '/nominatim': 1})
+
+    def test_falls_back_to_secondary_when_primary_fails(self):
+        self.server.statuses['/opencage'] = 500
+        started = time.monotonic()
+        result, complete = geocoding.geocode_remote('Dublin')
+        self.assertEqual((result['source'], complete), ('nominatim', True))
+        # Started on the failure, without waiting for the hedge delay
+        self.assertLess(time.monotonic() - started, self.HEDGE_DELAY_MS / 1000)
+
+    def test_breaker_opens_after_failures_and_half_opens_after_cooldown(self):
+        self.server.statuses['/opencage'] = 503
+        for _ in range(self.BREAKER_FAILURES):
+            geocoding.geocode_remote('Dublin')
+        self.assertEqual(geocoding.breakers['opencage'].state, 'open')
+
+        # Open: OpenCage is skipped and Nominatim is asked straight away
+        result, complete = geocoding.geocode_remote('Dublin')
+        self.assertEqual((result['source'], complete), ('nominatim', True))
+        self.assertEqual(self.server.calls['/opencage'], self.BREAKER_FAILURES)
+
+        time.sleep(self.BREAKER_RESET)
+        self.assertEqual(geocoding.breakers['opencage'].state, 'half-open')
+        # One trial call goes through; its success closes the breaker again
+        self.server.statuses['/opencage'] = 200
+        result, complete = geocoding.geocode_remote('Dublin')
+        self.assertEqual(result['source'], 'opencage')
+        self.assertEqual(self.server.calls['/opencage'], self.BREAKER_FAILURES + 1)
+        self.assertEqual(geocoding.breakers['opencage'].state, 'closed')
+
+    def test_failed_trial_reopens_breaker(self):
+        self.server.statuses['/opencage'] = 503
+        for _ in range(self.BREAKER_FAILURES):
+            geocoding.geocode_remote('Dublin')
+        time.sleep(self.BREAKER_RESET)
+        geocoding.geocode_remote('Dublin')
+        self.assertEqual(self.server.calls['/opencage'], self.BREAKER_FAILURES + 1)
+        self.assertEqual(geocoding.breakers['opencage'].state, 'open')
+
+    def test_every_provider_failing_raises(self):
+        self.server.statuses = {'/opencage': 500, '/nominatim': 502}
+        with self.assertRaisesRegex(geocoding.GeocodingError, 'opencage: HTTP 500; nominatim: HTTP 502'):
+            geocoding.geocode_remote('Dublin')
+
+    def test_async_hedge_fires_after_delay(self):
+        self.server.delays['/opencage'] = 1.0
+        result, complete = async_to_sync(geocoding.ageocode_remote)('Dublin')
+        self.assertEqual((result['source'], complete), ('nominatim', True))
+        self.assertEqual(self.wait_for_calls('/opencage', 1), 1)
+
+
+SERVICE_TYPES = ('hospital', 'police', 'fire')
+
+
+# `count` index rows scattered over Ireland, reproducibly from `seed`
+def random_rows(count, seed, first_id=1):
+    rng = random.Random(seed)
+    return [
+        service_row(service_id, rng.uniform(51.4, 55.4), rng.uniform(-10.5, -5.5), rng.choice(SERVICE_TYPES))
+        for service_id in range(first_id, first_id + count)
+    ]
+
+
+# Reference answers: haversine to every row
+def brute_force(rows, lat, lng, service_type=None):
+    pairs = [
+        (row, haversine_m(lat, lng, row['latitude'], row['longitude']))
+        for row in rows if service_type is None or row['service_type'] == service_type
+    ]
+    pairs.sort(key=lambda pair: pair[1])
+    return pairs
+
+
+# Distances of (row, distance_m) pairs in order, rounded so float noise does not count
+def rounded_distances(pairs):
+    return [round(distance, 6) for _, distance in pairs]
+
+
+class ServiceIndexTests(SimpleTestCase):
+    """KD-tree answers match a brute-force haversine scan, before and after patches"""
+
+    QUERIES = 50
+
+    def setUp(self):
+        self.rows = random_rows(2000, seed=1)
+        self.rng = random.Random(2)
+
+    def query_points(self):
+        return [(self.rng.uniform(51.4, 55.4), self.rng.uniform(-10.5, -5.5)) for _ in range(self.QUERIES)]
+
+    # Same ids at the same distances; ties may come in either order, so distances are
+    # compared in order and ids as sets
+    def assert_same_results(self, results, expected):
+        self.assertEqual(rounded_distances(results), rounded_distances(expected))
+        self.assertEqual({row['id'] for row, _ in results}, {row['id'] for row, _ in expected})
+
+    def assert_matches_brute_force(self, index, rows):
+        for lat, lng in self.query_points():
+            for service_type in (None, *SERVICE_TYPES):
+                expected = brute_force(rows, lat, lng, service_type)
+                for limit in (1, 5, 20):
+                    self.assert_same_results(index.nearest(lat, lng, limit, service_type), expected[:limit])
+                for radius_m in (1_000, 25_000, 80_000):
+                    self.assert_same_results(
+                        index.within_radius(lat, lng, radius_m, service_type),
+                        [pair for pair in expected if pair[1] <= radius_m],
+                    )
+                if service_type:
+                    self.assert_same_results(index.by_type(lat, lng, service_type), expected)
+
+    def test_matches_brute_force(self):
+        self.assert_matches_brute_force(ServiceIndex(self.rows), self.rows)
+
+    def test_limit_beyond_row_count(self):
+        index = ServiceIndex(self.rows[:3])
+        self.assertEqual(len(index.nearest(53.35, -6.26, 10)), 3)
+        self.assertEqual(ServiceIndex().nearest(53.35, -6.26, 10), [])
+
+    def test_insert_move_retype_and_delete(self):
+        index = ServiceIndex(self.rows)
+        rows = {row['id']: row for row in self.rows}
+        for row in random_rows(30, seed=3, first_id=10_001):
+            index.upsert(row)
+            rows[row['id']] = row
+        for service_id in self.rng.sample(sorted(rows), 30):
+            moved = dict(rows[service_id], latitude=self.rng.uniform(51.4, 55.4))
+            index.upsert(moved)
+            rows[service_id] = moved
+        for service_id in self.rng.sample(sorted(rows), 30):
+            retyped = dict(rows[service_id], service_type=self.rng.choice(SERVICE_TYPES))
+            index.upsert(retyped)
+            rows[service_id] = retyped
+        for service_id in self.rng.sample(sorted(rows), 30):
+            index.remove(service_id)
+            del rows[service_id]
+        index.remove(-1)
+        self.assertEqual(len(index), len(rows))
+        self.assert_matches_brute_force(index, list(rows.values()))
+
+    def test_sync_patches_small_changes_only(self):
+        index = ServiceIndex(self.rows)
+        fresh = [dict(row, latitude=row['latitude'] + 0.01) for row in self.rows[:5]] + self.rows[10:]
+        self.assertFalse(index.sync(fresh, max_changes=5))
+        self.assertEqual(len(index), len(self.rows))
+        self.assertTrue(index.sync(fresh, max_changes=10))
+        self.assert_matches_brute_force(index, fresh)
+
+
+@override_settings(COVERAGE_GRID_CELL_DEG=0.25, COVERAGE_GRID_K=8, COVERAGE_GRID_MAX_SHORTLIST=500)
+class CoverageGridTests(SimpleTestCase):
+    """Grid lookups match brute force, also after incremental updates"""
+
+    QUERIES = 300
+
+    def setUp(self):
+        self.rows = random_rows(600, seed=4)
+        self.rng = random.Random(5)
+
+    # The grid's own answer (not the KD-tree fallback), nearest first
+    def grid_nearest(self, index, lat, lng, limit, service_type=None):
+        types = [service_type] if service_type else index.service_types()
+        rows = {service_type: index.tree_and_rows(service_type)[1] for service_type in types}
+        results = index._grid.nearest(lat, lng, limit, types, rows)
+        self.assertIsNotNone(results, f'no grid answer at {lat}, {lng}')
+        results.sort(key=lambda pair: pair[1])
+        return results[:limit]
+
+    def assert_matches_brute_force(self, index, rows):
+        for _ in range(self.QUERIES):
+            lat, lng = self.rng.uniform(51.4, 55.4), self.rng.uniform(-10.5, -5.5)
+            service_type = self.rng.choice((None, *SERVICE_TYPES))
+            limit = self.rng.randint(1, 8)
+            self.assertEqual(
+                rounded_distances(self.grid_nearest(index, lat, lng, limit, service_type)),
+                rounded_distances(brute_force(rows, lat, lng, service_type)[:limit]),
+            )
+
+    def test_lookup_matches_brute_force(self):
+        index = ServiceIndex(self.rows, coverage_grid=True)
+        self.assert_matches_brute_force(index, self.rows)
+
+    def test_cell_corners_match_brute_force(self):
+        index = ServiceIndex(self.rows, coverage_grid=True)
+        grid = index._grid
+        # Just inside the corners of every tenth cell: the farthest points from its centre
+        for cell in range(0, len(grid), 10):
+            row, col = divmod(cell, grid.cols)
+            south, west = grid.min_lat + row * grid.cell_deg, grid.min_lng + col * grid.cell_deg
+            north = min(south + grid.cell_deg, grid.max_lat)
+            east = min(west + grid.cell_deg, grid.max_lng)
+            for lat in (south + 1e-6, north - 1e-6):
+                for lng in (west + 1e-6, east - 1e-6):
+                    self.assertEqual(rounded_distances(self.grid_nearest(index, lat, lng, 8)),
+                                     rounded_distances(brute_force(self.rows, lat, lng)[:8]))
+
+    def test_no_answer_outside_grid_or_above_k(self):
+        index = ServiceIndex(self.rows, coverage_grid=True)
+        rows = {service_type: index.tree_and_rows(service_type)[1] for service_type in SERVICE_TYPES}
+        self.assertIsNone(index._grid.nearest(48.85, 2.35, 5, SERVICE_TYPES, rows))
+        self.assertIsNone(index._grid.nearest(53.35, -6.26, 9, SERVICE_TYPES, rows))
+        # The index falls back to its KD-trees for both
+        self.assertEqual(len(index.nearest(53.35, -6.26, 9)), 9)
+
+    def test_incremental_updates_match_rebuild(self):
+        index = ServiceIndex(self.rows, coverage_grid=True)
+        rows = {row['id']: row for row in self.rows}
+        changes = []
+        changes += [('upsert', row) for row in random_rows(20, seed=6, first_id=10_001)]
+        changes += [('upsert', dict(rows[service_id], longitude=self.rng.uniform(-10.5, -5.5)))
+                    for service_id in self.rng.sample(sorted(rows), 20)]
+        changes += [('upsert', dict(rows[service_id], service_type=self.rng.choice(SERVICE_TYPES)))
+                    for service_id in self.rng.sample(sorted(rows), 20)]
+        changes += [('remove', service_id) for service_id in self.rng.sample(sorted(rows), 20)]
+        for action, change in changes:
+            if action == 'upsert':
+                index.upsert(change)
+                rows[change['id']] = change
+            else:
+                index.remove(change)
+                rows.pop(change, None)
+        self.assert_matches_brute_force(index, list(rows.values()))
+        rebuilt = ServiceIndex(list(rows.values()), coverage_grid=True)
+        self.assertEqual(index._grid._shortlists, rebuilt._grid._shortlists)
+
+    def test_first_service_of_a_type_builds_its_layer(self):
+        index = ServiceIndex([row for row in self.rows if row['service_type'] != 'fire'], coverage_grid=True)
+        index.upsert(service_row(20_001, 53.35, -6.26, 'fire'))
+        [(row, distance)] = self.grid_nearest(index, 51.9, -8.47, 1, 'fire')
+        self.assertEqual(row['id'], 20_001)
+
+
+class CoverageStoreTests(TestCase):
+    """Stored coverage follows a service that changed type"""
+
+    def test_service_that_changed_type_moves_its_area(self):
+        services = [
+            EmergencyService.objects.create(
+                name=f'Station {n}', service_type='fire', address='', location=Point(-6.26 - n, 53.35, srid=4326)
+            )
+            for n in range(3)
+        ]
+        coverage.store_results('fire', {service.id: [100.0, 2, 500.0, 30_000.0] for service in services}, [])
+        self.assertEqual(ServiceArea.objects.filter(service_type='fire').count(), 3)
+
+        EmergencyService.objects.filter(id=services[0].id).update(service_type='police')
+        coverage.store_results('police', {services[0].id: [250.0, 3, 900.0, 100_000.0]}, [])
+        area = ServiceArea.objects.get(service_id=services[0].id)
+        self.assertEqual((area.service_type, area.population, area.mean_distance_m), ('police', 250, 400.0))
+        self.assertEqual(ServiceArea.objects.filter(service_type='fire').count(), 2)
+
+        coverage.store_results('fire', {service.id: [100.0, 2, 500.0, 30_000.0] for service in services[1:]}, [])
+        self.assertEqual(
+            sorted(ServiceArea.objects.values_list('service_type', flat=True)), ['fire', 'fire', 'police']
+        )
+
+
+GAZETTEER_FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'gazetteer.csv')
+
+
+class GazetteerTests(SimpleTestCase):
+    """Prefix and range lookups agree with a linear scan of the fixture gazetteer"""
+
+    MAX_SUGGESTIONS = 5
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gazetteer = Gazetteer.from_csv(GAZETTEER_FIXTURE, 1000, cls.MAX_SUGGESTIONS)
+
+    # Entry indices (ranks) whose name, or a later word of it, starts with the prefix
+    def scan(self, prefix, limit):
+        found = []
+        for index, entry in enumerate(self.gazetteer.entries):
+            words = geocoding.normalize_query(entry[0]).split(' ')
+            if any(' '.join(words[start:]).startswith(prefix) for start in range(len(words))):
+                found.append(index)
+        return found[:limit]
+
+    def test_rows_outside_ireland_or_unparsable_are_skipped(self):
+        names = {entry[0] for entry in self.gazetteer.entries}
+        self.assertEqual(len(self.gazetteer), 13)
+        self.assertNotIn('Paris', names)
+        self.assertNotIn('Nowhere', names)
+
+    def test_prefix_match_equals_linear_scan(self):
+        prefixes = {'zz', 'dublin x', 'street s'}
+        for key in self.gazetteer.keys:
+            prefixes.update(key[:length] for length in range(1, len(key) + 1))
+        for prefix in sorted(prefixes):
+            for limit in range(1, self.MAX_SUGGESTIONS + 1):
+                self.assertEqual(self.gazetteer._match(prefix, limit), self.scan(prefix, limit), prefix)
+
+    def test_range_best_ranked_equals_linear_scan(self):
+        entries = self.gazetteer.key_entries
+        for lo in range(len(entries) + 1):
+            for hi in range(lo, len(entries) + 1):
+                for limit in (1, 2, 4, 100):
+                    self.assertEqual(
+                        self.gazetteer._best_ranked(lo, hi, limit), sorted(set(entries[lo:hi]))[:limit]
+                    )
+
+    # Most populous first; equally populous (streets) by name
+    def test_autocomplete_normalises_and_ranks_by_population(self):
+        self.assertEqual([place['name'] for place in self.gazetteer.autocomplete("  O'Conn")], ["O'Connell Street"])
+        self.assertEqual([place['name'] for place in self.gazetteer.autocomplete('D', limit=3)],
+                         ['Dublin', 'Drogheda', 'Dún Laoghaire'])
+        self.assertEqual([place['name'] for place in self.gazetteer.autocomplete('str')],
+                         ['Cork Street', 'Main Street', 'Main Street', "O'Connell Street"])
+        self.assertEqual(self.gazetteer.autocomplete('!!'), [])
+
+    def test_exact_lookup(self):
+        lookup = self.gazetteer.lookup
+        self.assertEqual(lookup('dublin')['formatted_address'], 'Dublin')
+        self.assertEqual(lookup('dunmore')['formatted_address'], 'Dunmore, Co. Galway')
+        self.assertEqual(lookup('dunmore east co waterford')['source'], 'gazetteer')
+        # Streets only with their county
+        self.assertIsNone(lookup('main street'))
+        self.assertEqual(lookup('main street cork')['lat'], 51.8970)
+        self.assertEqual(lookup('main street county galway')['lat'], 53.2720)
+        # Equally ranked places of one name are left to the providers, unless the county tells them apart
+        self.assertIsNone(lookup('newtown'))
+        self.assertEqual(lookup('newtown kildare')['lat'], 53.2)
+        # The more populous place wins a shared key: "cork" is the city, not Cork Street
+        self.assertEqual(lookup('cork')['formatted_address'], 'Cork')
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'geocode': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'geocode-tests'},
+})
+class GeocodeCacheTests(SimpleTestCase):
+    """Query normalisation and the two-tier geocode cache"""
+
+    def test_normalize_query(self):
+        for query, key in [
+            ('Dublin', 'dublin'),
+            ("  O'Connell   Street,\tDublin 1 ", 'oconnell street dublin 1'),
+            ('O\u2019Connell St.', 'oconnell st'),
+            ('Cork, Ireland', 'cork'),
+            ('Galway, Republic of Ireland', 'galway'),
+            ('Sligo Eire', 'sligo'),
+            ('Tralee, IE', 'tralee'),
+            ('Ireland', 'ireland'),
+            ('Dún Laoghaire', 'dún laoghaire'),
+            ('?!', ''),
+        ]:
+            self.assertEqual(geocoding.normalize_query(query), key, query)
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = geocoding.LRUCache(2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        self.assertEqual(cache.get('a'), (True, 1))
+        cache.set('c', 3, 60)
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual((cache.get('a'), cache.get('c')), ((True, 1), (True, 3)))
+        self.assertEqual(len(cache), 2)
+
+    def test_lru_expires_entries(self):
+        cache = geocoding.LRUCache(10)
+        with mock.patch.object(geocoding.time, 'monotonic', return_value=100.0):
+            cache.set('a', 1, 5)
+            cache.set('b', None, 60)
+        with mock.patch.object(geocoding.time, 'monotonic', return_value=105.0):
+            self.assertEqual(cache.get('a'), (False, None))
+            # A cached "not found" is a hit with value None
+            self.assertEqual(cache.get('b'), (True, None))
+        self.assertEqual(len(cache), 1)
+
+    def test_shared_tier_is_promoted_and_negative_results_kept(self):
+        cache = geocoding.GeocodeCache(max_size=10, ttl=60, negative_ttl=30, shared_alias='geocode')
+        result = {'lat': 53.3498, 'lng': -6.2603, 'source': 'nominatim'}
+        cache.set('dublin', result)
+        cache.set('nowhere', None)
+        other_worker = geocoding.GeocodeCache(max_size=10, ttl=60, negative_ttl=30, shared_alias='geocode')
+        self.assertEqual(other_worker.get('dublin'), (True, result))
+        self.assertEqual(other_worker.get('dublin'), (True, result))
+        self.assertEqual(other_worker.get('nowhere'), (True, None))
+        self.assertEqual(other_worker.get('cork'), (False, None))
+        stats = other_worker.stats()
+        self.assertEqual(
+            {name: stats[name] for name in ('shared_hits', 'memory_hits', 'negative_hits', 'misses')},
+            {'shared_hits': 1, 'memory_hits': 1, 'negative_hits': 1, 'misses': 1},
+        )
+        self.assertEqual(stats['hit_rate'], 0.75)
+
+
+class CursorTests(SimpleTestCase):
+    """Keyset cursors round-trip and reject anything they did not produce"""
+
+    def test_round_trip(self):
+        for name, service_id in [('Dublin Fire Station', 1), ('', 2), ('Dún Laoghaire "Garda"', 2**40)]:
+            token = encode_cursor({'name': name, 'id': service_id, 'service_type': 'fire'})
+            self.assertNotIn('=', token)
+            self.assertEqual(decode_cursor(token), (name, service_id))
+
+    def test_malformed_cursors_raise(self):
+        def token(payload):
+            return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        for bad in ['not base64!', token('not json'), token('["Cork"]'), token('["Cork", 1, 2]'),
+                    token('["Cork", "1"]'), token('[1, 1]'), token('{"name": "Cork", "id": 1}'), token('null')]:
+            with self.assertRaises((ValueError, TypeError, UnicodeDecodeError), msg=bad):
+                decode_cursor(bad)
+
+
+class KeysetPaginationTests(TestCase):
+    """The service list pages through ties on name without gaps or repeats"""
+
+    NAMES = ['Alpha', 'Bravo', 'Bravo', 'Bravo', 'Charlie', 'Charlie', 'Delta']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ids = [
+            EmergencyService.objects.create(
+                name=name, service_type='fire', address='', location=Point(-6.26, 53.35, srid=4326)
+            ).id
+            for name in cls.NAMES
+        ]
+
+    def get_page(self, **params):
+        response = self.client.get('/api/services/', params, HTTP_ACCEPT='application/json')
+        return response.status_code, response.json()
+
+    def test_pages_cover_every_row_once_in_order(self):
+        for page_size in (1, 2, 3, 7, 50):
+            seen = []
+            params = {'page_size': page_size}
+            while True:
+                status_code, page = self.get_page(**params)
+                self.assertEqual(status_code, 200)
+                self.assertLessEqual(len(page['results']), page_size)
+                seen.extend((row['name'], row['id']) for row in page['results'])
+                if page['cursor'] is None:
+                    self.assertIsNone(page['next'])
+                    break
+                self.assertIn(f"cursor={page['cursor']}", page['next'])
+                params['cursor'] = page['cursor']
+            self.assertEqual(seen, sorted(zip(self.NAMES, self.ids)), page_size)
+
+    def test_cursor_inside_a_tie_continues_after_its_id(self):
+        bravo = [service_id for name, service_id in zip(self.NAMES, self.ids) if name == 'Bravo']
+        cursor = encode_cursor({'name': 'Bravo', 'id': bravo[0]})
+        status_code, page = self.get_page(cursor=cursor, page_size=2)
+        self.assertEqual(status_code, 200)
+        self.assertEqual([row['id'] for row in page['results']], bravo[1:])
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ['garbage', encode_cursor({'name': 'Bravo', 'id': 'x'}),
+                       base64.urlsafe_b64encode(b'["Bravo"]').decode()]:
+            status_code, _ = self.get_page(cursor=cursor)
+            self.assertEqual(status_code, 404, cursor)
+
+    def test_page_size_is_clamped(self):
+        _, page = self.get_page(page_size=0)
+        self.assertEqual(len(page['results']), 1)
+        _, page = self.get_page(page_size='lots')
+        self.assertEqual(len(page['results']), len(self.NAMES))
+
+    def test_changes_snapshot_is_paged_under_one_cursor(self):
+        url, seen, cursors = '/api/services/changes/?page_size=3', [], set()
+        while url:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertTrue(page['full'])
+            self.assertLessEqual(len(page['changed']), 3)
+            seen.extend((row['name'], row['id']) for row in page['changed'])
+            cursors.add(page['cursor'])
+            url = page['next']
+        self.assertEqual(seen, sorted(zip(self.NAMES, self.ids)))
+        self.assertEqual(len(cursors), 1)
+
+        response = self.client.get('/api/services/changes/', {'since': cursors.pop()}, HTTP_ACCEPT='application/json')
+        self.assertFalse(response.json()['full'])
+        self.assertIsNone(response.json()['next'])
+
+
+# Rows back from a decoded columnar payload (JSON lists, or packed little-endian bytes)
+def columnar_rows(payload):
+    columns = dict(payload['columns'])
+    count = len(columns['name'])
+    for name, code in (('id', 'I'), ('type', 'B'), ('lat', 'i'), ('lng', 'i'), ('distance_m', 'I'),
+                       ('is_24_hours', 'B'), ('travel_time_s', 'I'), ('available', 'i')):
+        if isinstance(columns.get(name), bytes):
+            columns[name] = list(struct.unpack(f'<{count}{code}', columns[name]))
+    rows = []
+    for position in range(count):
+        row = {
+            'id': columns['id'][position],
+            'service_type': payload['types'][columns['type'][position]],
+            'latitude': columns['lat'][position] / payload['scale'],
+            'longitude': columns['lng'][position] / payload['scale'],
+            'distance_m': columns['distance_m'][position],
+            'is_24_hours': bool(columns['is_24_hours'][position]),
+            'name': columns['name'][position],
+            'address': columns['address'][position],
+            'phone': columns['phone'][position],
+        }
+        if 'travel_time_s' in columns:
+            seconds = columns['travel_time_s'][position]
+            row['travel_time_s'] = None if seconds == renderers.MAX_UINT32 else seconds
+        rows.append(row)
+    return rows
+
+
+# What a columnar client can expect back for a response row: the same fields, coordinates
+# to a millionth of a degree and whole metres and seconds
+def expected_columnar(row):
+    expected = {
+        'id': row['id'], 'service_type': row['service_type'],
+        'latitude': round(row['latitude'], 6), 'longitude': round(row['longitude'], 6),
+        'distance_m': round(row['distance']['m']), 'is_24_hours': row['is_24_hours'],
+        'name': row['name'], 'address': row['address'], 'phone': row['phone'],
+    }
+    if 'travel_time' in row:
+        expected['travel_time_s'] = None if row['travel_time'] is None else round(row['travel_time']['s'])
+    return expected
+
+
+class ColumnarRendererTests(SimpleTestCase):
+    """Columnar JSON and MessagePack bodies decode back to the response rows"""
+
+    def setUp(self):
+        rows = random_rows(40, seed=7)
+        rows[0]['name'] = 'Dún Laoghaire "Harbour" Station'
+        rows[1]['is_24_hours'] = False
+        pairs = [(row, haversine_m(53.35, -6.26, row['latitude'], row['longitude'])) for row in rows]
+        self.data = {'user_location': {'lat': 53.35, 'lng': -6.26}, 'count': len(rows),
+                     'services': encode_indexed_rows(pairs)}
+        # Every fifth service has no road route
+        triples = [
+            (row, distance, None if index % 5 == 0 else distance / 15) for index, (row, distance) in enumerate(pairs)
+        ]
+        self.travel_data = {'count': len(rows), 'rank': 'travel_time', 'services': encode_travel_time_rows(triples)}
+
+    def assert_decodes(self, decode, renderer, data):
+        payload = decode(renderer.render(data))
+        self.assertEqual({key: payload[key] for key in data if key != 'services'},
+                         {key: value for key, value in data.items() if key != 'services'})
+        decoded = columnar_rows(payload)
+        for row in decoded:
+            row['latitude'] = round(row['latitude'], 6)
+            row['longitude'] = round(row['longitude'], 6)
+        self.assertEqual(decoded, [expected_columnar(row) for row in data['services']])
+
+    def test_columnar_json_round_trip(self):
+        for data in (self.data, self.travel_data):
+            self.assert_decodes(json.loads, renderers.ColumnarJSONRenderer(), data)
+
+    @skipIf(renderers.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_round_trip(self):
+        for data in (self.data, self.travel_data):
+            self.assert_decodes(
+                lambda body: renderers.msgpack.unpackb(body, raw=False), renderers.MessagePackRenderer(), data
+            )
+
+    def test_other_payloads_pass_through(self):
+        for data in ({'error': 'Invalid parameters.'}, {'total': 3, 'by_type': {'fire': 3}}):
+            self.assertEqual(json.loads(renderers.ColumnarJSONRenderer().render(data)), data)
+
+    def test_json_renderer_matches_stdlib(self):
+        self.assertEqual(json.loads(renderers.FastJSONRenderer().render(self.data)), json.loads(json.dumps(self.data)))
+
+
+VALID_RECORD = {
+    'external_id': 'hse-1', 'name': 'Mater Hospital', 'service_type': 'Hospital', 'address': 'Eccles St, Dublin',
+    'phone': '01 803 2000', 'email': 'info@mater.ie', 'lat': '53.3596', 'lng': '-6.2675', 'capacity': '570',
+    'is_24_hours': 'yes', 'description': 'Tab\there',
+}
+
+
+class ImportValidationTests(SimpleTestCase):
+    """Records from every input format are validated into staging rows or rejected with a reason"""
+
+    def test_flat_record(self):
+        self.assertEqual(ingest.clean_record(VALID_RECORD), (
+            'hse-1', 'Mater Hospital', 'hospital', 'Eccles St, Dublin', '01 803 2000', 'info@mater.ie',
+            53.3596, -6.2675, 570, True, 'Tab\there',
+        ))
+
+    def test_geojson_feature_and_ndjson_line(self):
+        feature = {'type': 'Feature', 'id': 'g-7', 'geometry': {'type': 'Point', 'coordinates': [-8.47, 51.9]},
+                   'properties': {'name': 'Cork Fire', 'type': 'fire', 'address': 'Anglesea St'}}
+        self.assertEqual(ingest.clean_record(feature)[:3], ('g-7', 'Cork Fire', 'fire'))
+        self.assertEqual(ingest.clean_record(json.dumps(feature))[6:8], (51.9, -8.47))
+
+    def test_missing_external_id_gets_a_stable_key(self):
+        record = {key: value for key, value in VALID_RECORD.items() if key != 'external_id'}
+        key = ingest.clean_record(record)[0]
+        self.assertTrue(key.startswith('auto:'))
+        self.assertEqual(ingest.clean_record(dict(record, name='MATER HOSPITAL', phone='x'))[0], key)
+        self.assertNotEqual(ingest.clean_record(dict(record, address='Elsewhere'))[0], key)
+
+    def test_invalid_records(self):
+        for changes, message in [
+            ({'name': ' '}, 'name is required'),
+            ({'service_type': 'ambulance'}, "unknown service_type 'ambulance'"),
+            ({'address': ''}, 'address is required'),
+            ({'email': 'not-an-email'}, "invalid email 'not-an-email'"),
+            ({'lat': 'north'}, 'lat and lng must be numbers'),
+            ({'lat': '48.85', 'lng': '2.35'}, 'outside Ireland'),
+            ({'capacity': 'many'}, 'capacity must be a whole number'),
+            ({'capacity': '-1'}, 'capacity is out of range'),
+            ({'is_24_hours': 'sometimes'}, 'is_24_hours must be a boolean'),
+            ({'name': 'x' * 201}, 'name is longer than 200 characters'),
+        ]:
+            with self.assertRaisesRegex(ValueError, re.escape(message), msg=changes):
+                ingest.clean_record(dict(VALID_RECORD, **changes))
+        with self.assertRaisesRegex(ValueError, 'geometry must be a Point'):
+            ingest.clean_record({'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': []}})
+
+    def test_batch_renders_copy_rows_and_collects_errors(self):
+        copy_data, valid, read, errors = ingest.validate_batch([
+            (1, VALID_RECORD), (2, dict(VALID_RECORD, service_type='ambulance')), (3, '{not json'),
+        ])
+        self.assertEqual((valid, read), (1, 3))
+        self.assertEqual([line_no for line_no, _ in errors], [2, 3])
+        fields = copy_data.decode().rstrip('\n').split('\t')
+        self.assertEqual(len(fields), len(ingest.STAGING_COLUMNS))
+        self.assertEqual(fields[:3], ['1', 'hse-1', 'Mater Hospital'])
+        # The tab inside the description is escaped rather than splitting the row
+        self.assertEqual(fields[-2:], ['t', 'Tab\\there'])
+
+    def test_geojson_is_streamed_across_reads(self):
+        features = [{'type': 'Feature', 'id': str(n), 'geometry': {'type': 'Point', 'coordinates': [-6.2, 53.3]},
+                     'properties': {'name': f'Station {n}'}} for n in range(20)]
+        text = json.dumps({'type': 'FeatureCollection', 'features': features})
+        with mock.patch.object(ingest, 'READ_SIZE', 7):
+            self.assertEqual(list(ingest.read_geojson(io.StringIO(text))), features)
+            with self.assertRaisesRegex(ValueError, 'ended inside'):
+                list(ingest.read_geojson(io.StringIO(text[:-10])))
+
+    def test_detect_format(self):
+        self.assertEqual([ingest.detect_format(path) for path in ('a.CSV', 'b.jsonl', 'c.geojson')],
+                         ['csv', 'ndjson', 'geojson'])
+        with self.assertRaisesRegex(ValueError, 'pass --format'):
+            ingest.detect_format('services.xlsx')
+
+
+class ImportUpsertTests(TransactionTestCase):
+    """import_services upserts on external_id: the last duplicate wins, unchanged rows stay put"""
+
+    HEADER = 'external_id,name,service_type,address,lat,lng\n'
+
+    def run_import(self, lines):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write(self.HEADER + ''.join(f'{line}\n' for line in lines))
+        self.addCleanup(os.remove, handle.name)
+        out = io.StringIO()
+        with mock.patch('services.management.commands.import_services.bump_data_version') as bump:
+            call_command(
+                'import_services', handle.name, workers=1, no_isochrones=True, stdout=out, stderr=io.StringIO()
+            )
+        counts = re.findall(r'(\d+) inserted, (\d+) updated, (\d+) unchanged', out.getvalue())[-1]
+        return tuple(map(int, counts)), bump.call_count
+
+    def test_duplicates_and_reimport(self):
+        counts, bumps = self.run_import([
+            'a,Station A,fire,Street 1,53.30,-6.20',
+            'b,Station B,police,Street 2,53.31,-6.21',
+            'a,Station A2,fire,Street 1,53.30,-6.20',
+            'c,Bad,ambulance,Street 3,53.32,-6.22',
+        ])
+        self.assertEqual((counts, bumps), ((2, 0, 0), 1))
+        self.assertEqual(
+            dict(EmergencyService.objects.values_list('external_id', 'name')), {'a': 'Station A2', 'b': 'Station B'}
+        )
+        updated_at = dict(EmergencyService.objects.values_list('external_id', 'updated_at'))
+
+        # The same data again changes nothing, so the data version is not bumped
+        counts, bumps = self.run_import([
+            'a,Station A2,fire,Street 1,53.30,-6.20',
+            'b,Station B,police,Street 2,53.31,-6.21',
+        ])
+        self.assertEqual((counts, bumps), ((0, 0, 2), 0))
+        self.assertEqual(dict(EmergencyService.objects.values_list('external_id', 'updated_at')), updated_at)
+
+        counts, bumps = self.run_import([
+            'b,Station B,police,Street 2,53.40,-6.21',
+            'd,Station D,hospital,Street 4,53.50,-6.30',
+        ])
+        self.assertEqual((counts, bumps), ((1, 1, 0), 1))
+        moved = EmergencyService.objects.get(external_id='b')
+        self.assertEqual((moved.latitude, moved.longitude), (53.40, -6.21))
+        self.assertGreater(moved.updated_at, updated_at['b'])
+        self.assertEqual(EmergencyService.objects.get(external_id='a').updated_at, updated_at['a'])
+
+
+@override_settings(NEAREST_BATCH_MAX_POINTS=3, NEAREST_BATCH_MAX_LIMIT=5)
+class BatchRequestTests(SimpleTestCase):
+    """nearest/batch bodies are parsed within the configured limits, with a message for each mistake"""
+
+    def test_points_and_limits(self):
+        points, limits = parse_batch_request({
+            'points': [{'lat': '53.35', 'lng': -6.26}, [51.9, -8.47]],
+            'limits': {'hospital': 5, 'police': '2', 'fire': 0},
+        })
+        self.assertEqual(points, [(53.35, -6.26), (51.9, -8.47)])
+        # A zero limit leaves the type out of the query
+        self.assertEqual(limits, {'hospital': 5, 'police': 2})
+
+    def test_limits_default_to_one_of_each_type(self):
+        _, limits = parse_batch_request({'points': [[53.35, -6.26]]})
+        self.assertEqual(limits, {'hospital': 1, 'police': 1, 'fire': 1})
+
+    def test_size_limits(self):
+        point = [53.35, -6.26]
+        self.assertEqual(len(parse_batch_request({'points': [point] * 3})[0]), 3)
+        with self.assertRaisesMessage(ValueError, 'A batch can contain at most 3 points.'):
+            parse_batch_request({'points': [point] * 4})
+        with self.assertRaisesMessage(ValueError, 'Limits must be between 0 and 5.'):
+            parse_batch_request({'points': [point], 'limits': {'fire': 6}})
+        with self.assertRaisesMessage(ValueError, 'Limits must be between 0 and 5.'):
+            parse_batch_request({'points': [point], 'limits': {'fire': -1}})
+
+    def test_error_messages(self):
+        point = [53.35, -6.26]
+        bad_type = 'Invalid service type. Choose: hospital, police, or fire.'
+        for data, message in [
+            ([point], 'Request body must be a JSON object.'),
+            ({}, 'Provide "points" as a non-empty list.'),
+            ({'points': []}, 'Provide "points" as a non-empty list.'),
+            ({'points': {'lat': 53.35, 'lng': -6.26}}, 'Provide "points" as a non-empty list.'),
+            ({'points': [{'lat': 53.35}]}, 'Each point needs numeric lat and lng.'),
+            ({'points': [[53.35]]}, 'Each point needs numeric lat and lng.'),
+            ({'points': [['north', 'west']]}, 'Each point needs numeric lat and lng.'),
+            ({'points': [None]}, 'Each point needs numeric lat and lng.'),
+            ({'points': [[91, 0]]}, 'Point coordinates out of range.'),
+            ({'points': [[0, -181]]}, 'Point coordinates out of range.'),
+            ({'points': [point], 'limits': ['fire']}, '"limits" must map service types to counts.'),
+            ({'points': [point], 'limits': {'ambulance': 1}}, bad_type),
+            ({'points': [point], 'limits': {'fire': 'two'}}, 'Limits must be integers.'),
+            ({'points': [point], 'limits': {'fire': None}}, 'Limits must be integers.'),
+        ]:
+            with self.assertRaisesMessage(ValueError, message, msg=data):
+                parse_batch_request(data)
@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .data_version import get_data_version
+from .models import EmergencyService
+
+# Web Mercator world width in metres, used to size cluster cells per zoom level
+WEB_MERCATOR_WORLD_M = 40075016.685578488
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+# Services inside the tile (plus a small margin so edge markers are not clipped),
+# projected to Web Mercator for ST_AsMVTGeom
+POINTS_CTE = '''
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom,
+               ST_Transform(ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => %(margin)s), 4326) AS filter_geom
+    ),
+    points AS (
+        SELECT e.id, e.name, e.service_type, e.is_24_hours, ST_Transform(e.location, 3857) AS geom
+        FROM {table} e, bounds
+        WHERE e.location && bounds.filter_geom{type_filter}
+    )
+'''
+
+POINTS_TILE_SQL = POINTS_CTE + '''
+    SELECT ST_AsMVT(tile, 'services', %(extent)s, 'geom') FROM (
+        SELECT ST_AsMVTGeom(points.geom, bounds.geom, %(extent)s, %(buffer)s, true) AS geom,
+               points.id, points.name, points.service_type, points.is_24_hours, 1 AS point_count
+        FROM points, bounds
+    ) AS tile
+'''
+
+# Low zooms: snap points to a grid of cells and emit one feature per (cell, type) with a count
+CLUSTER_TILE_SQL = POINTS_CTE + ''',
+    clusters AS (
+        SELECT min(id) AS id, service_type, count(*) AS point_count,
+               ST_Centroid(ST_Collect(geom)) AS geom
+        FROM points
+        GROUP BY service_type, ST_SnapToGrid(geom, %(cell)s)
+    )
+    SELECT ST_AsMVT(tile, 'services', %(extent)s, 'geom') FROM (
+        SELECT ST_AsMVTGeom(clusters.geom, bounds.geom, %(extent)s, %(buffer)s, true) AS geom,
+               clusters.id, clusters.service_type, clusters.point_count
+        FROM clusters, bounds
+    ) AS tile
+'''
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def render_tile(z, x, y, service_type=None):
+    clustered = z <= settings.TILE_CLUSTER_MAX_ZOOM
+    sql = CLUSTER_TILE_SQL if clustered else POINTS_TILE_SQL
+    sql = sql.format(
+        table=connection.ops.quote_name(EmergencyService._meta.db_table),
+        type_filter=' AND e.service_type = %(service_type)s' if service_type else '',
+    )
+    params = {
+        'z': z,
+        'x': x,
+        'y': y,
+        'extent': TILE_EXTENT,
+        'buffer': TILE_BUFFER,
+        # Clusters are snapped to a global grid, so no margin (a margin would double count)
+        'margin': 0 if clustered else TILE_BUFFER / TILE_EXTENT,
+        'cell': WEB_MERCATOR_WORLD_M / 2 ** z / settings.TILE_CLUSTER_GRID,
+        'service_type': service_type,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] is not None else b''
+
+
+# Rendered tiles are cached per (z, x, y, type, data version); any edit bumps the
+# version, so old tiles are never served again and simply expire from the cache
+def get_tile(z, x, y, service_type=None):
+    key = f'tile:{get_data_version()}:{z}:{x}:{y}:{service_type or "all"}'
+    tile = cache.get(key)
+    if tile is None:
+        tile = render_tile(z, x, y, service_type)
+        cache.set(key, tile, settings.TILE_CACHE_TIMEOUT)
+    return tile
@@ -0,0 +1,202 @@
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+logger = logging.getLogger(__name__)
+
+# Per-request phase timings (REQUEST_TIMING): where a request's time went, split into
+# db (with the query count), serialize (building response rows), render (encoding the
+# body) and external (geocoding provider calls); the rest is reported as app. Exposed as
+# a Server-Timing header, logged as one JSON line through the services logger, and slow
+# queries get an EXPLAIN ANALYZE plan logged next to them. Without the middleware no
+# timing is current and every hook is a single context variable lookup
+
+# The timing of the request being handled. A context variable follows the request into
+# sync_to_async threads and async tasks; threads the code starts itself (the geocoding
+# hedge pool) are timed from the caller, which waits for them
+_current = contextvars.ContextVar('request_timing', default=None)
+
+# Statements explained recently: sql -> monotonic time. Bounded; cleared when full
+MAX_EXPLAINED = 1000
+_explained = {}
+_explained_lock = threading.Lock()
+
+
+class RequestTiming:
+    """Seconds and counts per phase of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        # Time covered by phases that have finished, so an enclosing phase (rows encoded
+        # while a lazy queryset runs its query) only counts its own time
+        self.covered = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, count=1):
+        with self.lock:
+            entry = self.phases.get(name)
+            if entry is None:
+                entry = self.phases[name] = [0.0, 0]
+            entry[0] += seconds
+            entry[1] += count
+
+    # Phase durations in milliseconds, with the unaccounted rest as app and the total
+    def summary(self):
+        total_ms = (time.perf_counter() - self.started) * 1000
+        phases = {name: {'ms': seconds * 1000, 'count': count} for name, (seconds, count) in self.phases.items()}
+        phases['app'] = {'ms': max(total_ms - sum(phase['ms'] for phase in phases.values()), 0.0), 'count': 1}
+        return total_ms, phases
+
+    def header(self, total_ms, phases):
+        entries = []
+        for name, phase in phases.items():
+            entry = f"{name};dur={phase['ms']:.1f}"
+            if name == 'db':
+                entry += f''';desc="{phase['count']} queries"'''
+            entries.append(entry)
+        entries.append(f'total;dur={total_ms:.1f}')
+        return ', '.join(entries)
+
+
+# Time the enclosed code as one occurrence of `name`, excluding phases nested inside it
+@contextmanager
+def phase(name):
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    covered_before = timing.covered
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timing.add(name, elapsed - (timing.covered - covered_before))
+        timing.covered = covered_before + elapsed
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# connection_created receiver: time every query on the connection as db. Connections are
+# reopened by the same wrapper object, so the wrapper is only added once
+def install_db_timing(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def time_query(execute, sql, params, many, context):
+    if _current.get() is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    with phase('db'):
+        result = execute(sql, params, many, context)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if settings.SLOW_QUERY_MS and elapsed_ms >= settings.SLOW_QUERY_MS and not many:
+        log_slow_query(context['connection'], sql, params, elapsed_ms)
+    return result
+
+
+# Read-only statements are run again under EXPLAIN ANALYZE (at most once per statement per
+# SLOW_QUERY_EXPLAIN_INTERVAL, since that doubles their cost); anything else is logged
+# without a plan. The plan runs in a savepoint, so a failure cannot break the request's
+# transaction, and outside the request timing
+def explain(connection, sql, params):
+    if not sql.lstrip()[:7].upper().startswith(('SELECT', 'EXECUTE')):
+        return None
+    now = time.monotonic()
+    with _explained_lock:
+        if now - _explained.get(sql, float('-inf')) < settings.SLOW_QUERY_EXPLAIN_INTERVAL:
+            return None
+        if len(_explained) >= MAX_EXPLAINED:
+            _explained.clear()
+        _explained[sql] = now
+    token = _current.set(None)
+    try:
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params)
+                return '\n'.join(line for (line,) in cursor.fetchall())
+    except DatabaseError as e:
+        logger.warning(f'EXPLAIN ANALYZE of a slow query failed: {e}')
+        return None
+    finally:
+        _current.reset(token)
+
+
+def log_slow_query(connection, sql, params, elapsed_ms):
+    logger.warning(json.dumps({
+        'event': 'slow_query',
+        'ms': round(elapsed_ms, 1),
+        'sql': sql,
+        'plan': explain(connection, sql, params),
+    }))
+
+
+class RequestTimingMiddleware:
+    """Adds a Server-Timing header with per-phase timings and logs slow requests"""
+    sync_capable = True
+    async_capable = True
+
+    # Async under ASGI when the rest of the chain is; the timing is current for the
+    # awaited handler and every sync_to_async call it makes
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing)
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing)
+
+    def finish(self, request, response, timing):
+        # A streamed body is produced after this point, so its timings cover the
+        # response headers only
+        total_ms, phases = timing.summary()
+        response['Server-Timing'] = timing.header(total_ms, phases)
+        if total_ms >= settings.REQUEST_TIMING_LOG_MS:
+            logger.info(json.dumps({
+                'event': 'request_timing',
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(total_ms, 1),
+                'phases': {
+                    name: {'ms': round(phase['ms'], 1), 'count': phase['count']} for name, phase in phases.items()
+                },
+            }))
+        return response
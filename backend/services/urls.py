@@ -1,6 +1,11 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import EmergencyServiceViewSet, geocode_address
+from . import async_views
+from .views import (
+    EmergencyServiceViewSet, availability_update, geocode_address, geocode_autocomplete, geocode_cache_stats,
+    service_tiles
+)
 
 # Create router for ViewSet endpoints
 router = DefaultRouter()
@@ -11,4 +16,21 @@ router.register(r'services', EmergencyServiceViewSet, basename='service')
 urlpatterns = [
     path('', include(router.urls)), # Include all ViewSet routes
     path('geocode/', geocode_address, name='geocode'), # Geocoding endpoint
-]
\ No newline at end of file
+    path('geocode/autocomplete/', geocode_autocomplete, name='geocode-autocomplete'), # Local type-ahead
+    path('geocode/cache-stats/', geocode_cache_stats, name='geocode-cache-stats'), # Geocode cache counters
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', service_tiles, name='service-tiles'), # Vector tiles for the map
+    path('availability/', availability_update, name='availability'), # Live availability reports
+    path('availability/stream/', async_views.availability_stream, name='availability-stream'), # Server-sent events
+]
+
+# ASGI workers: the read endpoints are served by native async views, ahead of the
+# viewset routes for the same paths (see services.async_views)
+if settings.ASYNC_READ_VIEWS:
+    urlpatterns = [
+        path('services/nearest/', async_views.nearest, name='service-nearest-async'),
+        path('services/within_radius/', async_views.within_radius, name='service-within-radius-async'),
+        path('services/by_type/', async_views.by_type, name='service-by-type-async'),
+        path('services/in_bbox/', async_views.in_bbox, name='service-in-bbox-async'),
+        path('services/statistics/', async_views.statistics, name='service-statistics-async'),
+        path('geocode/', async_views.geocode_address, name='geocode-async'),
+    ] + urlpatterns
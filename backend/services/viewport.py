@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.db import connection
+
+from .models import EmergencyService
+
+SERVICE_TYPE_KEYS = [key for key, _ in EmergencyService.SERVICE_TYPES]
+
+# Services in a map viewport (GET /api/services/in_bbox/). The && operator against
+# ST_MakeEnvelope is answered from the GiST index on location, so a query only reads the
+# services in view. Up to IN_BBOX_MAX_RESULTS services come back as rows; a viewport
+# holding more is answered with grid clusters (count and mean position per cell and type)
+ENVELOPE = 'location && ST_MakeEnvelope(%(minx)s, %(miny)s, %(maxx)s, %(maxy)s, 4326)'
+
+# No ORDER BY: the rows are all returned or, past the limit, thrown away for clusters,
+# so the planner is free to walk the spatial index alone
+POINTS_SQL = f'''
+    SELECT id, name, service_type, address, phone,
+           ST_Y(location) AS latitude, ST_X(location) AS longitude, is_24_hours
+    FROM {{table}}
+    WHERE {ENVELOPE}{{type_filter}}
+    LIMIT %(limit)s
+'''
+
+# Cells are floor()ed from the origin rather than snapped to the nearest grid point, so a
+# cell never straddles the edge of a tile the map requests and no service is counted twice
+CLUSTERS_SQL = f'''
+    SELECT min(id) AS id, service_type, count(*) AS point_count,
+           avg(ST_Y(location)) AS latitude, avg(ST_X(location)) AS longitude
+    FROM {{table}}
+    WHERE {ENVELOPE}{{type_filter}}
+    GROUP BY service_type, floor(ST_X(location) / %(cell)s), floor(ST_Y(location) / %(cell)s)
+'''
+
+
+# Validate in_bbox query parameters and return (bbox, zoom, service_type)
+# bbox: (minx, miny, maxx, maxy) in degrees; zoom: int or None
+# Raises ValueError with a client-facing message on bad input
+def parse_bbox_request(params):
+    try:
+        bbox = tuple(float(value) for value in params.get('bbox', '').split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        raise ValueError('Provide bbox as minx,miny,maxx,maxy in degrees.')
+    minx, miny, maxx, maxy = bbox
+    if not (-180 <= minx < maxx <= 180 and -90 <= miny < maxy <= 90):
+        raise ValueError('bbox must have min < max, with longitudes in [-180, 180] and latitudes in [-90, 90].')
+
+    zoom = params.get('zoom')
+    if zoom not in (None, ''):
+        try:
+            zoom = int(zoom)
+        except ValueError:
+            raise ValueError('zoom must be an integer.')
+        if not 0 <= zoom <= 22:
+            raise ValueError('zoom must be between 0 and 22.')
+    else:
+        zoom = None
+
+    service_type = params.get('type') or None
+    if service_type is not None and service_type not in SERVICE_TYPE_KEYS:
+        raise ValueError('Invalid service type. Choose: hospital, police, or fire.')
+    return bbox, zoom, service_type
+
+
+# Cluster cell side in degrees: IN_BBOX_CLUSTER_GRID cells per 256 px map tile at the
+# zoom level, or per side of the viewport when no zoom is given
+def cell_size(bbox, zoom):
+    if zoom is not None:
+        return 360 / 2 ** zoom / settings.IN_BBOX_CLUSTER_GRID
+    minx, miny, maxx, maxy = bbox
+    return max(maxx - minx, maxy - miny) / settings.IN_BBOX_CLUSTER_GRID
+
+
+def _fetch(sql, params, service_type):
+    sql = sql.format(
+        table=connection.ops.quote_name(EmergencyService._meta.db_table),
+        type_filter=' AND service_type = %(service_type)s' if service_type else '',
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [column.name for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+# Services in the bbox as (rows, clusters): the rows when there are at most
+# IN_BBOX_MAX_RESULTS of them (clusters None), otherwise clusters (rows None). One row past
+# the cap is fetched to tell the two apart without counting the whole viewport
+def services_in_bbox(bbox, zoom=None, service_type=None):
+    minx, miny, maxx, maxy = bbox
+    params = {
+        'minx': minx,
+        'miny': miny,
+        'maxx': maxx,
+        'maxy': maxy,
+        'limit': settings.IN_BBOX_MAX_RESULTS + 1,
+        'cell': cell_size(bbox, zoom),
+        'service_type': service_type,
+    }
+    rows = _fetch(POINTS_SQL, params, service_type)
+    if len(rows) <= settings.IN_BBOX_MAX_RESULTS:
+        return rows, None
+    return None, _fetch(CLUSTERS_SQL, params, service_type)
+
+
+# Response body shared by the viewset action and the async view
+def bbox_payload(bbox, zoom, rows, clusters):
+    payload = {'bbox': list(bbox), 'zoom': zoom, 'clustered': clusters is not None}
+    if clusters is None:
+        payload['count'] = len(rows)
+        payload['services'] = rows
+    else:
+        payload['count'] = sum(cluster['point_count'] for cluster in clusters)
+        payload['clusters'] = clusters
+    return payload
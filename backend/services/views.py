@@ -1,24 +1,60 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
-from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.utils.urls import replace_query_param
+from django.http import HttpResponse, JsonResponse
 from django.contrib.gis.geos import Point
-from django.contrib.gis.db.models.functions import Distance
-from django.contrib.gis.measure import D
-from decouple import config
-import requests
+from django.conf import settings
 import logging
-from .models import EmergencyService
+from .models import EmergencyService, ServiceIsochrone
 from .serializers import EmergencyServiceSerializer
+from . import availability, geocoding, isochrones, metrics, routing, spatial_index, sync, tiles, viewport
+from .gazetteer import get_gazetteer
+from .statistics import get_statistics
+from .coverage import get_coverage
+from .batch import nearest_batch_database, nearest_batch_memory, parse_batch_request
+from .conditional import conditional_read
+from .expressions import GeographyDWithin
+from .pagination import KeysetPagination
+from .renderers import COLUMNAR_RENDERERS, FastJSONRenderer
+from .rows import (
+    by_type_rows, distance_values, encode_distance_rows, encode_indexed_rows, encode_travel_time_rows,
+    list_values, nearest_rows, within_radius_rows
+)
+from .streaming import STREAM_FORMATS, stream_rows
 
 logger = logging.getLogger(__name__)
 
+# nearest/within_radius/by_type also negotiate compact columnar JSON and MessagePack
+SPATIAL_RENDERERS = [FastJSONRenderer, BrowsableAPIRenderer, *COLUMNAR_RENDERERS]
+
+# ?rank= on nearest/by_type: straight-line distance (default), road travel time, or current
+# availability (accepting services first, each group nearest first)
+RANKINGS = ['distance', 'travel_time', 'availability']
+
+
+# Error response for an invalid ?rank=, or for travel_time when no road graph is loaded
+def rank_error(rank):
+    if rank not in RANKINGS:
+        return Response(
+            {'error': 'Invalid rank. Choose: distance, travel_time or availability.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if rank == 'travel_time' and routing.get_ranker() is None:
+        return Response(
+            {'error': 'Travel-time ranking is unavailable: no road graph is loaded.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    return None
+
 
 # ViewSet for EmergencyService model - handles all CRUD operations via REST API
 class EmergencyServiceViewSet(viewsets.ModelViewSet):
     queryset = EmergencyService.objects.all()
     serializer_class = EmergencyServiceSerializer
-    renderer_classes = [JSONRenderer, BrowsableAPIRenderer] # JSON and browsable API
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer] # JSON and browsable API
+    pagination_class = KeysetPagination # Keyset pages for list (?cursor= / ?page_size=)
     
     # Set template names for different actions in browsable API
     def get_template_names(self):
@@ -26,7 +62,8 @@ class EmergencyServiceViewSet(viewsets.ModelViewSet):
             return ['rest_framework/api_list.html']
         elif self.action == 'retrieve':
             return ['rest_framework/api_detail.html']
-        elif self.action in ['nearest', 'within_radius', 'by_type', 'statistics']:
+        elif self.action in ['nearest', 'nearest_batch', 'within_radius', 'by_type', 'in_bbox', 'statistics',
+                             'changes', 'isochrone', 'reachable', 'coverage']:
             return ['rest_framework/action.html']
         return ['rest_framework/api.html']
     
@@ -38,28 +75,34 @@ class EmergencyServiceViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(service_type=service_type)
         return queryset
     
+    @conditional_read
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        data = []
-        for service in queryset:
-            data.append({
-                'id': service.id,
-                'name': service.name,
-                'service_type': service.service_type,
-                'address': service.address,
-                'phone': service.phone,
-                'email': service.email,
-                'latitude': service.latitude,
-                'longitude': service.longitude,
-                'capacity': service.capacity,
-                'is_24_hours': service.is_24_hours,
-                'description': service.description
-            })
-        return Response(data)
+        rows = list_values(self.get_queryset())
+        
+        # ?stream=ndjson|geojson|json (1 = ndjson): full export from a server-side cursor
+        stream = request.query_params.get('stream')
+        if stream:
+            fmt = STREAM_FORMATS.get(stream)
+            if fmt is None:
+                return Response(
+                    {'error': 'Invalid stream format. Choose: ndjson, geojson or json.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return stream_rows(rows, fmt)
+        
+        # Keyset page of (name, id)-ordered value rows, continued with ?cursor=; plain
+        # value rows, no model instances or serializer per row
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(page)
+    
+    @conditional_read
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     # Custom action: Find nearest N services to given coordinates
     # Uses PostGIS ST_Distance function to calculate distances
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], renderer_classes=SPATIAL_RENDERERS)
+    @conditional_read
     def nearest(self, request):
         try:
             # Get parameters from query string
@@ -74,45 +117,91 @@ class EmergencyServiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create Point object from user coordinates (SRID 4326 = WGS84)
-        user_location = Point(lng, lat, srid=4326)
-        # Annotate each service with distance from user location using PostGIS Distance function
-        # Order by distance ascending and limit to N results
-        queryset = EmergencyService.objects.annotate(
-            distance=Distance('location', user_location)
-        ).order_by('distance')[:limit]
-        
-        # Filter by service type if specified
-        if service_type:
-            queryset = queryset.filter(service_type=service_type)
+        rank = request.query_params.get('rank', 'distance')
+        error = rank_error(rank)
+        if error is not None:
+            return error
+        try:
+            min_available = availability.parse_min_available(request.query_params)
+        except ValueError:
+            return Response(
+                {'error': 'min_available must be a non-negative integer.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Availability ranking and filtering pick from a larger pool of the nearest services
+        live = rank == 'availability' or min_available is not None
+        candidates = limit * settings.AVAILABILITY_CANDIDATES if live else limit
         
-        # Build response data with distance in both meters and kilometers
-        data = []
-        for service in queryset:
-            data.append({
-                'id': service.id,
-                'name': service.name,
-                'service_type': service.service_type,
-                'address': service.address,
-                'phone': service.phone,
-                'latitude': service.latitude,
-                'longitude': service.longitude,
-                'is_24_hours': service.is_24_hours,
-                'distance': {
-                    'm': float(service.distance.m),
-                    'km': round(service.distance.m / 1000, 2)
-                }
+        # Road network: one backward search from the incident meets the precomputed
+        # searches of every service, so all of them are candidates, not only the closest
+        if rank == 'travel_time':
+            service_types = {service_type} if service_type else None
+            data = encode_travel_time_rows(
+                routing.get_ranker().rank(lat, lng, service_types, max(candidates, 0))
+            )
+            if live:
+                data = availability.apply(data, limit, min_available)
+            return Response({
+                'user_location': {'lat': lat, 'lng': lng},
+                'rank': rank,
+                'count': len(data),
+                'services': data
             })
         
+        if spatial_index.is_enabled():
+            # In-memory backend: answer from the per-worker KD-tree index
+            index = spatial_index.get_index()
+            data = encode_indexed_rows(index.nearest(lat, lng, candidates, service_type))
+        else:
+            # Database backend: KNN scan of the geography index, with distance in metres and km
+            data = encode_distance_rows(nearest_rows(lat, lng, candidates, service_type))
+        if live:
+            data = availability.apply(data, limit, min_available, by_availability=rank == 'availability')
+        
         return Response({
             'user_location': {'lat': lat, 'lng': lng},
+            'rank': rank,
             'count': len(data),
             'services': data
         })
     
+    # Custom action: Nearest services of each type for many points in one request
+    # POST body: {"points": [{"lat": .., "lng": ..}, ...], "limits": {"hospital": 1, ...}}
+    # Answered with a single set-based query (or one pass over the in-memory index)
+    @action(detail=False, methods=['post'], url_path='nearest/batch')
+    def nearest_batch(self, request):
+        try:
+            points, limits = parse_batch_request(request.data)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if spatial_index.is_enabled():
+            results, details = nearest_batch_memory(points, limits)
+        else:
+            results, details = nearest_batch_database(points, limits)
+        
+        # One compact entry per point: [service id, distance in metres] pairs per type
+        # Service details are listed once in 'services' rather than repeated per point
+        return Response({
+            'count': len(points),
+            'results': [
+                {
+                    'lat': lat,
+                    'lng': lng,
+                    'nearest': {
+                        service_type: [[service_id, round(distance_m, 1)] for service_id, distance_m in matches]
+                        for service_type, matches in result.items()
+                    }
+                }
+                for (lat, lng), result in zip(points, results)
+            ],
+            'services': details
+        })
+    
     # Custom action: Find all services within specified radius
     # Uses PostGIS ST_DWithin function for efficient spatial query
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], renderer_classes=SPATIAL_RENDERERS)
+    @conditional_read
     def within_radius(self, request):
         try:
             # Get parameters from query string
@@ -127,38 +216,22 @@ class EmergencyServiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create Point object from user coordinates
-        user_location = Point(lng, lat, srid=4326)
-        # Use PostGIS ST_DWithin to find all points within radius
-        # D(km=radius) creates a distance object in kilometers
-        queryset = EmergencyService.objects.filter(
-            location__dwithin=(user_location, D(km=radius))
-        ).annotate(
-            distance=Distance('location', user_location)
-        ).order_by('distance')
-        
-        # Filter by service type if specified
-        if service_type:
-            queryset = queryset.filter(service_type=service_type)
-        
-        # Build response data
-        data = []
-        for service in queryset:
-            data.append({
-                'id': service.id,
-                'name': service.name,
-                'service_type': service.service_type,
-                'address': service.address,
-                'phone': service.phone,
-                'latitude': service.latitude,
-                'longitude': service.longitude,
-                'is_24_hours': service.is_24_hours,
-                'distance': {
-                    'm': float(service.distance.m),
-                    'km': round(service.distance.m / 1000, 2)
-                }
+        # In-memory backend: KD-tree range search with the radius converted to metres
+        if spatial_index.is_enabled():
+            index = spatial_index.get_index()
+            data = encode_indexed_rows(index.within_radius(lat, lng, radius * 1000, service_type))
+            metrics.observe_within_radius(request, len(data))
+            return Response({
+                'user_location': {'lat': lat, 'lng': lng},
+                'radius_km': radius,
+                'count': len(data),
+                'services': data
             })
         
+        # Database backend: ST_DWithin on the geography index, nearest first
+        data = encode_distance_rows(within_radius_rows(lat, lng, radius * 1000, service_type))
+        metrics.observe_within_radius(request, len(data))
+        
         return Response({
             'user_location': {'lat': lat, 'lng': lng},
             'radius_km': radius,
@@ -166,7 +239,8 @@ class EmergencyServiceViewSet(viewsets.ModelViewSet):
             'services': data
         })
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], renderer_classes=SPATIAL_RENDERERS)
+    @conditional_read
     def by_type(self, request):
         try:
             lat = float(request.query_params.get('lat'))
@@ -185,57 +259,253 @@ class EmergencyServiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        user_location = Point(lng, lat, srid=4326)
-        queryset = EmergencyService.objects.filter(
-            service_type=service_type
-        ).annotate(
-            distance=Distance('location', user_location)
-        ).order_by('distance')
+        rank = request.query_params.get('rank', 'distance')
+        error = rank_error(rank)
+        if error is not None:
+            return error
+        try:
+            min_available = availability.parse_min_available(request.query_params)
+        except ValueError:
+            return Response(
+                {'error': 'min_available must be a non-negative integer.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if rank == 'travel_time':
+            data = encode_travel_time_rows(routing.get_ranker().rank(lat, lng, {service_type}))
+        elif spatial_index.is_enabled():
+            index = spatial_index.get_index()
+            data = encode_indexed_rows(index.by_type(lat, lng, service_type))
+        else:
+            data = encode_distance_rows(by_type_rows(lat, lng, service_type))
+        if rank == 'availability' or min_available is not None:
+            data = availability.apply(data, min_available=min_available, by_availability=rank == 'availability')
+        
+        return Response({
+            'user_location': {'lat': lat, 'lng': lng},
+            'service_type': service_type,
+            'rank': rank,
+            'count': len(data),
+            'services': data
+        })
+    
+    # Custom action: Services in a map viewport (?bbox=minx,miny,maxx,maxy&zoom=)
+    # Index scan with && ST_MakeEnvelope, always on the database like the vector tiles;
+    # viewports holding more than IN_BBOX_MAX_RESULTS services get grid clusters instead
+    @action(detail=False, methods=['get'])
+    @conditional_read
+    def in_bbox(self, request):
+        try:
+            bbox, zoom, service_type = viewport.parse_bbox_request(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        data = []
-        for service in queryset:
-            data.append({
-                'id': service.id,
+        rows, clusters = viewport.services_in_bbox(bbox, zoom, service_type)
+        return Response(viewport.bbox_payload(bbox, zoom, rows, clusters))
+    
+    # Area reachable from this service within ?minutes= as a GeoJSON Feature
+    # Computed in a background process pool on first request and whenever the service moves;
+    # answers 202 until the polygon is ready
+    @action(detail=True, methods=['get'])
+    def isochrone(self, request, pk=None):
+        try:
+            minutes = int(request.query_params.get('minutes', 8))
+        except ValueError:
+            minutes = 0
+        if not 1 <= minutes <= settings.ISOCHRONE_MAX_MINUTES:
+            return Response(
+                {'error': f'minutes must be a whole number from 1 to {settings.ISOCHRONE_MAX_MINUTES}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        service = self.get_object()
+        isochrone = isochrones.get_isochrone(service, minutes)
+        if isochrone is None:
+            response = Response(
+                {'status': 'pending', 'service_id': service.id, 'minutes': minutes},
+                status=status.HTTP_202_ACCEPTED
+            )
+            response['Retry-After'] = '2'
+            return response
+        
+        return Response({
+            'type': 'Feature',
+            'geometry': isochrone['geometry'],
+            'properties': {
+                'service_id': service.id,
                 'name': service.name,
                 'service_type': service.service_type,
-                'address': service.address,
-                'phone': service.phone,
-                'latitude': service.latitude,
-                'longitude': service.longitude,
-                'is_24_hours': service.is_24_hours,
-                'distance': {
-                    'm': float(service.distance.m),
-                    'km': round(service.distance.m / 1000, 2)
-                }
-            })
+                'minutes': minutes,
+                'method': isochrone['method'],
+                'computed_at': isochrone['computed_at']
+            }
+        })
+    
+    # Services whose stored isochrone for ?minutes= contains the point ("which stations can
+    # reach this incident within N minutes"), nearest first. Only services within the
+    # farthest an isochrone can extend (isochrones.reach_m) are candidates, found on the
+    # geography index; point-in-polygon runs on the isochrone GiST index. Candidates without
+    # a current isochrone are counted as pending, not computed here: compute_isochrones and
+    # the save signal keep the polygons current
+    @action(detail=False, methods=['get'])
+    def reachable(self, request):
+        try:
+            lat = float(request.query_params.get('lat'))
+            lng = float(request.query_params.get('lng'))
+            minutes = int(request.query_params.get('minutes', 8))
+            service_type = request.query_params.get('type', None)
+        except (TypeError, ValueError) as e:
+            logger.warning(f'Invalid parameters: {e}')
+            return Response(
+                {'error': 'Invalid parameters. Provide lat, lng as numbers and minutes as a whole number.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 1 <= minutes <= settings.ISOCHRONE_MAX_MINUTES:
+            return Response(
+                {'error': f'minutes must be a whole number from 1 to {settings.ISOCHRONE_MAX_MINUTES}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        user_location = Point(lng, lat, srid=4326)
+        services = EmergencyService.objects.filter(
+            GeographyDWithin('location', user_location, isochrones.reach_m(minutes))
+        )
+        if service_type:
+            services = services.filter(service_type=service_type)
+        stored = ServiceIsochrone.objects.filter(minutes=minutes, service__in=services)
+        signatures = dict(stored.values_list('service_id', 'signature'))
+        containing = set(
+            stored.filter(polygon__intersects=user_location).values_list('service_id', flat=True)
+        )
         
+        reachable = []
+        pending = 0
+        for row in distance_values(services, user_location).order_by('distance_m'):
+            signature = isochrones.isochrone_signature(row['latitude'], row['longitude'], minutes)
+            if signatures.get(row['id']) != signature:
+                pending += 1
+            elif row['id'] in containing:
+                reachable.append(row)
+        
+        data = encode_distance_rows(reachable)
         return Response({
             'user_location': {'lat': lat, 'lng': lng},
-            'service_type': service_type,
+            'minutes': minutes,
             'count': len(data),
+            'pending': pending,
             'services': data
         })
     
+    # Coverage analysis for one type (stored by `manage.py analyse_coverage`): each service's
+    # Voronoi area with the population it serves, and the ?gaps= worst-served cells, as GeoJSON
     @action(detail=False, methods=['get'])
-    def statistics(self, request):
-        total = EmergencyService.objects.count()
-        hospitals = EmergencyService.objects.filter(service_type='hospital').count()
-        police = EmergencyService.objects.filter(service_type='police').count()
-        fire = EmergencyService.objects.filter(service_type='fire').count()
-        available_24h = EmergencyService.objects.filter(is_24_hours=True).count()
+    def coverage(self, request):
+        service_type = request.query_params.get('type')
+        if service_type not in ['hospital', 'police', 'fire']:
+            return Response(
+                {'error': 'Invalid service type. Choose: hospital, police, or fire.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            gap_limit = int(request.query_params.get('gaps', 50))
+        except ValueError:
+            return Response(
+                {'error': 'gaps must be a number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(get_coverage(service_type, gap_limit))
+    
+    # Delta sync: services changed and ids deleted since the client's cursor
+    # Clients store the returned cursor and send it back as ?since= on the next sync
+    # A full snapshot is paged on (name, id) like the list: follow 'next' until it is null.
+    # Its links carry ?snapshot=, so every page returns the cursor taken before the first
+    # one and rows changed while the client pages are sent again by the next sync
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        try:
+            since = sync.parse_cursor(request.query_params.get('since'))
+            snapshot = sync.parse_cursor(request.query_params.get('snapshot'))
+        except (ValueError, OverflowError, OSError):
+            return Response(
+                {'error': 'Invalid since cursor'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
+        changes = sync.get_changes(since)
+        if not changes['full']:
+            return Response({
+                'cursor': changes['cursor'],
+                'full': False,
+                'changed': list(list_values(changes['changed'])),
+                'deleted': changes['deleted'],
+                'next': None
+            })
+        
+        paginator = KeysetPagination()
+        rows = paginator.paginate_queryset(list_values(changes['changed']), request, view=self)
+        cursor = request.query_params['snapshot'] if snapshot else changes['cursor']
+        next_link = paginator.get_next_link()
+        if next_link:
+            next_link = replace_query_param(next_link, 'snapshot', cursor)
         return Response({
-            'total_services': total,
-            'by_type': {
-                'hospitals': hospitals,
-                'police_stations': police,
-                'fire_stations': fire
-            },
-            'available_24_hours': available_24h
+            'cursor': cursor,
+            'full': True,
+            'changed': rows,
+            'deleted': [],
+            'next': next_link
         })
+    
+    # Dashboard statistics from one aggregate query, cached per data version
+    @action(detail=False, methods=['get'])
+    @conditional_read
+    def statistics(self, request):
+        return Response(get_statistics())
+
+
+# Mapbox Vector Tile of services for the map, pre-clustered at low zooms
+# Plain Django view because the body is binary protobuf, not a DRF-rendered payload
+def service_tiles(request, z, x, y):
+    service_type = request.GET.get('type') or None
+    if service_type and service_type not in ['hospital', 'police', 'fire']:
+        return JsonResponse(
+            {'error': 'Invalid service type. Choose: hospital, police, or fire.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not tiles.is_valid_tile(z, x, y):
+        return JsonResponse({'error': 'Tile out of range.'}, status=status.HTTP_404_NOT_FOUND)
+    
+    response = HttpResponse(
+        tiles.get_tile(z, x, y, service_type),
+        content_type='application/vnd.mapbox-vector-tile'
+    )
+    response['Cache-Control'] = f'public, max-age={settings.TILE_HTTP_MAX_AGE}'
+    return response
+
+
+# Availability reports from the services themselves: one report object or {"reports": [...]}
+# with service, available, optional status (open, diverting, closed) and wait_minutes.
+# Stored in the separate ServiceAvailability table (see services.availability)
+@api_view(['POST'])
+def availability_update(request):
+    if not availability.can_publish(request):
+        return Response(
+            {'error': 'Publishing availability needs the publish token or a staff user.'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    try:
+        reports = availability.parse_reports(request.data)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    stored = set(availability.publish(reports))
+    return Response({
+        'stored': len(stored),
+        'unknown_services': [service_id for service_id, *_ in reports if service_id not in stored]
+    })
 
 
 # API endpoint to convert address/street name to coordinates (geocoding)
+# Results (including "not found") are cached; see services.geocoding
 @api_view(['GET'])
 def geocode_address(request):
     query = request.query_params.get('query', '').strip()
@@ -247,111 +517,47 @@ def geocode_address(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Get API key from environment variable (never hardcode in source code)
-    api_key = config('OPENCAGE_API_KEY', default='')
-    
-    # Try OpenCage API first if key is available
-    if api_key and api_key.strip() != '':
-        try:
-            url = "https://api.opencagedata.com/geocode/v1/json"
-            params = {
-                'q': f"{query}, Ireland",
-                'key': api_key,
-                'countrycode': 'ie',
-                'limit': 1,
-                'no_annotations': 1
-            }
-            
-            response = requests.get(url, params=params, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get('results') and len(data['results']) > 0:
-                result = data['results'][0]
-                geometry = result['geometry']
-                components = result.get('components', {})
-                formatted = result.get('formatted', query)
-                confidence = result.get('confidence', 0) / 10
-                
-                lat = geometry['lat']
-                lng = geometry['lng']
-                
-                if not (51.4 <= lat <= 55.4 and -10.5 <= lng <= -5.5):
-                    raise ValueError("Coordinates outside Ireland bounds")
-                
-                address_parts = []
-                if components.get('house_number'):
-                    address_parts.append(components['house_number'])
-                if components.get('road'):
-                    address_parts.append(components['road'])
-                if components.get('suburb'):
-                    address_parts.append(components['suburb'])
-                if components.get('city') or components.get('town'):
-                    address_parts.append(components.get('city') or components.get('town'))
-                
-                formatted_address = ', '.join(address_parts) if address_parts else formatted
-                
-                return Response({
-                    'lat': lat,
-                    'lng': lng,
-                    'formatted_address': formatted_address,
-                    'confidence': confidence,
-                    'source': 'opencage'
-                })
-                
-        except Exception as e:
-            logger.warning(f'OpenCage error, falling back to Nominatim: {e}')
-    
     try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            'q': f"{query}, Ireland",
-            'format': 'json',
-            'limit': 1,
-            'addressdetails': 1,
-            'countrycodes': 'ie'
-        }
-        headers = {'User-Agent': 'EmergencyServicesLocator/1.0'}
-        
-        response = requests.get(url, params=params, headers=headers, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data and len(data) > 0:
-            result = data[0]
-            lat = float(result['lat'])
-            lng = float(result['lon'])
-            
-            if 51.4 <= lat <= 55.4 and -10.5 <= lng <= -5.5:
-                address_parts = []
-                if result.get('address'):
-                    addr = result['address']
-                    if addr.get('house_number'):
-                        address_parts.append(addr['house_number'])
-                    if addr.get('road'):
-                        address_parts.append(addr['road'])
-                    if addr.get('suburb'):
-                        address_parts.append(addr['suburb'])
-                    if addr.get('city') or addr.get('town'):
-                        address_parts.append(addr.get('city') or addr.get('town'))
-                
-                formatted_address = ', '.join(address_parts) if address_parts else result.get('display_name', query)
-                
-                return Response({
-                    'lat': lat,
-                    'lng': lng,
-                    'formatted_address': formatted_address,
-                    'confidence': 8,
-                    'source': 'nominatim'
-                })
-    except Exception as e:
+        result = geocoding.geocode(query)
+    except geocoding.GeocodingError as e:
         logger.error(f'Geocoding failed: {e}')
         return Response(
             {'error': f'Geocoding failed: {str(e)}'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
     
-    return Response(
-        {'error': 'No results found. Please try a different address.'},
-        status=status.HTTP_404_NOT_FOUND
-    )
\ No newline at end of file
+    if result is None:
+        return Response(
+            {'error': 'No results found. Please try a different address.'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(result)
+
+
+# Type-ahead suggestions from the local gazetteer (no remote calls)
+@api_view(['GET'])
+def geocode_autocomplete(request):
+    text = request.query_params.get('q', '').strip()
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        return Response(
+            {'error': 'limit must be a number'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    results = get_gazetteer().autocomplete(text, limit) if text else []
+    return Response({
+        'query': text,
+        'count': len(results),
+        'results': results
+    })
+
+
+# Geocode cache hit/miss counters and provider circuit states for this worker process
+@api_view(['GET'])
+def geocode_cache_stats(request):
+    return Response({
+        **geocoding.geocode_cache.stats(),
+        'providers': geocoding.provider_status()
+    })
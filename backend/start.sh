@@ -48,6 +48,31 @@ python create_superuser.py || true
 echo "📁 Collecting static files..."
 python manage.py collectstatic --noinput || true
 
+# Prometheus metrics: each Gunicorn worker writes its samples to files in this directory
+# and /metrics sums them. Emptied on start so counters restart with the server
+export METRICS_ENABLED=${METRICS_ENABLED:-True}
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-metrics}
+rm -rf "${PROMETHEUS_MULTIPROC_DIR}"
+mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+
+# SERVER_INTERFACE=asgi: the same Gunicorn workers run the ASGI app through Uvicorn
+# The read endpoints switch to async views, so a worker keeps serving while slow
+# geocoding or database calls are in flight instead of blocking on each one
+if [ "${SERVER_INTERFACE:-wsgi}" = "asgi" ]; then
+  export ASYNC_READ_VIEWS=${ASYNC_READ_VIEWS:-True}
+  # Sync code runs on a new thread per request here, so persistent connections are opened
+  # per request; DATABASE_POOL=process (or pgbouncer) shares them once measured to help
+  echo "🌟 Starting Gunicorn server with Uvicorn (ASGI) workers..."
+  exec gunicorn emergency_project.asgi:application \
+      --worker-class uvicorn.workers.UvicornWorker \
+      --bind 0.0.0.0:8000 \
+      --workers 3 \
+      --timeout 120 \
+      --access-logfile - \
+      --error-logfile - \
+      --log-level info
+fi
+
 # Start Gunicorn WSGI server for production
 # Listen on all interfaces, port 8000
 # Number of worker processes
@@ -6,8 +6,13 @@ let markerCluster = null; // Marker cluster group for grouping nearby markers
 let searchLines = []; // Lines drawn from user location to services
 let searchCircle = null; // Circle showing radius search area
 let routeLayer = null; // Polyline showing route to selected service
+let vectorTileLayer = null; // Vector tile layer used when browsing all services
+let coverageLayer = null; // Coverage analysis overlay (service areas and gaps)
 let userLocation = { lat: 53.3365, lng: -6.2856 }; // Default location (Dublin city center)
+let availabilityById = new Map(); // Service id -> latest availability report from the stream
 const API_BASE = '/api'; // Base URL for API endpoints
+// Browse services through server-rendered vector tiles (only the visible area is fetched)
+const USE_VECTOR_TILES = true;
 
 // Configuration for each service type with colors and icons
 const serviceConfig = {
@@ -63,6 +68,22 @@ function initMap() {
     // Load all emergency services and statistics on page load
     loadAllServices();
     loadStatistics();
+    connectAvailability();
+}
+
+// Live availability over server-sent events: a snapshot of every report, then the changed
+// reports every poll. EventSource reconnects by itself (the server asks for 5 s) and gets a
+// fresh snapshot; a server without streams (503) ends it for good
+const AVAILABILITY_MAX_AGE_MS = 300000; // Older reports are not shown (AVAILABILITY_MAX_AGE)
+function connectAvailability() {
+    if (!window.EventSource) return;
+    const source = new EventSource(`${API_BASE}/availability/stream/`);
+    source.addEventListener('snapshot', (e) => {
+        availabilityById = new Map(JSON.parse(e.data).map(report => [report.id, report]));
+    });
+    source.addEventListener('availability', (e) => {
+        JSON.parse(e.data).forEach(report => availabilityById.set(report.id, report));
+    });
 }
 
 function updateLocationDisplay() {
@@ -72,6 +93,30 @@ function updateLocationDisplay() {
     document.getElementById('inputLng').value = userLocation.lng.toFixed(4);
 }
 
+// Fill the address datalist from the local gazetteer while the user types
+// Debounced so only the last keystroke in a burst triggers a request
+let suggestTimer = null;
+function suggestAddresses() {
+    clearTimeout(suggestTimer);
+    suggestTimer = setTimeout(async () => {
+        const input = document.getElementById('addressInput').value.trim();
+        const list = document.getElementById('addressSuggestions');
+        if (input.length < 2) {
+            list.innerHTML = '';
+            return;
+        }
+        try {
+            const response = await fetch(`${API_BASE}/geocode/autocomplete/?q=${encodeURIComponent(input)}&limit=8`);
+            const data = await response.json();
+            list.innerHTML = data.results
+                .map(result => `<option value="${result.name}${result.county && result.county !== result.name ? ', Co. ' + result.county : ''}">`)
+                .join('');
+        } catch (error) {
+            console.error('Autocomplete error:', error);
+        }
+    }, 150);
+}
+
 // Search for address and move map to that location
 async function searchAddress() {
     const input = document.getElementById('addressInput').value.trim();
@@ -270,28 +315,17 @@ function updateSearchVisuals() {
 }
 
 async function loadAllServices() {
-    try {
-        const response = await fetch(`${API_BASE}/services/`);
-        const data = await response.json();
-        displayServicesOnMap(data);
-    } catch (error) {
-        console.error('Error:', error);
-        showAlert('Failed to load services', 'error');
-    }
+    if (showVectorTiles()) return;
+    showViewport();
 }
 
 async function filterByType(type) {
     clearMarkers();
     clearSearchVisuals();
-    try {
-        const response = await fetch(`${API_BASE}/services/?type=${type}`);
-        const data = await response.json();
-        displayServicesOnMap(data);
-        showAlert(`Showing ${serviceConfig[type].label}s`, 'success');
-    } catch (error) {
-        console.error('Error:', error);
-        showAlert('Failed to filter', 'error');
+    if (!showVectorTiles(type)) {
+        showViewport(type);
     }
+    showAlert(`Showing ${serviceConfig[type].label}s`, 'success');
 }
 
 function showAllServices() {
@@ -321,16 +355,154 @@ function clearSearchVisuals() {
     clearRoute();
 }
 
+// Compact spatial responses: nearest / within radius are requested as columnar MessagePack
+// (one packed array per field) and expanded back into the usual service objects here
+const SPATIAL_FORMAT = 'application/x-msgpack';
+
+// Minimal MessagePack decoder (the subset the API emits: maps, arrays, strings, binary,
+// integers, floats, booleans and nil). Binary values are returned as ArrayBuffers
+function decodeMsgpack(buffer) {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    const text = new TextDecoder();
+    let offset = 0;
+
+    function str(length) {
+        const value = text.decode(bytes.subarray(offset, offset + length));
+        offset += length;
+        return value;
+    }
+    function bin(length) {
+        const value = buffer.slice(offset, offset + length);
+        offset += length;
+        return value;
+    }
+    function array(length) {
+        const value = new Array(length);
+        for (let i = 0; i < length; i++) value[i] = read();
+        return value;
+    }
+    function object(length) {
+        const value = {};
+        for (let i = 0; i < length; i++) {
+            const key = read();
+            value[key] = read();
+        }
+        return value;
+    }
+    function next(size, getter) {
+        const value = getter.call(view, offset);
+        offset += size;
+        return value;
+    }
+
+    function read() {
+        const type = bytes[offset++];
+        if (type <= 0x7f) return type;
+        if (type <= 0x8f) return object(type & 0x0f);
+        if (type <= 0x9f) return array(type & 0x0f);
+        if (type <= 0xbf) return str(type & 0x1f);
+        if (type >= 0xe0) return type - 0x100;
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return bin(next(1, view.getUint8));
+            case 0xc5: return bin(next(2, view.getUint16));
+            case 0xc6: return bin(next(4, view.getUint32));
+            case 0xca: return next(4, view.getFloat32);
+            case 0xcb: return next(8, view.getFloat64);
+            case 0xcc: return next(1, view.getUint8);
+            case 0xcd: return next(2, view.getUint16);
+            case 0xce: return next(4, view.getUint32);
+            case 0xcf: return Number(next(8, view.getBigUint64));
+            case 0xd0: return next(1, view.getInt8);
+            case 0xd1: return next(2, view.getInt16);
+            case 0xd2: return next(4, view.getInt32);
+            case 0xd3: return Number(next(8, view.getBigInt64));
+            case 0xd9: return str(next(1, view.getUint8));
+            case 0xda: return str(next(2, view.getUint16));
+            case 0xdb: return str(next(4, view.getUint32));
+            case 0xdc: return array(next(2, view.getUint16));
+            case 0xdd: return array(next(4, view.getUint32));
+            case 0xde: return object(next(2, view.getUint16));
+            case 0xdf: return object(next(4, view.getUint32));
+            default: throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+        }
+    }
+    return read();
+}
+
+// Rebuild service objects from columns; packed columns (ArrayBuffers, little-endian)
+// are read as typed arrays without per-number parsing
+function expandColumnar(payload) {
+    const { columns, types, scale } = payload;
+    const column = (values, TypedArray) => (values instanceof ArrayBuffer ? new TypedArray(values) : values);
+    const ids = column(columns.id, Uint32Array);
+    const codes = column(columns.type, Uint8Array);
+    const lats = column(columns.lat, Int32Array);
+    const lngs = column(columns.lng, Int32Array);
+    const distances = column(columns.distance_m, Uint32Array);
+    const open24 = column(columns.is_24_hours, Uint8Array);
+
+    const services = new Array(ids.length);
+    for (let i = 0; i < ids.length; i++) {
+        services[i] = {
+            id: ids[i],
+            name: columns.name[i],
+            service_type: types[codes[i]],
+            address: columns.address[i],
+            phone: columns.phone[i],
+            latitude: lats[i] / scale,
+            longitude: lngs[i] / scale,
+            is_24_hours: open24[i] === 1,
+            distance: { m: distances[i], km: Math.round(distances[i] / 10) / 100 }
+        };
+    }
+    // ?rank=availability / ?min_available=: available is -1 without a current report
+    if (columns.available) {
+        const available = column(columns.available, Int32Array);
+        for (let i = 0; i < ids.length; i++) {
+            services[i].availability = available[i] < 0
+                ? null
+                : { available: available[i], status: columns.availability_status[i] };
+        }
+    }
+    const result = { ...payload, services };
+    delete result.columns;
+    delete result.types;
+    delete result.scale;
+    return result;
+}
+
+// Fetch a spatial endpoint in the compact format, falling back to plain JSON when the
+// server does not offer it (406) or answers with JSON anyway
+async function fetchSpatial(url) {
+    let response = await fetch(url, { headers: { Accept: SPATIAL_FORMAT } });
+    if (response.status === 406) {
+        response = await fetch(url, { headers: { Accept: 'application/json' } });
+    }
+    const contentType = response.headers.get('Content-Type') || '';
+    if (contentType.startsWith(SPATIAL_FORMAT)) {
+        const payload = decodeMsgpack(await response.arrayBuffer());
+        return payload.columns ? expandColumnar(payload) : payload;
+    }
+    if (contentType.startsWith('application/vnd.emergency.columnar+json')) {
+        const payload = await response.json();
+        return payload.columns ? expandColumnar(payload) : payload;
+    }
+    return response.json();
+}
+
 async function findNearest() {
     const limit = document.getElementById('nearestLimit').value;
     clearMarkers();
     clearSearchVisuals();
     
     try {
-        const response = await fetch(
+        const data = await fetchSpatial(
             `${API_BASE}/services/nearest/?lat=${userLocation.lat}&lng=${userLocation.lng}&limit=${limit}`
         );
-        const data = await response.json();
         
         displayServicesOnMap(data.services, false);
         displayResults(data.services, `${data.count} Nearest Services`);
@@ -362,10 +534,9 @@ async function searchWithinRadius() {
     clearSearchVisuals();
     
     try {
-        const response = await fetch(
+        const data = await fetchSpatial(
             `${API_BASE}/services/within_radius/?lat=${userLocation.lat}&lng=${userLocation.lng}&radius=${radius}`
         );
-        const data = await response.json();
         
         displayServicesOnMap(data.services, false);
         displayResults(data.services, `Within ${radius}km`);
@@ -386,70 +557,96 @@ async function searchWithinRadius() {
     }
 }
 
-function displayServicesOnMap(services, useClustering = true) {
-    clearMarkers();
+// Build the popup HTML shown for a single service
+// Live availability line for a popup; nothing when there is no recent report
+function formatAvailability(report) {
+    if (!report) return '';
+    const age = report.updated_at ? Date.now() - Date.parse(report.updated_at) : 0;
+    if (age > AVAILABILITY_MAX_AGE_MS) return '';
+    const accepting = report.status === 'open' && report.available > 0;
+    const wait = report.wait_minutes != null ? `, ${report.wait_minutes} min wait` : '';
+    const label = report.status === 'open' ? `${report.available} available${wait}`
+        : report.status === 'diverting' ? 'Diverting' : 'Closed';
+    const updated = report.updated_at
+        ? ` <small>(${age < 60000 ? Math.max(Math.round(age / 1000), 0) + ' s' : Math.round(age / 60000) + ' min'} ago)</small>`
+        : '';
+    return `<div class="popup-item"><i class="fas fa-bed info-icon"></i><span style="color: ${accepting ? '#10B981' : '#EF4444'}; font-weight: 600;">${label}</span>${updated}</div>`;
+}
 
-    const markerBatch = [];
+function buildPopupContent(service) {
+    const config = serviceConfig[service.service_type];
+    // Escape service name for use in onclick
+    const escapedName = service.name.replace(/'/g, "\\'").replace(/"/g, '\\"');
     
-    services.forEach(service => {
-        const config = serviceConfig[service.service_type];
-        
-        const customIcon = L.divIcon({
-            html: `<div style="background: ${config.color}; color: white; border-radius: 50%; width: 44px; height: 44px; display: flex; align-items: center; justify-content: center; font-size: 20px; border: 3px solid white; box-shadow: 0 3px 12px rgba(0,0,0,0.25);">${config.icon}</div>`,
-            className: '',
-            iconSize: [44, 44],
-            iconAnchor: [22, 22]
-        });
-
-        const marker = L.marker([service.latitude, service.longitude], {
-            icon: customIcon,
-            title: service.name
-        });
-
-        // Escape service name for use in onclick
-        const escapedName = service.name.replace(/'/g, "\\'").replace(/"/g, '\\"');
-        
-        const popupContent = `
-            <div class="popup-content">
-                <div class="popup-title">${config.icon} ${service.name}</div>
-                <div class="popup-info">
-                    <div class="popup-item">
-                        <i class="fas fa-tag info-icon"></i>
-                        <span>${config.label}</span>
-                    </div>
-                    <div class="popup-item">
-                        <i class="fas fa-map-marker-alt info-icon"></i>
-                        <span>${service.address}</span>
-                    </div>
-                    <div class="popup-item">
-                        <i class="fas fa-phone info-icon"></i>
-                        <span>${service.phone || 'N/A'}</span>
-                    </div>
-                    ${service.is_24_hours ? 
-                        '<div class="popup-item"><i class="fas fa-clock info-icon"></i><span style="color: #10B981; font-weight: 600;">Open 24 Hours</span></div>' : 
-                        '<div class="popup-item"><i class="fas fa-clock info-icon"></i><span style="color: #F59E0B; font-weight: 600;">Limited Hours</span></div>'}
-                    ${service.distance ? `<div class="popup-item"><i class="fas fa-route info-icon"></i><span><b>${service.distance.km} km</b> away (as crow flies)</span></div>` : ''}
+    const popupContent = `
+        <div class="popup-content">
+            <div class="popup-title">${config.icon} ${service.name}</div>
+            <div class="popup-info">
+                <div class="popup-item">
+                    <i class="fas fa-tag info-icon"></i>
+                    <span>${config.label}</span>
+                </div>
+                <div class="popup-item">
+                    <i class="fas fa-map-marker-alt info-icon"></i>
+                    <span>${service.address}</span>
                 </div>
-                <div style="margin-top: 12px; padding-top: 12px; border-top: 1px solid #EBEBEB;">
-                    <button onclick="getRouteToService(${service.latitude}, ${service.longitude}, '${escapedName}')" 
-                            class="btn-route" 
-                            style="width: 100%; padding: 10px; background: linear-gradient(135deg, ${config.color} 0%, ${config.color}dd 100%); color: white; border: none; border-radius: 8px; font-weight: 600; cursor: pointer; font-size: 0.875rem; transition: all 0.2s ease;">
-                        <i class="fas fa-directions"></i> Get Directions
-                    </button>
+                <div class="popup-item">
+                    <i class="fas fa-phone info-icon"></i>
+                    <span>${service.phone || 'N/A'}</span>
                 </div>
+                ${service.is_24_hours ? 
+                    '<div class="popup-item"><i class="fas fa-clock info-icon"></i><span style="color: #10B981; font-weight: 600;">Open 24 Hours</span></div>' : 
+                    '<div class="popup-item"><i class="fas fa-clock info-icon"></i><span style="color: #F59E0B; font-weight: 600;">Limited Hours</span></div>'}
+                ${formatAvailability(service.availability !== undefined ? service.availability : availabilityById.get(service.id))}
+                ${service.distance ? `<div class="popup-item"><i class="fas fa-route info-icon"></i><span><b>${service.distance.km} km</b> away (as crow flies)</span></div>` : ''}
             </div>
-        `;
+            <div style="margin-top: 12px; padding-top: 12px; border-top: 1px solid #EBEBEB;">
+                <button onclick="getRouteToService(${service.latitude}, ${service.longitude}, '${escapedName}')" 
+                        class="btn-route" 
+                        style="width: 100%; padding: 10px; background: linear-gradient(135deg, ${config.color} 0%, ${config.color}dd 100%); color: white; border: none; border-radius: 8px; font-weight: 600; cursor: pointer; font-size: 0.875rem; transition: all 0.2s ease;">
+                    <i class="fas fa-directions"></i> Get Directions
+                </button>
+            </div>
+        </div>
+    `;
+    return popupContent;
+}
 
-        marker.bindPopup(popupContent, {
-            maxWidth: 300,
-            className: 'custom-popup'
-        });
-        
-        marker.on('click', function() {
-            map.setView([service.latitude, service.longitude], 16);
-        });
-        
-        markerBatch.push(marker);
+function createServiceMarker(service) {
+    const config = serviceConfig[service.service_type];
+    
+    const customIcon = L.divIcon({
+        html: `<div style="background: ${config.color}; color: white; border-radius: 50%; width: 44px; height: 44px; display: flex; align-items: center; justify-content: center; font-size: 20px; border: 3px solid white; box-shadow: 0 3px 12px rgba(0,0,0,0.25);">${config.icon}</div>`,
+        className: '',
+        iconSize: [44, 44],
+        iconAnchor: [22, 22]
+    });
+
+    const marker = L.marker([service.latitude, service.longitude], {
+        icon: customIcon,
+        title: service.name
+    });
+
+    // Built when opened, so the popup shows the latest availability
+    marker.bindPopup(() => buildPopupContent(service), {
+        maxWidth: 300,
+        className: 'custom-popup'
+    });
+    
+    marker.on('click', function() {
+        map.setView([service.latitude, service.longitude], 16);
+    });
+    
+    return marker;
+}
+
+function displayServicesOnMap(services, useClustering = true) {
+    clearMarkers();
+
+    const markerBatch = [];
+    
+    services.forEach(service => {
+        markerBatch.push(createServiceMarker(service));
     });
 
     if (useClustering) {
@@ -608,7 +805,307 @@ async function loadStatistics() {
     }
 }
 
+// Show services as vector tiles, clustered by the server at low zooms
+// Returns false when tiles are disabled or the VectorGrid plugin failed to load
+function showVectorTiles(type = null) {
+    if (!USE_VECTOR_TILES || !L.vectorGrid) return false;
+    clearMarkers();
+
+    const query = type ? `?type=${type}` : '';
+    vectorTileLayer = L.vectorGrid.protobuf(`${API_BASE}/tiles/{z}/{x}/{y}.mvt${query}`, {
+        rendererFactory: L.canvas.tile,
+        interactive: true,
+        maxNativeZoom: 18,
+        getFeatureId: (feature) => `${feature.properties.service_type}-${feature.properties.id}`,
+        vectorTileLayerStyles: {
+            services: (properties) => {
+                const color = serviceConfig[properties.service_type].color;
+                const count = properties.point_count || 1;
+                return {
+                    // Clusters grow with the number of services they contain
+                    radius: count > 1 ? Math.min(10 + 4 * Math.log2(count), 28) : 9,
+                    fill: true,
+                    fillColor: color,
+                    fillOpacity: count > 1 ? 0.75 : 1,
+                    color: 'white',
+                    weight: 3
+                };
+            }
+        }
+    });
+
+    vectorTileLayer.on('click', async (e) => {
+        const properties = e.layer.properties;
+        // Clicking a cluster zooms in; clicking a single service opens its popup
+        if ((properties.point_count || 1) > 1) {
+            map.setView(e.latlng, Math.min(map.getZoom() + 2, 18));
+            return;
+        }
+        openServicePopup(properties.id);
+    });
+
+    vectorTileLayer.addTo(map);
+    return true;
+}
+
+// Popup for a service known only by its id (vector tile features, viewport clusters)
+async function openServicePopup(id) {
+    try {
+        const response = await fetch(`${API_BASE}/services/${id}/`);
+        const feature = await response.json();
+        const service = { id: feature.id, ...feature.properties };
+        L.popup({ maxWidth: 300, className: 'custom-popup' })
+            .setLatLng([service.latitude, service.longitude])
+            .setContent(buildPopupContent(service))
+            .openOn(map);
+    } catch (error) {
+        console.error('Error:', error);
+        showAlert('Failed to load service details', 'error');
+    }
+}
+
+// Without vector tiles, services are loaded for the viewport from /services/in_bbox/.
+// The map is cut into fixed square tiles of 360 / 2^zoom degrees, the same grid the server
+// clusters on, and each tile is requested once: panning only fetches the tiles newly in
+// view. Requests wait until the map has stopped moving for VIEWPORT_DEBOUNCE_MS
+const VIEWPORT_DEBOUNCE_MS = 250;
+const VIEWPORT_CACHE_MS = 60000; // Keep a fetched tile this long
+const VIEWPORT_CACHE_TILES = 512; // Oldest tiles are dropped past this many
+const VIEWPORT_MAX_ZOOM = 18;
+const SERVICE_LIST_PAGE_SIZE = 1000; // Largest page the list endpoint serves (KEYSET_MAX_PAGE_SIZE)
+let viewportType = null; // Service type filter of the viewport layer, null for all
+let viewportLayers = new Map(); // Tile key -> layer group of the tiles shown (null while loading)
+let viewportZoom = null;
+let viewportTimer = null;
+const viewportCache = new Map(); // Tile key -> { time, request } (a promise of the response)
+
+function showViewport(type = null) {
+    clearMarkers();
+    viewportType = type;
+    viewportZoom = null;
+    map.on('moveend', scheduleViewportLoad);
+    loadViewport();
+}
+
+function hideViewport() {
+    map.off('moveend', scheduleViewportLoad);
+    clearTimeout(viewportTimer);
+    viewportLayers.forEach(layer => layer && map.removeLayer(layer));
+    viewportLayers = new Map();
+}
+
+function scheduleViewportLoad() {
+    clearTimeout(viewportTimer);
+    viewportTimer = setTimeout(loadViewport, VIEWPORT_DEBOUNCE_MS);
+}
+
+// Keys of the tiles covering the current view at zoom z: `${type}/${z}/${x}/${y}`
+function viewportTileKeys(z) {
+    const size = 360 / 2 ** z;
+    const bounds = map.getBounds();
+    const clamp = (value, min, max) => Math.min(Math.max(value, min), max);
+    const minX = Math.floor((clamp(bounds.getWest(), -180, 180) + 180) / size);
+    const maxX = Math.min(Math.floor((clamp(bounds.getEast(), -180, 180) + 180) / size), 2 ** z - 1);
+    const minY = Math.floor((clamp(bounds.getSouth(), -90, 90) + 90) / size);
+    const maxY = Math.min(Math.floor((clamp(bounds.getNorth(), -90, 90) + 90) / size), 2 ** (z - 1) - 1);
+    const keys = [];
+    for (let x = minX; x <= maxX; x++) {
+        for (let y = minY; y <= maxY; y++) {
+            keys.push(`${viewportType || 'all'}/${z}/${x}/${y}`);
+        }
+    }
+    return keys;
+}
+
+// Response for one tile from the cache, or a new request; failed requests are not cached
+function fetchViewportTile(key) {
+    const cached = viewportCache.get(key);
+    if (cached && Date.now() - cached.time < VIEWPORT_CACHE_MS) return cached.request;
+
+    const [type, z, x, y] = key.split('/');
+    const size = 360 / 2 ** z;
+    const bbox = [x * size - 180, y * size - 90, (+x + 1) * size - 180, (+y + 1) * size - 90].join(',');
+    const query = type === 'all' ? '' : `&type=${type}`;
+    const request = fetch(`${API_BASE}/services/in_bbox/?bbox=${bbox}&zoom=${z}${query}`).then(response => {
+        if (!response.ok) throw new Error(`in_bbox answered ${response.status}`);
+        return response.json();
+    });
+    request.catch(() => viewportCache.delete(key));
+
+    viewportCache.delete(key);
+    viewportCache.set(key, { time: Date.now(), request });
+    if (viewportCache.size > VIEWPORT_CACHE_TILES) {
+        viewportCache.delete(viewportCache.keys().next().value);
+    }
+    return request;
+}
+
+async function loadViewport() {
+    const z = Math.max(1, Math.min(Math.round(map.getZoom()), VIEWPORT_MAX_ZOOM));
+    // Clusters depend on the zoom, so a zoom change replaces every tile
+    if (z !== viewportZoom) {
+        viewportLayers.forEach(layer => layer && map.removeLayer(layer));
+        viewportLayers = new Map();
+        viewportZoom = z;
+    }
+    const keys = viewportTileKeys(z);
+    const visible = new Set(keys);
+    viewportLayers.forEach((layer, key) => {
+        if (!visible.has(key)) {
+            if (layer) map.removeLayer(layer);
+            viewportLayers.delete(key);
+        }
+    });
+
+    const layers = viewportLayers;
+    await Promise.all(keys.filter(key => !layers.has(key)).map(async (key) => {
+        layers.set(key, null);
+        try {
+            const data = await fetchViewportTile(key);
+            // Dropped while loading: the view moved on or the layer was replaced
+            if (viewportLayers !== layers || !layers.has(key)) return;
+            const tileLayers = data.clustered
+                ? data.clusters.map(createClusterMarker)
+                : data.services.map(createServiceMarker);
+            layers.set(key, L.layerGroup(tileLayers).addTo(map));
+        } catch (error) {
+            layers.delete(key);
+            console.error('Error:', error);
+            if (!navigator.onLine) {
+                showOfflineServices();
+                return;
+            }
+            showAlert('Failed to load services for this area', 'error');
+        }
+    }));
+}
+
+// Every service of a type (null = all) from the keyset-paged list, following `next`
+// Offline, the service worker answers the first page with its whole local replica
+async function fetchServiceList(type = null) {
+    const query = type ? `&type=${type}` : '';
+    let url = `${API_BASE}/services/?page_size=${SERVICE_LIST_PAGE_SIZE}${query}`;
+    const services = [];
+    while (url) {
+        const response = await fetch(url);
+        if (!response.ok) throw new Error(`Service list answered ${response.status}`);
+        const page = await response.json();
+        services.push(...page.results);
+        url = page.next;
+    }
+    return services;
+}
+
+// Offline, in_bbox tiles fail: show the services stored by the service worker instead
+let offlineLoad = null;
+function showOfflineServices() {
+    if (offlineLoad) return;
+    offlineLoad = fetchServiceList(viewportType)
+        .then(services => {
+            displayServicesOnMap(services);
+            showAlert('Offline: showing saved services', 'info');
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            showAlert('Failed to load services', 'error');
+        })
+        .finally(() => { offlineLoad = null; });
+}
+
+// Server-side cluster: sized like the vector tile clusters; clicking zooms in, or opens
+// the popup when the cluster is a single service
+function createClusterMarker(cluster) {
+    const count = cluster.point_count;
+    const marker = L.circleMarker([cluster.latitude, cluster.longitude], {
+        radius: count > 1 ? Math.min(10 + 4 * Math.log2(count), 28) : 9,
+        fillColor: serviceConfig[cluster.service_type].color,
+        fillOpacity: count > 1 ? 0.75 : 1,
+        color: 'white',
+        weight: 3
+    });
+    if (count > 1) marker.bindTooltip(`${count} ${serviceConfig[cluster.service_type].label.toLowerCase()}s`);
+    marker.on('click', (e) => {
+        if (count > 1) {
+            map.setView(e.latlng, Math.min(map.getZoom() + 2, VIEWPORT_MAX_ZOOM));
+        } else {
+            openServicePopup(cluster.id);
+        }
+    });
+    return marker;
+}
+
+// Overlay the stored coverage analysis for a type: service areas shaded by the population
+// they serve, and the worst-served population cells as red circles
+async function showCoverage(type) {
+    try {
+        const response = await fetch(`${API_BASE}/services/coverage/?type=${type}&gaps=100`);
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || 'Request failed');
+        clearCoverage();
+        if (!data.areas.features.length) {
+            showAlert(`No coverage analysis for ${serviceConfig[type].label.toLowerCase()}s yet`, 'info');
+            return;
+        }
+
+        const color = serviceConfig[type].color;
+        const busiest = Math.max(...data.areas.features.map(feature => feature.properties.population), 1);
+        const areas = L.geoJSON(data.areas, {
+            style: (feature) => ({
+                color: color,
+                weight: 1,
+                fillColor: color,
+                fillOpacity: 0.1 + 0.5 * feature.properties.population / busiest
+            }),
+            onEachFeature: (feature, layer) => {
+                const p = feature.properties;
+                layer.bindPopup(`
+                    <strong>${p.name}</strong><br>
+                    Serves ${Math.round(p.population).toLocaleString()} people<br>
+                    Mean distance ${((p.mean_distance_m || 0) / 1000).toFixed(1)} km,
+                    farthest ${((p.max_distance_m || 0) / 1000).toFixed(1)} km
+                `);
+            }
+        });
+        const gaps = L.geoJSON(data.gaps, {
+            pointToLayer: (feature, latlng) => L.circleMarker(latlng, {
+                radius: 6,
+                color: '#B91C1C',
+                fillColor: '#EF4444',
+                fillOpacity: 0.8,
+                weight: 1
+            }).bindPopup(`
+                ${Math.round(feature.properties.population).toLocaleString()} people<br>
+                ${(feature.properties.distance_m / 1000).toFixed(1)} km from the nearest ${serviceConfig[type].label.toLowerCase()}
+            `)
+        });
+        coverageLayer = L.layerGroup([areas, gaps]).addTo(map);
+        map.fitBounds(areas.getBounds());
+
+        const summary = data.summary;
+        showAlert(
+            `${serviceConfig[type].label}s: mean ${((summary.mean_distance_m || 0) / 1000).toFixed(1)} km, ` +
+            `max ${((summary.max_distance_m || 0) / 1000).toFixed(1)} km`,
+            'success'
+        );
+    } catch (error) {
+        console.error('Error:', error);
+        showAlert('Failed to load coverage analysis', 'error');
+    }
+}
+
+function clearCoverage() {
+    if (coverageLayer) {
+        map.removeLayer(coverageLayer);
+        coverageLayer = null;
+    }
+}
+
 function clearMarkers() {
+    if (vectorTileLayer) {
+        map.removeLayer(vectorTileLayer);
+        vectorTileLayer = null;
+    }
+    hideViewport();
     markerCluster.clearLayers();
     markers.forEach(marker => map.removeLayer(marker));
     markers = [];
@@ -5,6 +5,8 @@
 const CACHE_NAME = 'emergency-services-locator-v1';
 const STATIC_CACHE = 'emergency-static-v1'; // Cache for static assets (CSS, JS, images)
 const DYNAMIC_CACHE = 'emergency-dynamic-v1'; // Cache for API responses and dynamic content
+const REPLICA_CACHE = 'emergency-replica-v1'; // Local replica of all services kept by delta sync
+const REPLICA_KEY = '/__replica__/services'; // Cache entry holding the replica JSON
 
 // List of static assets to cache when service worker installs
 // These files are cached immediately for offline access
@@ -57,7 +59,7 @@ self.addEventListener('activate', (event) => {
             return Promise.all(
                 cacheNames.map((cacheName) => {
                     // Delete old caches that don't match current version
-                    if (cacheName !== STATIC_CACHE && cacheName !== DYNAMIC_CACHE) {
+                    if (cacheName !== STATIC_CACHE && cacheName !== DYNAMIC_CACHE && cacheName !== REPLICA_CACHE) {
                         console.log('[Service Worker] Deleting old cache:', cacheName);
                         return caches.delete(cacheName);
                     }
@@ -69,6 +71,80 @@ self.addEventListener('activate', (event) => {
     return self.clients.claim();
 });
 
+// Read the stored replica: { cursor, services: { id: service } }, or null if none yet
+async function readReplica() {
+    const cache = await caches.open(REPLICA_CACHE);
+    const response = await cache.match(REPLICA_KEY);
+    return response ? response.json() : null;
+}
+
+async function writeReplica(replica) {
+    const cache = await caches.open(REPLICA_CACHE);
+    await cache.put(REPLICA_KEY, new Response(JSON.stringify(replica), {
+        headers: { 'Content-Type': 'application/json' }
+    }));
+}
+
+// Delta sync: fetch only services changed/deleted since the stored cursor and merge them
+// The server answers with full=true (whole dataset) on first sync or if the cursor is too old,
+// in pages linked by 'next'; the replica is only replaced once every page has arrived
+let replicaSync = null;
+function syncReplica() {
+    // Concurrent list requests share one in-flight sync
+    if (!replicaSync) {
+        replicaSync = (async () => {
+            const replica = await readReplica();
+            const since = replica ? `&since=${encodeURIComponent(replica.cursor)}` : '';
+            let url = `/api/services/changes/?page_size=1000${since}`;
+            let services = null;
+            let changes;
+            while (url) {
+                const response = await fetch(url);
+                if (!response.ok) {
+                    throw new Error(`Delta sync failed with status ${response.status}`);
+                }
+                changes = await response.json();
+                if (!services) {
+                    services = changes.full || !replica ? {} : replica.services;
+                }
+                changes.changed.forEach((service) => { services[service.id] = service; });
+                changes.deleted.forEach((id) => { delete services[id]; });
+                url = changes.next;
+            }
+            const updated = { cursor: changes.cursor, services };
+            await writeReplica(updated);
+            return updated;
+        })().finally(() => { replicaSync = null; });
+    }
+    return replicaSync;
+}
+
+// Answer GET /api/services/ (optionally ?type=) from the replica, in the API's name order,
+// as a single last page of the API's keyset pagination
+function replicaResponse(replica, serviceType) {
+    const services = Object.values(replica.services)
+        .filter((service) => !serviceType || service.service_type === serviceType)
+        .sort((a, b) => a.name.localeCompare(b.name));
+    return new Response(JSON.stringify({ next: null, cursor: null, results: services }), {
+        headers: { 'Content-Type': 'application/json' }
+    });
+}
+
+// Sync then serve from the replica; offline, serve the last synced replica as-is
+async function serviceListFromReplica(request, url) {
+    const serviceType = url.searchParams.get('type');
+    try {
+        return replicaResponse(await syncReplica(), serviceType);
+    } catch (err) {
+        console.log('[Service Worker] Delta sync failed, using stored replica:', err);
+        const replica = await readReplica();
+        if (replica) {
+            return replicaResponse(replica, serviceType);
+        }
+        return fetch(request);
+    }
+}
+
 // Fetch event - intercepts all network requests
 // Implements caching strategies for offline support
 self.addEventListener('fetch', (event) => {
@@ -81,8 +157,17 @@ self.addEventListener('fetch', (event) => {
         return;
     }
 
+    // Availability event stream: never cached (caching would read the endless body)
+    if (url.pathname === '/api/availability/stream/') {
+        return;
+    }
+
     // Different caching strategies for different types of requests
-    if (request.url.includes('/api/')) {
+    if (request.method === 'GET' && url.pathname === '/api/services/'
+            && [...url.searchParams.keys()].every((key) => key === 'type' || key === 'page_size')) {
+        // First page of the service list: the whole list from the delta-synced local replica
+        event.respondWith(serviceListFromReplica(request, url));
+    } else if (request.url.includes('/api/')) {
         // Network First strategy for API calls
         // Try network first, fallback to cache if offline
         event.respondWith(
@@ -154,14 +239,11 @@ self.addEventListener('fetch', (event) => {
 });
 
 // Background sync event
-// Allows syncing data when connection is restored (future feature)
+// Allows syncing data when connection is restored
 self.addEventListener('sync', (event) => {
     if (event.tag === 'sync-services') {
-        event.waitUntil(
-            // Sync logic would go here
-            // Example: sync user actions performed while offline
-            console.log('[Service Worker] Background sync triggered')
-        );
+        // Bring the local services replica up to date once back online
+        event.waitUntil(syncReplica());
     }
 });
 